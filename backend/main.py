@@ -1,15 +1,19 @@
-from fastapi import FastAPI, Query, UploadFile, File, HTTPException
+from fastapi import FastAPI, Query, UploadFile, File, HTTPException, Response, Request
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from datetime import date
 from .services.gmail_service import gmail_service
+from .services.gmail_account_service import gmail_account_service
 from .services.storage_service import storage_service
 from .services.settings_service import settings_service
-from .models import ScanResult, InvoiceData, Rule
-from typing import List
+from .services.scan_job_service import scan_job_service, run_scan
+from .services.attachment_store import attachment_store
+from .models import ScanResult, ScanJobRequest, ScanJobInfo, InvoiceData, InvoiceQuery, Rule, GmailAccount
+from typing import List, Optional
 from pydantic import BaseModel
 import os
-import shutil
 import uuid
 import time
 
@@ -18,7 +22,6 @@ app.mount("/files", StaticFiles(directory="backend/static/invoices"), name="file
 
 # Ensure static directory exists
 os.makedirs("backend/static/invoices", exist_ok=True)
-import shutil
 from fastapi import UploadFile, File
 
 # --- Auth Endpoints ---
@@ -56,6 +59,35 @@ def get_profile():
     except Exception as e:
         return {"email": None}
 
+# --- Gmail Accounts ---
+# More mailboxes next to the one signed in through /auth/login; scans cover all of them.
+
+@app.get("/accounts", response_model=List[GmailAccount])
+def list_accounts():
+    """Signed-in Gmail accounts, the primary one first."""
+    return gmail_account_service.accounts()
+
+@app.post("/accounts", response_model=GmailAccount)
+def add_account():
+    """Signs in another Gmail account (opens the consent screen)."""
+    try:
+        return {"email": gmail_account_service.add(), "primary": False}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.delete("/accounts/{email}")
+def remove_account(email: str):
+    """Signs the account out. Its invoices stay in history."""
+    if not gmail_account_service.remove(email):
+        raise HTTPException(status_code=404, detail="Account not found")
+    return {"status": "success"}
+
+def _check_accounts(accounts: Optional[List[str]]):
+    try:
+        gmail_account_service.services(accounts)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 # ----------------------
 
 # Ensure static dir exists
@@ -70,66 +102,200 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Total-Count", "X-Next-Cursor", "ETag"],
 )
 
 @app.get("/scan", response_model=ScanResult)
-def scan_emails(start_date: date, end_date: date):
+def scan_emails(start_date: date, end_date: date, incremental: bool = False, refresh: bool = False,
+                accounts: Optional[List[str]] = Query(None)):
     """
     Scans emails for invoices in the given date range.
     Uses REAL Gmail API.
     Saves found invoices to History (Storage).
     Returns merged results (if invoice already exists in history, use that version).
+    With `incremental=true`, only mail added since the last sync is scanned; the date
+    range is used when there is no sync point yet or it has expired.
+    Emails already in history (or deleted by rules before) are not downloaded again,
+    unless `refresh=true`.
+    Every signed-in account is scanned, concurrently, unless `accounts` names some.
     """
-    # 1. Scan
-    scan_result = gmail_service.scan_invoices(start_date, end_date)
-    
-    # 2. Merge with History
-    # If an invoice from scan already exists in DB, we prefer the DB version 
-    # (because it might have manual edits or Status updates)
-    final_invoices = []
-    
-    # We also want to SAVE new ones to DB immediately? 
-    # Yes, so they appear in history.
-    
-    from .services.rule_service import rule_service # Import here to avoid circular
-    
-    for fresh_inv in scan_result.invoices:
-        existing = storage_service.get_by_id(fresh_inv.id)
-        if existing:
-            # Use existing (it has the correct status and potentially manual edits)
-            # BUT: If we downloaded a PDF now and existing didn't have URL? 
-            # We might want to backfill the URL.
-            if fresh_inv.download_url and not existing.download_url:
-                storage_service.update_invoice(existing.id, {"download_url": fresh_inv.download_url})
-                existing.download_url = fresh_inv.download_url
-            
-            # Check if it should be deleted by rules (even if existing)
-            should_del = rule_service.should_delete(existing)
-            
-            if should_del:
-                storage_service.delete_invoice(existing.id)
-                # Do not add to final_invoices
-            else:
-                final_invoices.append(existing)
-        else:
-            # NEW Invoice found! Apply rules here.
-            processed_inv = rule_service.apply_rules(fresh_inv)
-            
-            if processed_inv:
-                # Save new
-                storage_service.save_invoice(processed_inv)
-                final_invoices.append(processed_inv)
-            
-    return ScanResult(
-        total_emails_scanned=scan_result.total_emails_scanned,
-        invoices_found=len(final_invoices),
-        invoices=final_invoices
-    )
+    _check_accounts(accounts)
+    return run_scan(start_date, end_date, incremental=incremental, refresh=refresh, accounts=accounts)
+
+# --- Background Scan Jobs ---
+# A scan as a job: POST starts it and returns at once, progress streams as server-sent
+# events, and invoices are saved while it runs, so a cancelled job keeps its work.
+
+# Seconds between progress events of one stream, and between keep-alives when idle
+SCAN_EVENT_INTERVAL = 0.25
+SCAN_KEEPALIVE_SECONDS = 15
+
+def _get_job_or_404(job_id: str):
+    job = scan_job_service.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Scan job not found")
+    return job
+
+@app.post("/scan/jobs", response_model=ScanJobInfo, status_code=202)
+def start_scan_job(request: ScanJobRequest):
+    """Starts a scan in the background; follow it with /scan/jobs/{id}/events."""
+    _check_accounts(request.accounts)
+    job = scan_job_service.start(request.start_date, request.end_date, request.incremental, request.refresh, request.accounts)
+    return job.info()
+
+@app.get("/scan/jobs", response_model=List[ScanJobInfo])
+def list_scan_jobs():
+    """Recent scan jobs, newest first."""
+    return [job.info() for job in scan_job_service.list_jobs()]
+
+@app.get("/scan/jobs/{job_id}", response_model=ScanJobInfo)
+def get_scan_job(job_id: str):
+    return _get_job_or_404(job_id).info()
+
+@app.get("/scan/jobs/{job_id}/result", response_model=ScanResult)
+def get_scan_job_result(job_id: str):
+    """The job's invoices, like /scan returns them. Available once the job is done or cancelled."""
+    job = _get_job_or_404(job_id)
+    if not job.result:
+        raise HTTPException(status_code=409, detail=f"Scan job is {job.status}")
+    return job.result
+
+@app.post("/scan/jobs/{job_id}/cancel", response_model=ScanJobInfo)
+def cancel_scan_job(job_id: str):
+    """Stops the job. Invoices saved so far stay in history."""
+    _get_job_or_404(job_id)
+    return scan_job_service.cancel(job_id).info()
+
+@app.get("/scan/jobs/{job_id}/events")
+def scan_job_events(job_id: str):
+    """
+    Server-sent events with the job's progress: "progress" events while it runs, then one
+    "done", "cancelled" or "failed" event and the stream ends. Every event carries the job info.
+    """
+    job = _get_job_or_404(job_id)
+
+    def events():
+        version = -1
+        while True:
+            seen = job.wait_for_change(version, SCAN_KEEPALIVE_SECONDS)
+            if seen == version:
+                yield ": keep-alive\n\n"
+                continue
+            version = seen
+            info = job.info()
+            event = info.status if job.finished else "progress"
+            yield f"id: {version}\nevent: {event}\ndata: {info.model_dump_json()}\n\n"
+            if job.finished:
+                break
+            # Counters change per message; one event per interval is plenty for a progress bar
+            time.sleep(SCAN_EVENT_INTERVAL)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# --- Conditional GET ---
+# Polled endpoints send an ETag built from the backing store's revision, so an
+# unchanged store is answered with 304 before any data is loaded.
+
+def _etag_headers(etag: str) -> dict:
+    # no-cache: browsers keep the body but revalidate with If-None-Match every time
+    return {"ETag": etag, "Cache-Control": "no-cache"}
+
+def _opaque_tag(tag: str) -> str:
+    # str.removeprefix is Python 3.9+
+    return tag[2:] if tag.startswith("W/") else tag
+
+def _not_modified(request: Request, etag: str) -> Optional[Response]:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return None
+    # Weak comparison (RFC 9110): ignore W/ prefixes
+    candidates = [_opaque_tag(tag.strip()) for tag in if_none_match.split(",")]
+    if "*" in candidates or _opaque_tag(etag) in candidates:
+        return Response(status_code=304, headers=_etag_headers(etag))
+    return None
+
+NDJSON_CHUNK_SIZE = 200
+
+def _ndjson_lines(invoices):
+    """Serializes invoices one per line (pydantic-core JSON), flushing in small chunks."""
+    chunk = []
+    for inv in invoices:
+        chunk.append(inv.model_dump_json())
+        if len(chunk) >= NDJSON_CHUNK_SIZE:
+            yield "\n".join(chunk) + "\n"
+            chunk = []
+    if chunk:
+        yield "\n".join(chunk) + "\n"
 
 @app.get("/invoices", response_model=List[InvoiceData])
-def get_invoices():
-    """Returns all saved invoices from history"""
-    return storage_service.get_all()
+def get_invoices(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    sort: str = Query("id", pattern="^(id|date|amount|vendor)$"),
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+    status: Optional[str] = None,
+    label: Optional[str] = None,
+    account: Optional[str] = None,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    min_amount: Optional[float] = None,
+    max_amount: Optional[float] = None,
+    q: Optional[str] = None,
+    stream: bool = False,
+):
+    """
+    Returns saved invoices from history.
+    Without `limit` this is the whole (filtered) history, newest first.
+    With `limit` it is one page: pass the `X-Next-Cursor` response header back
+    as `cursor` to get the next one. `X-Total-Count` is the number of matches.
+    With `stream=1` or `Accept: application/x-ndjson` the invoices are streamed
+    as newline-delimited JSON instead of one JSON array.
+    """
+    streaming = stream or "application/x-ndjson" in request.headers.get("accept", "")
+    # The NDJSON and JSON forms of the same URL are different representations
+    etag = storage_service.revision.etag("invoices-ndjson" if streaming else "invoices")
+    not_modified = _not_modified(request, etag)
+    if not_modified:
+        return not_modified
+
+    query = InvoiceQuery(
+        status=status, label=label, account=account,
+        start_date=start_date, end_date=end_date,
+        min_amount=min_amount, max_amount=max_amount,
+        text=q, sort=sort, order=order, limit=limit, cursor=cursor,
+    )
+    if streaming:
+        try:
+            total, next_cursor, invoices = storage_service.stream(query)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        headers = {"X-Total-Count": str(total), "Vary": "Accept", **_etag_headers(etag)}
+        if next_cursor:
+            headers["X-Next-Cursor"] = next_cursor
+        # The background task runs after the body is sent or the client went away: it releases
+        # the listing's database connection even if streaming never started
+        return StreamingResponse(_ndjson_lines(invoices), media_type="application/x-ndjson", headers=headers,
+                                 background=BackgroundTask(invoices.close))
+
+    try:
+        page = storage_service.query(query)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    response.headers.update(_etag_headers(etag))
+    response.headers["Vary"] = "Accept"
+    response.headers["X-Total-Count"] = str(page.total)
+    if page.next_cursor:
+        response.headers["X-Next-Cursor"] = page.next_cursor
+    return page.items
+
+@app.get("/invoices/search", response_model=List[InvoiceData])
+def search_invoices(q: str, limit: int = Query(50, ge=1, le=500)):
+    """Full-text search (Hebrew & English, prefix matching) over subject, vendor, sender and comments."""
+    return storage_service.search(q, limit)
 
 @app.put("/invoices/{invoice_id}", response_model=InvoiceData)
 def update_invoice(invoice_id: str, invoice: InvoiceData):
@@ -155,7 +321,12 @@ def delete_invoice(invoice_id: str):
 # --- Label Management ---
 
 @app.get("/labels", response_model=List[str])
-def get_labels():
+def get_labels(request: Request, response: Response):
+    etag = settings_service.revision.etag("labels")
+    not_modified = _not_modified(request, etag)
+    if not_modified:
+        return not_modified
+    response.headers.update(_etag_headers(etag))
     return settings_service.get_labels()
 
 # --- Rules Endpoints ---
@@ -163,7 +334,12 @@ from .models import Rule
 from .services.rule_service import rule_service
 
 @app.get("/rules", response_model=List[Rule])
-def get_rules():
+def get_rules(request: Request, response: Response):
+    etag = rule_service.revision.etag("rules")
+    not_modified = _not_modified(request, etag)
+    if not_modified:
+        return not_modified
+    response.headers.update(_etag_headers(etag))
     return rule_service.get_all_rules()
 
 @app.post("/rules", response_model=Rule)
@@ -200,7 +376,6 @@ def delete_label(label: str):
 # --- Manual Entry ---
 
 from fastapi import File, UploadFile, Form
-import shutil
 import uuid
 
 @app.post("/invoices/manual", response_model=InvoiceData)
@@ -222,18 +397,15 @@ async def create_manual_invoice(
     
     invoice_id = str(uuid.uuid4())
     download_url = None
+    attachment_sha256 = None
 
     if file:
         print(f"Received file: {file.filename}, content_type: {file.content_type}")
         try:
-            filename = f"manual_{invoice_id}_{file.filename}"
-            file_path = os.path.join("backend/static/invoices", filename)
-            
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
-            
-            download_url = f"http://127.0.0.1:8000/files/{filename}"
-            print(f"Saved manual file to {file_path}")
+            ext = os.path.splitext(file.filename)[1] or ".pdf"
+            attachment_sha256 = attachment_store.put(await file.read(), ext)
+            download_url = attachment_store.url(attachment_sha256, ext)
+            print(f"Saved manual file as {attachment_sha256}")
         except Exception as e:
             print(f"Failed to save file: {e}")
 
@@ -248,6 +420,7 @@ async def create_manual_invoice(
         vat_amount=vat_amount, 
         subject=subject or "Manual Entry",
         download_url=download_url,
+        attachment_sha256=attachment_sha256,
         status=status,
         labels=labels
     )
@@ -265,30 +438,26 @@ async def upload_invoice_file(invoice_id: str, file: UploadFile = File(...)):
         # Or if the user is editing an existing one.
         pass # For now assume it exists or we just proceed if we want to allow standalone uploads
 
-    # Generate filename
-    # Sanitize filename
+    # Sanitize filename; the file itself is stored by content, the name is what the user uploaded
     safe_filename = "".join(c for c in file.filename if c.isalnum() or c in "._-").strip()
-    # Unique prefix
-    import time
-    timestamp = int(time.time())
-    new_filename = f"manual_{invoice_id}_{timestamp}_{safe_filename}"
-    
-    file_path = os.path.join("backend/static/invoices", new_filename)
     
-    # Save file
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-        
-    # Construct URL
-    # Use request.base_url ideally, but hardcoding for now as per other parts
-    download_url = f"http://127.0.0.1:8000/files/{new_filename}"
+    # Save file (once per content; the replaced file is left to the attachment GC)
+    ext = os.path.splitext(safe_filename)[1] or ".pdf"
+    attachment_sha256 = attachment_store.put(await file.read(), ext)
+    download_url = attachment_store.url(attachment_sha256, ext)
+    filename = safe_filename or f"{attachment_sha256}{ext}"
     
     # Update invoice if it exists
     if invoice:
-        updated_invoice = storage_service.update_invoice(invoice_id, {"download_url": download_url, "filename": new_filename})
+        updated_invoice = storage_service.update_invoice(invoice_id, {"download_url": download_url, "filename": filename, "attachment_sha256": attachment_sha256})
         return updated_invoice
     
-    return {"download_url": download_url, "filename": new_filename}
+    return {"download_url": download_url, "filename": filename, "attachment_sha256": attachment_sha256}
+
+@app.post("/attachments/gc")
+def collect_attachment_garbage():
+    """Deletes stored attachments that no invoice references anymore."""
+    return attachment_store.collect_garbage(storage_service.get_all())
 
 # --- Export Endpoints ---
 from .services.export_service import generate_pdf_report, generate_zip_export
@@ -338,8 +507,13 @@ def export_zip(req: ExportRequest):
 from .services.analytics_service import analytics_service
 
 @app.get("/analytics")
-def get_analytics(start_date: date, end_date: date):
+def get_analytics(start_date: date, end_date: date, request: Request, response: Response):
     """
     Returns aggregated data for charts.
     """
+    etag = storage_service.revision.etag("analytics")
+    not_modified = _not_modified(request, etag)
+    if not_modified:
+        return not_modified
+    response.headers.update(_etag_headers(etag))
     return analytics_service.get_analytics(start_date, end_date)
@@ -1,6 +1,6 @@
-from pydantic import BaseModel
-from typing import Optional, List
-from datetime import date
+from pydantic import BaseModel, Field
+from typing import Dict, Optional, List
+from datetime import date, datetime
 
 class InvoiceData(BaseModel):
     id: str
@@ -15,16 +15,92 @@ class InvoiceData(BaseModel):
     currency: str = "ILS"
     vat_amount: Optional[float] = None
     download_url: Optional[str] = None
+    # SHA-256 of the PDF in the attachment store (see attachment_store), None for older invoices
+    attachment_sha256: Optional[str] = None
+    # Gmail account the invoice was found in (None for manual invoices and older scans)
+    account: Optional[str] = None
     labels: List[str] = []
     comments: Optional[str] = None
     
     # Status
     status: str = "Pending" # Pending, Warning, Processed, Cancelled
     
+class InvoiceQuery(BaseModel):
+    # Filters (all optional, combined with AND)
+    status: Optional[str] = None
+    label: Optional[str] = None
+    account: Optional[str] = None
+    start_date: Optional[date] = None
+    end_date: Optional[date] = None
+    min_amount: Optional[float] = None
+    max_amount: Optional[float] = None
+    text: Optional[str] = None # Case-insensitive match on subject, vendor, sender, comments
+
+    # Ordering & paging
+    sort: str = "id" # id, date, amount, vendor
+    order: str = "desc" # asc, desc
+    limit: Optional[int] = None # None = everything
+    cursor: Optional[str] = None # Opaque, from InvoicePage.next_cursor
+
+class InvoicePage(BaseModel):
+    items: List[InvoiceData]
+    total: int
+    next_cursor: Optional[str] = None
+
 class ScanResult(BaseModel):
     total_emails_scanned: int
     invoices_found: int
     invoices: List[InvoiceData]
+    # The scanned account; a scan of several accounts lists them in `accounts` instead
+    account: Optional[str] = None
+    accounts: List[str] = []
+    # Accounts whose scan failed outright (the other accounts' invoices are still returned)
+    failed_accounts: List[str] = []
+    # True when only mail added since the last sync was scanned
+    incremental: bool = False
+    # Gmail mailbox position to remember as the account's sync point (None: not a sync point)
+    history_id: Optional[str] = None
+    # Download volume avoided by the two-phase fetch (estimate, in bytes)
+    bytes_saved: int = 0
+    # Emails that could not be fetched even after retries (a later scan of the range retries them)
+    failed_emails: int = 0
+    # Listed messages that were not fetched because they are already known (internal, not serialized)
+    skipped_ids: List[str] = Field(default_factory=list, exclude=True)
+    # Messages dropped by rules from their headers alone (internal, not serialized)
+    rejected_ids: List[str] = Field(default_factory=list, exclude=True)
+
+class ScanJobRequest(BaseModel):
+    start_date: date
+    end_date: date
+    incremental: bool = False
+    refresh: bool = False
+    # Accounts to scan (email addresses); None scans every signed-in account
+    accounts: Optional[List[str]] = None
+
+class ScanJobInfo(BaseModel):
+    id: str
+    status: str # "queued", "running", "done", "cancelled", "failed"
+    start_date: date
+    end_date: date
+    incremental: bool = False
+    refresh: bool = False
+    accounts: Optional[List[str]] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    # listed, skipped, fetched, rejected, downloaded, extracted, built, saved, failed
+    counts: Dict[str, int] = {}
+    # Seconds spent per phase (list, fetch, download, extract, build, save), and waiting on Gmail quota (throttled)
+    timings: Dict[str, float] = {}
+    # Set once the job is finished
+    total_emails_scanned: Optional[int] = None
+    invoices_found: Optional[int] = None
+    error: Optional[str] = None
+
+class GmailAccount(BaseModel):
+    email: str
+    # The account signed in through /auth/login (backend/token.json)
+    primary: bool = False
 
 # --- Rules Models ---
 class RuleCondition(BaseModel):
@@ -0,0 +1,145 @@
+import hashlib
+import os
+import threading
+import time
+from typing import Dict, Iterable, Iterator, Tuple
+
+STATIC_INVOICES_DIR = "backend/static/invoices"
+ATTACHMENTS_DIR = os.path.join(STATIC_INVOICES_DIR, "blobs")
+FILES_URL = "http://127.0.0.1:8000/files"
+# Blobs written or reused this recently are never collected: a running scan stores the PDF before saving its invoice
+GC_GRACE_SECONDS = 3600
+
+
+class AttachmentStore:
+    """
+    Attachments stored once by content: backend/static/invoices/blobs/ab/cd/abcd....pdf, named
+    by their SHA-256. The same PDF sent in several emails (or downloaded again on a rescan)
+    is written once; invoices reference it by hash (attachment_sha256).
+    Blobs are served under /files like the rest of the invoices folder.
+    """
+
+    def __init__(self, root: str = ATTACHMENTS_DIR, files_dir: str = STATIC_INVOICES_DIR, files_url: str = FILES_URL):
+        self.root = root
+        self.files_dir = files_dir
+        self.files_url = files_url
+        self._lock = threading.Lock()
+        self.stats = {"writes": 0, "deduplicated": 0, "bytes_written": 0, "bytes_deduplicated": 0}
+
+    def path(self, sha256: str, ext: str = ".pdf") -> str:
+        # Two levels of 256 directories keep each one small even with millions of blobs
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256 + ext)
+
+    def url(self, sha256: str, ext: str = ".pdf") -> str:
+        relative = os.path.relpath(self.path(sha256, ext), self.files_dir).replace(os.sep, "/")
+        return f"{self.files_url}/{relative}"
+
+    def exists(self, sha256: str, ext: str = ".pdf") -> bool:
+        return os.path.exists(self.path(sha256, ext))
+
+    def put(self, data: bytes, ext: str = ".pdf") -> str:
+        """Stores `data` unless a blob with the same content exists; returns its SHA-256."""
+        sha256 = hashlib.sha256(data).hexdigest()
+        path = self.path(sha256, ext)
+        if os.path.exists(path):
+            try:
+                # Reused: the GC grace period starts over, the invoice pointing at it may not be saved yet
+                os.utime(path)
+            except FileNotFoundError:
+                pass # Collected just now: written again below
+            else:
+                with self._lock:
+                    self.stats["deduplicated"] += 1
+                    self.stats["bytes_deduplicated"] += len(data)
+                return sha256
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Unique temp name: two threads may store the same new blob at once, the rename is atomic
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self.stats["writes"] += 1
+            self.stats["bytes_written"] += len(data)
+        return sha256
+
+    def blobs(self) -> Iterator[Tuple[str, str]]:
+        """(sha256, path) of every stored blob."""
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                if not name.endswith(".tmp"):
+                    yield os.path.splitext(name)[0], os.path.join(directory, name)
+
+    def refcounts(self, invoices: Iterable) -> Dict[str, int]:
+        """How many invoices reference each blob."""
+        counts: Dict[str, int] = {}
+        for invoice in invoices:
+            sha256 = getattr(invoice, "attachment_sha256", None)
+            if sha256:
+                counts[sha256] = counts.get(sha256, 0) + 1
+        return counts
+
+    def collect_garbage(self, invoices: Iterable, grace_seconds: float = GC_GRACE_SECONDS) -> Dict[str, int]:
+        """Deletes blobs no invoice references (not written or reused for `grace_seconds`); returns what it did."""
+        counts = self.refcounts(invoices)
+        cutoff = time.time() - grace_seconds
+        result = {"kept": 0, "removed": 0, "freed_bytes": 0}
+        for sha256, path in self.blobs():
+            try:
+                if counts.get(sha256, 0) > 0 or os.path.getmtime(path) > cutoff:
+                    result["kept"] += 1
+                    continue
+                size = os.path.getsize(path)
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            result["removed"] += 1
+            result["freed_bytes"] += size
+
+        # Drop shard directories left empty
+        for directory, subdirs, files in os.walk(self.root, topdown=False):
+            if directory != self.root and not subdirs and not files:
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    pass
+        return result
+
+attachment_store = AttachmentStore()
+
+
+def migrate_legacy_files(storage, store: AttachmentStore = attachment_store) -> Dict[str, int]:
+    """
+    Moves files saved before the attachment store (backend/static/invoices/{msg_id}_{name})
+    into it and points their invoices at the blob.
+    """
+    result = {"migrated": 0, "missing": 0}
+    moved = set()
+    with storage.batch() as batch:
+        for invoice in storage.get_all():
+            if invoice.attachment_sha256 or not invoice.download_url:
+                continue
+            name = invoice.download_url.split('/files/', 1)[-1]
+            path = os.path.join(store.files_dir, name)
+            if not os.path.isfile(path):
+                result["missing"] += 1
+                continue
+            ext = os.path.splitext(path)[1] or ".pdf"
+            with open(path, 'rb') as f:
+                sha256 = store.put(f.read(), ext)
+            batch.update_invoice(invoice.id, {"attachment_sha256": sha256, "download_url": store.url(sha256, ext)})
+            moved.add(path)
+            result["migrated"] += 1
+    for path in moved:
+        os.remove(path)
+    return result
+
+
+if __name__ == "__main__":
+    import sys
+    from backend.services.storage_service import storage_service
+
+    if len(sys.argv) > 1 and sys.argv[1] == "migrate":
+        print(f"Migrated attachments: {migrate_legacy_files(storage_service)}")
+    print(f"Garbage collected: {attachment_store.collect_garbage(storage_service.get_all())}")
@@ -186,8 +186,8 @@ def generate_zip_export(invoices: List[dict], files_dir: str) -> bytes:
             
             if inv.get('download_url'):
                 try:
-                    # http://.../files/19...pdf -> 19...pdf
-                    url_filename = inv['download_url'].split('/')[-1]
+                    # http://.../files/19...pdf -> 19...pdf, .../files/blobs/ab/cd/abcd...pdf -> blobs/ab/cd/abcd...pdf
+                    url_filename = inv['download_url'].split('/files/', 1)[-1]
                     candidates.append(url_filename)
                     # Also try decoding if url encoded? Usually split is enough for simple cases
                 except:
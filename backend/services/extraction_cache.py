@@ -0,0 +1,169 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import date
+from typing import Optional, Tuple
+from backend.services.extraction_service import EXTRACTOR_VERSION, FIELDS_VERSION
+
+EXTRACTION_CACHE_FILE = "backend/data/extraction_cache.db"
+# Least recently used documents are dropped past this size; 0 turns the cache off
+EXTRACTION_CACHE_MAX_MB = float(os.getenv("EXTRACTION_CACHE_MAX_MB", 64))
+# Eviction frees down to this share of the limit, so it doesn't run on every insert
+EVICT_TO_FRACTION = 0.9
+
+CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS extractions (
+    sha256 TEXT NOT NULL,
+    extractor_version TEXT NOT NULL,
+    text TEXT NOT NULL,
+    fields_version TEXT NOT NULL,
+    fields TEXT NOT NULL,
+    complete INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (sha256, extractor_version)
+);
+CREATE INDEX IF NOT EXISTS idx_extractions_last_used ON extractions(last_used);
+"""
+
+
+def _dump_fields(fields: dict) -> str:
+    return json.dumps({key: value.isoformat() if isinstance(value, date) else value for key, value in fields.items()})
+
+
+def _load_fields(data: str) -> dict:
+    fields = json.loads(data)
+    for key, value in fields.items():
+        if key.endswith("_date") and value:
+            fields[key] = date.fromisoformat(value)
+    return fields
+
+
+class ExtractionCache:
+    """
+    What was extracted from each PDF, keyed by the SHA-256 of its bytes and EXTRACTOR_VERSION,
+    in a WAL-mode SQLite database: the page text and the fields _extract_from_text found in it.
+    A rescan (or the same PDF in another email) skips parsing it. Entries of another extractor
+    version are dropped when the cache is opened; fields of another FIELDS_VERSION are not
+    returned, so the caller parses the cached text again. Text that is missing pages (reading
+    stopped once the old fields were found) is no use to new fields: such an entry is a miss.
+    """
+
+    def __init__(self, db_file: str = EXTRACTION_CACHE_FILE, max_bytes: int = int(EXTRACTION_CACHE_MAX_MB * 1024 * 1024),
+                 extractor_version: str = EXTRACTOR_VERSION, fields_version: str = FIELDS_VERSION):
+        self.db_file = db_file
+        self.max_bytes = max_bytes
+        self.extractor_version = extractor_version
+        self.fields_version = fields_version
+        self._lock = threading.RLock()
+        # Opened on first use: the extraction worker processes import this module but never use it
+        self._conn: Optional[sqlite3.Connection] = None
+        self._size = 0
+        self.stats = {"hits": 0, "misses": 0, "stale_fields": 0, "evictions": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_file) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_file, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(CACHE_SCHEMA)
+            if "complete" not in {column[1] for column in conn.execute("PRAGMA table_info(extractions)")}:
+                # Caches from before the column: whether their text has every page is unknown
+                conn.execute("ALTER TABLE extractions ADD COLUMN complete INTEGER NOT NULL DEFAULT 0")
+            dropped = conn.execute("DELETE FROM extractions WHERE extractor_version != ?", (self.extractor_version,)).rowcount
+            if dropped:
+                print(f"Dropped {dropped} cached extractions of an older extractor (now {self.extractor_version})")
+            self._size = conn.execute("SELECT COALESCE(SUM(size), 0) FROM extractions").fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    def get(self, sha256: str) -> Optional[Tuple[str, Optional[dict]]]:
+        """
+        (text, fields) of the PDF, fields None if they came from another FIELDS_VERSION;
+        None if not cached, or if the fields are stale and the text is missing pages.
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT text, fields_version, fields, complete FROM extractions WHERE sha256 = ? AND extractor_version = ?",
+                (sha256, self.extractor_version),
+            ).fetchone()
+            stale = row is not None and row[1] != self.fields_version
+            if stale:
+                self.stats["stale_fields"] += 1
+            if row is None or (stale and not row[3]):
+                self.stats["misses"] += 1
+                return None
+            conn.execute("UPDATE extractions SET last_used = ? WHERE sha256 = ? AND extractor_version = ?",
+                         (time.time(), sha256, self.extractor_version))
+            self.stats["hits"] += 1
+            if stale:
+                return row[0], None
+            return row[0], _load_fields(row[2])
+
+    def put(self, sha256: str, text: str, fields: dict, complete: bool = True):
+        """Stores what was extracted; `complete` is whether the text has every page of the PDF."""
+        if not self.enabled:
+            return
+        fields_data = _dump_fields(fields)
+        size = len(text.encode()) + len(fields_data)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            conn = self._connection()
+            old = conn.execute("SELECT size FROM extractions WHERE sha256 = ? AND extractor_version = ?",
+                               (sha256, self.extractor_version)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO extractions "
+                "(sha256, extractor_version, text, fields_version, fields, complete, size, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (sha256, self.extractor_version, text, self.fields_version, fields_data, int(complete), size, time.time()),
+            )
+            self._size += size - (old[0] if old else 0)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        target = self.max_bytes * EVICT_TO_FRACTION
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            while self._size > target:
+                oldest = conn.execute(
+                    "SELECT sha256, extractor_version, size FROM extractions ORDER BY last_used LIMIT 64"
+                ).fetchall()
+                if not oldest:
+                    break
+                for sha256, extractor_version, size in oldest:
+                    if self._size <= target:
+                        break
+                    conn.execute("DELETE FROM extractions WHERE sha256 = ? AND extractor_version = ?", (sha256, extractor_version))
+                    self._size -= size
+                    self.stats["evictions"] += 1
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            self._size = conn.execute("SELECT COALESCE(SUM(size), 0) FROM extractions").fetchone()[0]
+            raise
+
+    def size(self) -> int:
+        """Bytes of text and fields cached."""
+        with self._lock:
+            self._connection()
+            return self._size
+
+    def clear(self):
+        with self._lock:
+            self._connection().execute("DELETE FROM extractions")
+            self._size = 0
+
+extraction_cache = ExtractionCache()
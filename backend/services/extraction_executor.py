@@ -0,0 +1,278 @@
+import os
+import sys
+import hashlib
+import signal
+import threading
+import time
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor, CancelledError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Sequence, Tuple
+from backend.services.extraction_cache import ExtractionCache, extraction_cache
+
+# Worker processes for PDF parsing and rendering; 0 runs them in the calling thread instead.
+# One core is left to the API and the scan's own threads.
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
+# A document still parsing after this long is given up on (its worker is stopped)
+EXTRACTION_TIMEOUT_SECONDS = float(os.getenv("EXTRACTION_TIMEOUT_SECONDS", 30))
+# Time a worker gets to stop on its own after a timeout before the pool is killed
+KILL_GRACE_SECONDS = 2.0
+WATCHDOG_INTERVAL_SECONDS = 0.1
+
+
+class _WorkerTimeout(BaseException):
+    # BaseException, so the parser's own `except Exception` blocks don't swallow it
+    pass
+
+
+def _on_alarm(signum, frame):
+    raise _WorkerTimeout()
+
+
+def _init_worker():
+    # Ctrl+C is for the server; the workers stop with its pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if hasattr(signal, "setitimer"):
+        signal.signal(signal.SIGALRM, _on_alarm)
+
+
+def _warm_worker(_=None):
+    from backend.services.pdf_text_backends import pdf_text_extractor
+    pdf_text_extractor.warm_up()
+    from backend.services.gmail_service import convert_html_to_pdf  # noqa: F401 (imports xhtml2pdf, fonts)
+    # Long enough for every worker to get one of these
+    time.sleep(0.2)
+    return os.getpid()
+
+
+def _limited(timeout: Optional[float], fn, *args):
+    """Runs fn in the worker, interrupted after `timeout` seconds where the OS has SIGALRM."""
+    if not timeout or not hasattr(signal, "setitimer"):
+        return fn(*args)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return fn(*args)
+    except _WorkerTimeout:
+        raise TimeoutError(f"stopped after {timeout:g}s")
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def _read_pdf(pdf_bytes: bytes, filename: str) -> Tuple[Optional[str], bool, dict]:
+    """(text, every page read, fields) of the PDF; (None, False, {}) if it can't be read."""
+    from backend.services.extraction_service import extraction_service
+    result = extraction_service.read_text(pdf_bytes, filename)
+    if result is None:
+        return None, False, {}
+    text, complete = result
+    return text, complete, extraction_service._extract_from_text(text, filename)
+
+
+def _extract_pdf(pdf_bytes: bytes, filename: str, timeout: Optional[float] = None) -> Tuple[Optional[str], bool, dict]:
+    return _limited(timeout, _read_pdf, pdf_bytes, filename)
+
+
+def _shutdown_pool(pool: ProcessPoolExecutor, wait: bool):
+    # Queued tasks are dropped rather than started (cancel_futures is Python 3.9+;
+    # on 3.8 they fail with the killed pool, or run first when waiting)
+    if sys.version_info >= (3, 9):
+        pool.shutdown(wait=wait, cancel_futures=True)
+    else:
+        pool.shutdown(wait=wait)
+
+
+def _render_html(html: str, timeout: Optional[float] = None) -> Optional[bytes]:
+    from backend.services.gmail_service import convert_html_to_pdf
+    return _limited(timeout, convert_html_to_pdf, html)
+
+
+class ExtractionExecutor:
+    """
+    Runs PDF text extraction (and rendering email bodies to PDF) in a pool of worker
+    processes, so parsing is not serialized by the GIL. Workers are started once and reused.
+    At most one task per worker is in flight, so a task's deadline counts from when it starts:
+    a worker past `timeout` is interrupted (SIGALRM), and if it does not stop the pool is
+    killed and restarted; the other tasks it held are sent again.
+    With a `cache`, a PDF extracted before (same bytes) is answered from it without a worker.
+    """
+
+    def __init__(self, workers: int = EXTRACTION_WORKERS, timeout: float = EXTRACTION_TIMEOUT_SECONDS,
+                 cache: Optional[ExtractionCache] = None):
+        self.workers = workers
+        self.timeout = timeout
+        self.cache = cache if cache is not None and cache.enabled else None
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._slots = threading.Semaphore(max(1, workers))
+        self._inflight: Dict[Future, float] = {}
+        self._lock = threading.Lock()
+        self._watchdog: Optional[threading.Thread] = None
+        self.stats = {"tasks": 0, "timeouts": 0, "restarts": 0, "resubmitted": 0}
+
+    def _get_pool(self) -> Optional[ProcessPoolExecutor]:
+        with self._lock:
+            if self._pool is None and self.workers > 0:
+                try:
+                    # spawn, not fork: the scan's threads may hold locks a forked child would inherit
+                    self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                                     initializer=_init_worker)
+                except Exception as e:
+                    print(f"Could not start extraction workers, extracting in-process: {e}")
+                    self.workers = 0
+                    return None
+                if self._watchdog is None:
+                    self._watchdog = threading.Thread(target=self._watch, name="extraction-watchdog", daemon=True)
+                    self._watchdog.start()
+            return self._pool
+
+    def warm_up(self) -> int:
+        """Starts every worker and loads the parsers in it; returns the number of workers running."""
+        pool = self._get_pool()
+        if pool is None:
+            return 0
+        return len(set(pool.map(_warm_worker, range(self.workers))))
+
+    def _submit(self, fn, *args) -> Future:
+        self._slots.acquire()
+        try:
+            future = self._get_pool().submit(fn, *args, self.timeout)
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self._inflight[future] = time.monotonic() + self.timeout + KILL_GRACE_SECONDS
+            self.stats["tasks"] += 1
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future: Future):
+        with self._lock:
+            self._inflight.pop(future, None)
+        self._slots.release()
+
+    def _watch(self):
+        # A parse stuck where SIGALRM can't reach it (native code, or Windows) takes its pool down
+        while True:
+            time.sleep(WATCHDOG_INTERVAL_SECONDS)
+            now = time.monotonic()
+            with self._lock:
+                overdue = [future for future, deadline in self._inflight.items() if deadline < now]
+                for future in overdue:
+                    future.timed_out = True
+                    # Not watched any more: the next tick must not restart the pool again for it
+                    del self._inflight[future]
+            if overdue:
+                self._restart()
+
+    def _restart(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+            if pool is None:
+                return
+            # The pool's other tasks fail with it and are sent again on a fresh pool, with new deadlines
+            self._inflight.clear()
+            self.stats["restarts"] += 1
+        print("Extraction worker stuck past its timeout, restarting the extraction pool")
+        # ProcessPoolExecutor can't stop one task, so its processes are killed (public API from Python 3.14)
+        if hasattr(pool, "kill_workers"):
+            pool.kill_workers()
+        else:
+            for process in list((getattr(pool, "_processes", None) or {}).values()):
+                process.kill()
+        _shutdown_pool(pool, wait=False)
+
+    def _result(self, future: Future, fn, *args):
+        try:
+            return future.result()
+        except (BrokenProcessPool, CancelledError):
+            if getattr(future, "timed_out", False):
+                raise TimeoutError(f"killed after {self.timeout:g}s")
+            # Lost with a pool killed for another task (or a crashed worker): once more on a fresh pool
+            with self._lock:
+                self.stats["resubmitted"] += 1
+            return self._submit(fn, *args).result()
+
+    def _run(self, fn, *args):
+        if self.workers <= 0 or self._get_pool() is None:
+            return fn(*args)
+        return self._result(self._submit(fn, *args), fn, *args)
+
+    def _failed(self, filename: str, e: Exception) -> dict:
+        if isinstance(e, TimeoutError):
+            with self._lock:
+                self.stats["timeouts"] += 1
+        print(f"Error reading PDF {filename}: {e}")
+        return {}
+
+    def _cached(self, sha256: Optional[str], filename: str) -> Optional[dict]:
+        if self.cache is None:
+            return None
+        entry = self.cache.get(sha256)
+        if entry is None:
+            return None
+        text, fields = entry
+        if fields is None:
+            # Found by an older _extract_from_text in text with every page: parse that again, not the PDF
+            from backend.services.extraction_service import extraction_service
+            fields = extraction_service._extract_from_text(text, filename)
+            self.cache.put(sha256, text, fields)
+        return fields
+
+    def _extracted(self, sha256: Optional[str], result: Tuple[Optional[str], bool, dict]) -> dict:
+        text, complete, fields = result
+        # A PDF that can't be read is not cached: the next scan tries it again
+        if self.cache is not None and text is not None:
+            self.cache.put(sha256, text, fields, complete)
+        return fields
+
+    def _sha256(self, pdf_bytes: bytes) -> Optional[str]:
+        return hashlib.sha256(pdf_bytes).hexdigest() if self.cache is not None else None
+
+    def extract_pdf(self, pdf_bytes: bytes, filename: str, sha256: Optional[str] = None) -> dict:
+        """
+        Invoice fields of one PDF, like extraction_service.extract_from_pdf ({} if it can't be read).
+        `sha256` of the bytes, if the caller has it already, saves hashing them again for the cache.
+        """
+        sha256 = sha256 or self._sha256(pdf_bytes)
+        cached = self._cached(sha256, filename)
+        if cached is not None:
+            return cached
+        try:
+            return self._extracted(sha256, self._run(_extract_pdf, pdf_bytes, filename))
+        except Exception as e:
+            return self._failed(filename, e)
+
+    def extract_many(self, pdfs: Sequence[bytes], filenames: Optional[Sequence[str]] = None) -> List[dict]:
+        """Invoice fields of each PDF, in the order given; {} for one that fails or times out."""
+        filenames = list(filenames) if filenames is not None else [f"document_{n}.pdf" for n in range(len(pdfs))]
+        hashes = [self._sha256(pdf) for pdf in pdfs]
+        results: List[Optional[dict]] = [self._cached(sha256, filename) for sha256, filename in zip(hashes, filenames)]
+        todo = [n for n, result in enumerate(results) if result is None]
+        if self.workers <= 0 or self._get_pool() is None:
+            for n in todo:
+                results[n] = self._extracted(hashes[n], _extract_pdf(pdfs[n], filenames[n]))
+            return results
+
+        # Submitting blocks while every worker is busy; earlier documents finish meanwhile
+        futures = {n: self._submit(_extract_pdf, pdfs[n], filenames[n]) for n in todo}
+        for n, future in futures.items():
+            try:
+                results[n] = self._extracted(hashes[n], self._result(future, _extract_pdf, pdfs[n], filenames[n]))
+            except Exception as e:
+                results[n] = self._failed(filenames[n], e)
+        return results
+
+    def render_html_pdf(self, html: str) -> Optional[bytes]:
+        """PDF of an email body (see convert_html_to_pdf), or None if rendering failed."""
+        try:
+            return self._run(_render_html, html) or None
+        except Exception as e:
+            print(f"Error generating PDF: {e}")
+            return None
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool:
+            _shutdown_pool(pool, wait=True)
+
+extraction_executor = ExtractionExecutor(cache=extraction_cache)
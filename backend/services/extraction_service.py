@@ -1,25 +1,102 @@
+import os
 import re
-import io
-import pdfplumber
-from datetime import datetime
+from datetime import date
 from typing import Optional, Tuple
+from backend.services.pdf_text_backends import pdf_text_extractor
+
+# Pages read at most from one PDF (the first ones and the last); 0 reads every page
+EXTRACTION_MAX_PAGES = int(os.getenv("EXTRACTION_MAX_PAGES", 20))
+# VAT rates an explicit VAT amount is checked against (Israel: 17% until 2024, 18% since 2025)
+VAT_RATES = (0.17, 0.18)
+
+# Cached extractions (see extraction_cache) are only reused under the same versions.
+# Bump EXTRACTOR_VERSION when the text read out of a PDF changes (every PDF is parsed again),
+# FIELDS_VERSION when _extract_from_text changes. The cached text is then re-read, not the PDF,
+# if it has every page: where _found_all stopped reading early, the new fields may need more pages.
+EXTRACTOR_VERSION = f"{pdf_text_extractor.version}/max-pages-{EXTRACTION_MAX_PAGES}/2"
+FIELDS_VERSION = "2"
+
+# Currency-like numbers (e.g. 123.45 or 1,234.00)
+AMOUNT = re.compile(r'\d{1,3}(?:,\d{3})*\.\d{2}')
+# Runs of digits and separators, at least as long as the shortest amount (0.00).
+# Every date and amount below lies inside one, so the text is swept once.
+NUMBER_RUN = re.compile(r'\d[\d,./\-]{3,}')
+# Numbers that are years, not amounts
+NOT_AMOUNTS = {2023.0, 2024.0, 2025.0, 2026.0}
+# Date formats, most trusted first: the first one with a valid date anywhere in the text wins.
+# Sometimes RTL makes "26/10/2025 :תאריך" appear as "תאריך: 2025/10/26" or similar visual tricks,
+# so we look for the number sequences. (pattern, year first)
+DATE_PATTERNS = [
+    (re.compile(r'\d{2}[/.]\d{2}[/.]\d{4}'), False),      # 26/10/2025
+    (re.compile(r'\d{1,2}[/.]\d{1,2}[/.]\d{4}'), False),  # 1/1/2025
+    (re.compile(r'\d{4}-\d{2}-\d{2}'), True),             # 2025-10-26
+    (re.compile(r'\d{2}[/.]\d{2}[/.]\d{2}'), False),      # 26/10/25 (Dangerous but common)
+]
+# Matches every run that holds a date: most runs are amounts and skip DATE_PATTERNS
+DATE_HINT = re.compile(r'\d[/.]\d{1,2}[/.]\d\d|\d{4}-\d\d-\d\d')
+DAYS_IN_MONTH = (0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+
+def _parse_date(date_str: str, year_first: bool) -> Optional[date]:
+    """
+    A DATE_PATTERNS match as a date between 2001 and 2029, or None: the same dates strptime
+    gives with "%d/%m/%Y", "%Y-%m-%d" and "%d/%m/%y", without raising on the invalid ones.
+    """
+    if year_first:
+        year_str, month_str, day_str = date_str[:4], date_str[5:7], date_str[8:10]
+    else:
+        day_str, month_str, year_str = date_str.replace('.', '/').split('/')
+    # \d matches other scripts' digits too, and so do strptime's years and int(). Its %m takes
+    # ASCII digits only, its %d only "1" or "2" followed by any digit (e.g. "1٥" is the 15th).
+    if not (month_str.isascii() and (day_str.isascii() or day_str[0] in "12")):
+        return None
+    day, month, year = int(day_str), int(month_str), int(year_str)
+    if not year_first and len(year_str) == 2:
+        # strptime's %y: 69-99 are 1969-1999, 00-68 are 2000-2068
+        year += 1900 if year >= 69 else 2000
+    if not (2000 < year < 2030 and 1 <= month <= 12 and 1 <= day <= DAYS_IN_MONTH[month]):
+        return None
+    if month == 2 and day == 29 and not (year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)):
+        return None
+    return date(year, month, day)
 
 class ExtractionService:
     def extract_from_pdf(self, pdf_bytes, filename) -> dict:
         """
         Extracts text from PDF and then metadata.
         """
-        text = ""
-        try:
-            with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
-                for page in pdf.pages:
-                    text += (page.extract_text() or "") + "\n"
-        except Exception as e:
-            print(f"Error reading PDF {filename}: {e}")
+        text = self.extract_text(pdf_bytes, filename)
+        if text is None:
             return {}
-            
         return self._extract_from_text(text, filename)
 
+    def extract_text(self, pdf_bytes, filename) -> Optional[str]:
+        """
+        Text of the PDF, or None if it can't be read.
+        Read with the backends in PDF_TEXT_BACKENDS (see pdf_text_backends), falling back in order.
+        Long documents are read from both ends and only until the fields are found (see _found_all),
+        at most EXTRACTION_MAX_PAGES pages.
+        """
+        result = self.read_text(pdf_bytes, filename)
+        return result[0] if result is not None else None
+
+    def read_text(self, pdf_bytes, filename) -> Optional[Tuple[str, bool]]:
+        """extract_text's text and whether every page is in it, or None if the PDF can't be read."""
+        return pdf_text_extractor.read_text(pdf_bytes, filename, max_pages=EXTRACTION_MAX_PAGES,
+                                            enough=lambda text: self._found_all(text, filename))
+
+    def _found_all(self, text, filename) -> bool:
+        """
+        Whether the rest of a document can be skipped: the text has a date, and a VAT amount that
+        is what one of VAT_RATES gives on the total, which makes it unlikely the real total is
+        still to come.
+        """
+        data, explicit_vat = self._extract_fields(text, filename)
+        if not (data["invoice_date"] and data["total_amount"] and explicit_vat):
+            return False
+        total = data["total_amount"]
+        return any(abs(data["vat_amount"] - total * rate / (1 + rate)) <= max(0.05, total * 0.001) for rate in VAT_RATES)
+
     def extract_from_body(self, email_body, filename) -> dict:
         """
         Extracts metadata from email body text.
@@ -27,6 +104,10 @@ class ExtractionService:
         return self._extract_from_text(email_body, filename)
 
     def _extract_from_text(self, text, filename) -> dict:
+        return self._extract_fields(text, filename)[0]
+
+    def _extract_fields(self, text, filename) -> Tuple[dict, bool]:
+        """The fields found in the text, and whether the VAT amount was in it (not calculated)."""
         data = {
             "invoice_date": None,
             "total_amount": None,
@@ -37,115 +118,52 @@ class ExtractionService:
         # Debug:
         # print(f"-- Text for {filename} --\n{text}\n----------------")
 
-        # 1. Extract Date
-        # Enhanced patterns. 
-        # Sometimes RTL makes "26/10/2025 :תאריך" appear as "תאריך: 2025/10/26" or similar visual tricks.
-        # We look for the number sequences primarily.
-        date_patterns = [
-            r'(\d{2}[/.]\d{2}[/.]\d{4})',       # 26/10/2025
-            r'(\d{1,2}[/.]\d{1,2}[/.]\d{4})',   # 1/1/2025
-            r'(\d{4}-\d{2}-\d{2})',             # 2025-10-26
-            r'(\d{2}[/.]\d{2}[/.]\d{2})'        # 26/10/25 (Dangerous but common)
-        ]
-        
-        # We also look for specific anchors to prioritize the "Invoice Date" over other dates
-        # Hebrew: תאריך, לתאריך
-        # English: Date, Invoice Date
-        
-        for pattern in date_patterns:
-            matches = re.finditer(pattern, text)
-            for match in matches:
-                date_str = match.group(0).replace('.', '/')
-                try:
-                    # Try parsing common formats
-                    for fmt in ["%d/%m/%Y", "%Y-%m-%d", "%d/%m/%y"]:
-                        try:
-                            dt = datetime.strptime(date_str, fmt).date()
-                            if 2000 < dt.year < 2030:
-                                data["invoice_date"] = dt
-                                break
-                        except ValueError:
-                            continue
-                    if data["invoice_date"]: break
-                except:
-                    continue
-            if data["invoice_date"]: break
-
-        # 2. Extract Amount (Total)
-        clean_text = text.replace('\u20aa', 'NIS ').replace('₪', 'NIS ')
-        
-        # Look for numbers that look like currency (e.g. 123.45 or 1,234.00)
-        # We collect ALL currency-like numbers
+        # One sweep over the number runs collects the amounts and the best date.
+        # found_dates[i] is the first valid date of DATE_PATTERNS[i]; `best` the most trusted pattern with one.
         all_numbers = []
-        matches = re.findall(r'(\d{1,3}(?:,\d{3})*(?:\.\d{2}))', clean_text)
-        for m in matches:
-            try:
-                val = float(m.replace(',', ''))
-                # Filter out likely non-amounts (like years 2025, or IDs that slipped through regex)
-                if 0.0 < val < 50000 and val not in [2023, 2024, 2025, 2026]: 
-                    all_numbers.append(val)
-            except: pass
-            
+        found_dates = [None] * len(DATE_PATTERNS)
+        best = len(DATE_PATTERNS)
+        append = all_numbers.append
+        for run in NUMBER_RUN.findall(text):
+            if len(run) <= 6 and run[-3] == '.' and run[:-3].isdecimal() and run[-2:].isdecimal():
+                # Most runs are a plain amount like 123.45: no regex needed
+                val = float(run)
+                if 0.0 < val < 50000 and val not in NOT_AMOUNTS:
+                    append(val)
+                continue
+            if '.' in run:
+                for m in AMOUNT.findall(run):
+                    val = float(m.replace(',', ''))
+                    # Filter out likely non-amounts (like years 2025, or IDs that slipped through regex)
+                    if 0.0 < val < 50000 and val not in NOT_AMOUNTS:
+                        append(val)
+            if best and len(run) >= 8 and DATE_HINT.search(run):
+                for index in range(best):
+                    pattern, iso = DATE_PATTERNS[index]
+                    for m in pattern.findall(run):
+                        dt = _parse_date(m, iso)
+                        if dt:
+                            found_dates[index], best = dt, index
+                            break
+                    if index == best:
+                        break
+        if best < len(DATE_PATTERNS):
+            data["invoice_date"] = found_dates[best]
+
+        found_explicit_vat = False
         if all_numbers:
             # Heuristic: Total amount is often the MAX value
-            data["total_amount"] = max(all_numbers)
-
-        # 3. VAT (Maam)
-        # Logic: 
-        # A. Look for explicit VAT keywords
-        # B. If not found, CALCULATE it (Fallback)
-        
-        vat_keywords = [r'מע"?מ', r'VAT', r'Maam', r'Tax']
-        found_explicit_vat = False
-        
-        for kw in vat_keywords:
-            # Look for number near keyword
-            # We look for small context window around the keyword
-            pass 
-            # (Keeping the regex simple for now as per previous success, but using all_numbers logic is better)
-            
-        # Let's try to match VAT from the list of numbers we foudn
-        if data["total_amount"] and all_numbers:
-            # Try to find a number that looks like ~15-18% of total
-            for num in all_numbers:
-                if num == data["total_amount"]: continue
-                ratio = num / data["total_amount"]
-                if 0.14 < ratio < 0.19: # 17% is 0.17. 18% is 0.18. (Allowing slop)
-                    data["vat_amount"] = num
-                    found_explicit_vat = True
-                    break
-        
-        # User requested Fallback: If no VAT found, calculate 18% of Total
-        if not data["vat_amount"] and data["total_amount"]:
-            # Check if text implies "Inc VAT" or "Ex VAT"? 
-            # Usually B2C invoices are Inc VAT.
-            # 18% VAT means: Net * 1.18 = Total. => VAT = Total - (Total / 1.18)
-            # OR is it just 18% OF the total? User said "Calculated AS 18% of the amount". 
-            # Usually they mean Extract the vat component.
-            # Let's assume Total is Gross.
-            # VAT = Total * (0.17 / 1.17) for 17%. Currently Israel is 17%. 
-            # Wait, user specifically mentioned "18%". Maybe they are old school or it's a specific sector?
-            # Or maybe they mean simply Total * 0.18 (which would be weird for an invoice total).
-            # I will assume they mean "Extract the VAT component assuming 17% (current IL rate)".
-            # Correction: User wrote "18.00%" in the previous example image! 
-            # Ah, the image shows "Maam Nigba 18.00%". OK, so the invoice confirms 18%. 
-            # (Israel VAT is 17% since 2015, maybe this is a simulation image or old?).
-            # I will use 17% as standard default but if user insisted on 18... 
-            # Wait, the user text: "שיחשב כ 18% מהסכום". 
-            # checking the image... extracted text says "18.00%". 
-            # I will calculate VAT as Total * (18/118) -> extracting the tax from the gross.
-            
-            # Using 17% as it is the legal rate, unless user force 18.
-            # User said "calculate as 18%". I will follow user instructions literally if possible, 
-            # but usually its 17%. 
-            # Actually, let's verify if the user's example image has 17 or 18.
-            # Image: 35.00 Total. 29.66 Net. 5.34 VAT.
-            # 29.66 * 0.18 = 5.3388 (5.34). 
-            # So the image DOES use 18%. 
-            # Okay, I will fallback to 18% calculation.
-            
-            data["vat_amount"] = round(data["total_amount"] * (0.18 / 1.18), 2)
-
-        return data
+            total = data["total_amount"] = max(all_numbers)
+            # VAT (Maam): the first number that is ~15-18% of the total (17% and 18% rates, allowing slop)
+            vat = next((num for num in all_numbers if num != total and 0.14 < num / total < 0.19), None)
+            if vat is not None:
+                data["vat_amount"] = vat
+                found_explicit_vat = True
+            else:
+                # Fallback: extract the VAT component of a gross total at 18% (VAT = Total * 18/118),
+                # the rate the user's invoices show
+                data["vat_amount"] = round(total * (0.18 / 1.18), 2)
+
+        return data, found_explicit_vat
 
 extraction_service = ExtractionService()
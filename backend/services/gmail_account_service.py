@@ -0,0 +1,111 @@
+import os
+import threading
+from typing import Dict, List, Optional
+from backend.services.gmail_service import GmailService, gmail_service
+from backend.services.gmail_rate_limiter import GmailRateLimiter
+
+# Tokens of the accounts added next to the primary one, one file per address
+TOKENS_DIR = "backend/tokens"
+
+
+class GmailAccountService:
+    """
+    Gmail accounts signed in side by side. The primary account is the gmail_service singleton
+    (backend/token.json, /auth/login); every other account has its token in TOKENS_DIR as
+    {email}.json, and a rate limiter of its own, so scanning one mailbox does not eat into
+    another's quota.
+    """
+
+    def __init__(self, tokens_dir: str = TOKENS_DIR, primary: GmailService = gmail_service):
+        self.tokens_dir = tokens_dir
+        self.primary = primary
+        self._services: Dict[str, GmailService] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _token_file(self, email: str) -> str:
+        return os.path.join(self.tokens_dir, f"{email}.json")
+
+    def _load(self):
+        if not os.path.isdir(self.tokens_dir):
+            return
+        for name in sorted(os.listdir(self.tokens_dir)):
+            if name.endswith(".json"):
+                email = name[:-len(".json")]
+                service = GmailService(token_file=self._token_file(email), rate_limiter=GmailRateLimiter())
+                service.email = email
+                self._services[email] = service
+
+    def add(self, root_url: Optional[str] = None) -> str:
+        """
+        Signs in another account (the consent screen opens) and returns its address.
+        With `root_url` the account is a mailbox on another Gmail API host (e.g. fake_gmail_server.py),
+        kept for this process only.
+        """
+        service = GmailService(token_file=None, root_url=root_url, rate_limiter=GmailRateLimiter())
+        service.authenticate()
+        profile = service.get_user_profile()
+        if not profile or not profile.get("email"):
+            raise RuntimeError("Signed in, but Gmail did not return the account's address")
+        email = profile["email"]
+        if not root_url:
+            os.makedirs(self.tokens_dir, exist_ok=True)
+            service.token_file = self._token_file(email)
+            with open(service.token_file, 'w') as token:
+                token.write(service.creds.to_json())
+        with self._lock:
+            self._services[email] = service
+        print(f"Added Gmail account {email}")
+        return email
+
+    def remove(self, email: str) -> bool:
+        """Signs the account out and deletes its token. The primary account is signed out too."""
+        if email == self.primary.email:
+            self.primary.logout()
+            return True
+        with self._lock:
+            service = self._services.pop(email, None)
+        if not service:
+            return False
+        service.logout()
+        return True
+
+    def accounts(self) -> List[Dict]:
+        """[{"email", "primary"}] for every signed-in account, the primary one first."""
+        accounts = []
+        profile = self.primary.get_user_profile()
+        if profile and profile.get("email"):
+            accounts.append({"email": profile["email"], "primary": True})
+        with self._lock:
+            accounts.extend({"email": email, "primary": False} for email in self._services if email != self.primary.email)
+        return accounts
+
+    def services(self, emails: Optional[List[str]] = None) -> List[GmailService]:
+        """
+        The accounts to scan: those in `emails`, or the primary account (if signed in) and every added one.
+        Raises ValueError for an account that is not signed in, or when none is.
+        The primary account is included without asking Gmail who it is (the scan signs it in); a signed-out
+        one is left out, so a background scan never waits on a consent screen.
+        """
+        with self._lock:
+            added = dict(self._services)
+        if emails is None:
+            primary = [self.primary] if self.primary.is_signed_in() else []
+            services = primary + [service for email, service in added.items() if email != self.primary.email]
+            if not services:
+                raise ValueError("No Gmail account is signed in (see /auth/login)")
+            return services
+
+        services = []
+        for email in dict.fromkeys(emails):
+            if email in added:
+                services.append(added[email])
+                continue
+            if self.primary.email is None:
+                self.primary.get_user_profile()
+            if email != self.primary.email:
+                raise ValueError(f"Gmail account {email} is not signed in")
+            services.append(self.primary)
+        return services
+
+gmail_account_service = GmailAccountService()
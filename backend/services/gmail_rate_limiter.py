@@ -0,0 +1,198 @@
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+from googleapiclient.errors import HttpError
+
+# Gmail quota units per call (developers.google.com/gmail/api/reference/quota)
+QUOTA_UNITS = {
+    "getProfile": 1,
+    "history.list": 2,
+    "messages.list": 5,
+    "messages.get": 5,
+    "messages.attachments.get": 5,
+}
+DEFAULT_QUOTA_UNITS = 5
+# Gmail allows 250 units per user per second, averaged; the bucket holds one second of burst
+QUOTA_UNITS_PER_SECOND = float(os.getenv("GMAIL_QUOTA_UNITS_PER_SECOND", 250))
+# Most Gmail requests in flight at once; halved on every rate limit, then grown back one by one
+MAX_CONCURRENCY = int(os.getenv("GMAIL_MAX_CONCURRENCY", 8))
+
+# Responses worth another try, and how often / how long to back off (full jitter)
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 5
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 32.0
+# Several 429s arriving together are one signal: the limit is halved at most once per this
+THROTTLE_COOLDOWN_SECONDS = 1.0
+
+
+def error_status(exception) -> Optional[int]:
+    """HTTP status of a Gmail client error, if it has one."""
+    return getattr(getattr(exception, 'resp', None), 'status', None)
+
+
+def retry_after_seconds(exception) -> Optional[float]:
+    """The Retry-After header of a rate-limited response (seconds form only)."""
+    resp = getattr(exception, 'resp', None)
+    try:
+        return float(resp.get('retry-after')) if resp is not None and resp.get('retry-after') else None
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Quota units refilled at `rate` per second up to `capacity`. A caller that finds too few
+    reserves its units anyway (the balance goes negative) and sleeps until they are paid back,
+    so waiters are served in arrival order.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, units: float) -> float:
+        """Takes `units` (at most a full bucket), sleeping as needed; returns the seconds waited."""
+        units = min(units, self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self.tokens -= units
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+class AdaptiveConcurrency:
+    """
+    Limit on requests in flight, adjusted AIMD style: halved when Gmail says we are too fast,
+    raised by one after a full window of successes, never above `max_limit`.
+    """
+
+    def __init__(self, max_limit: int):
+        self.max_limit = max(1, max_limit)
+        self.limit = self.max_limit
+        self.in_flight = 0
+        self._successes = 0
+        self._last_decrease = 0.0
+        self._changed = threading.Condition()
+
+    @contextmanager
+    def slot(self):
+        with self._changed:
+            self._changed.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self._changed:
+                self.in_flight -= 1
+                self._changed.notify()
+
+    def on_success(self):
+        with self._changed:
+            self._successes += 1
+            if self._successes >= self.limit and self.limit < self.max_limit:
+                self.limit += 1
+                self._successes = 0
+                self._changed.notify()
+
+    def on_throttled(self):
+        with self._changed:
+            now = time.monotonic()
+            if now - self._last_decrease >= THROTTLE_COOLDOWN_SECONDS:
+                self.limit = max(1, self.limit // 2)
+                self._last_decrease = now
+            self._successes = 0
+
+
+class GmailRateLimiter:
+    """
+    Shared gate for Gmail API calls: a token bucket in quota units, an adaptive cap on
+    concurrent requests, and jittered exponential retries of rate-limited/server errors.
+    Counts what it did, for tuning (stats()).
+    """
+
+    def __init__(self, units_per_second: float = QUOTA_UNITS_PER_SECOND, max_concurrency: int = MAX_CONCURRENCY):
+        self.bucket = TokenBucket(units_per_second)
+        self.concurrency = AdaptiveConcurrency(max_concurrency)
+        self._metrics = {
+            "calls": 0, "units": 0, "retries": 0, "rate_limited": 0, "server_errors": 0,
+            "throttle_seconds": 0.0, "concurrency_wait_seconds": 0.0, "backoff_seconds": 0.0,
+        }
+        self._lock = threading.Lock()
+
+    def _add(self, **metrics):
+        with self._lock:
+            for name, value in metrics.items():
+                self._metrics[name] += value
+
+    @contextmanager
+    def acquire(self, method: str, calls: int = 1):
+        """Waits for quota and a free slot for `calls` calls of `method` (a batch counts each call)."""
+        units = QUOTA_UNITS.get(method, DEFAULT_QUOTA_UNITS) * calls
+        throttled = self.bucket.acquire(units)
+        start = time.perf_counter()
+        with self.concurrency.slot():
+            self._add(calls=calls, units=units, throttle_seconds=throttled,
+                      concurrency_wait_seconds=time.perf_counter() - start)
+            yield
+
+    def on_response(self, status: Optional[int] = None):
+        """Feeds one call's outcome (None: success) to the adaptive limit."""
+        if status is None:
+            self.concurrency.on_success()
+        elif status == 429:
+            self._add(rate_limited=1)
+            self.concurrency.on_throttled()
+        elif status >= 500:
+            self._add(server_errors=1)
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None):
+        """Sleeps before retry number `attempt` (0-based): full jitter, at least Retry-After."""
+        delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+        if retry_after:
+            delay = max(delay, min(retry_after, BACKOFF_MAX_SECONDS))
+        self._add(retries=1, backoff_seconds=delay)
+        time.sleep(delay)
+
+    def execute(self, request, method: str):
+        """Runs a Gmail request through the limiter, retrying rate-limited, server and network errors."""
+        for attempt in range(MAX_RETRIES + 1):
+            with self.acquire(method):
+                try:
+                    response = request.execute()
+                except HttpError as e:
+                    status = error_status(e)
+                    self.on_response(status)
+                    if status not in RETRYABLE_STATUSES or attempt == MAX_RETRIES:
+                        raise
+                    retry_after = retry_after_seconds(e)
+                except OSError:
+                    # Connection reset, timeout: nothing reached Gmail's quota
+                    if attempt == MAX_RETRIES:
+                        raise
+                    retry_after = None
+                else:
+                    self.on_response(None)
+                    return response
+            self.backoff(attempt, retry_after)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            metrics = dict(self._metrics)
+        for name in ("throttle_seconds", "concurrency_wait_seconds", "backoff_seconds"):
+            metrics[name] = round(metrics[name], 3)
+        metrics["concurrency_limit"] = self.concurrency.limit
+        metrics["in_flight"] = self.concurrency.in_flight
+        return metrics
+
+gmail_rate_limiter = GmailRateLimiter()
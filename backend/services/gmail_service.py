@@ -1,18 +1,118 @@
 import os.path
+import json
+import time
 import base64
-from typing import List, Optional
+import httplib2
+from typing import Callable, Dict, List, Optional, Set
 from datetime import date, datetime
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.errors import HttpError
 from bs4 import BeautifulSoup
 from backend.models import InvoiceData, ScanResult
+from backend.services.scan_pipeline import Pipeline, Stage
+from backend.services.sync_state_service import sync_state_service
+from backend.services.scan_checkpoint_service import scan_checkpoint_service
+from backend.services.attachment_store import attachment_store
+from backend.services.gmail_rate_limiter import gmail_rate_limiter, error_status, retry_after_seconds, RETRYABLE_STATUSES, MAX_RETRIES
+from backend.services.extraction_executor import extraction_executor, EXTRACTION_WORKERS
 
 # If modifying these scopes, delete the file token.json.
 SCOPES = ['https://www.googleapis.com/auth/gmail.modify']
-STATIC_INVOICES_DIR = "backend/static/invoices" 
-BASE_URL = "http://localhost:8000/files"
+
+# Gmail accepts up to 100 calls per batch request, but batches over 50 tend to hit its per-user rate limits
+GMAIL_BATCH_SIZE = 50
+
+# Threads per scan stage, e.g. SCAN_WORKERS="fetch=2,download=8,extract=2".
+# Extract threads hand PDFs to the extraction worker processes: one more than there are workers keeps them busy.
+SCAN_WORKERS = {"fetch": 2, "download": 4, "extract": max(2, EXTRACTION_WORKERS + 1), "build": 1}
+SCAN_WORKERS.update({
+    name.strip(): int(count)
+    for name, count in (pair.split("=") for pair in os.getenv("SCAN_WORKERS", "").split(",") if "=" in pair)
+})
+# Items waiting between two stages; a full queue makes the stage before it wait
+SCAN_QUEUE_SIZE = 32
+
+# First phase of a message fetch: top-level headers plus the MIME part tree, without body data.
+# (format=metadata would trim the headers too, but Gmail leaves the part tree out of it.)
+_PART_FIELDS = "partId,mimeType,filename,body/attachmentId,body/size"
+MESSAGE_OUTLINE_FIELDS = (
+    "id,threadId,labelIds,snippet,internalDate,sizeEstimate,"
+    f"payload({_PART_FIELDS},headers,parts({_PART_FIELDS},parts({_PART_FIELDS},parts({_PART_FIELDS},parts({_PART_FIELDS})))))"
+)
+
+# Points the client at another Gmail API host (e.g. fake_gmail_server.py); OAuth is skipped then
+GMAIL_API_ROOT_URL = os.getenv("GMAIL_API_ROOT_URL")
+# The account signed in first; further accounts keep their tokens in gmail_account_service's folder
+TOKEN_FILE = 'backend/token.json'
+
+
+def build_gmail_service(credentials=None, root_url: Optional[str] = None):
+    """Builds the Gmail client, against Google or against `root_url` (no auth)."""
+    if not root_url:
+        return build('gmail', 'v1', credentials=credentials)
+    # api_endpoint in client_options does not move the batch URI, so patch the discovery doc instead
+    document = json.loads(get_static_doc('gmail', 'v1'))
+    document['rootUrl'] = root_url.rstrip('/') + '/'
+    return build_from_document(document, http=httplib2.Http())
+
+
+def find_pdf_part(payload: dict) -> Optional[dict]:
+    """First PDF attachment part in the message's MIME tree (or the payload itself if it is the PDF)."""
+    def find_pdf(params):
+        for part in params:
+            if part.get('mimeType') == 'application/pdf' or part.get('filename', '').lower().endswith('.pdf'):
+                return part
+            if 'parts' in part:
+                 found = find_pdf(part['parts'])
+                 if found: return found
+        return None
+
+    pdf_part = find_pdf(payload.get('parts', []))
+    if not pdf_part and payload.get('mimeType') == 'application/pdf':
+        pdf_part = payload  # The message itself is the PDF
+    return pdf_part
+
+
+def _has_pdf_attachment(message: dict) -> bool:
+    pdf_part = find_pdf_part(message.get('payload', {}))
+    return bool(pdf_part and 'attachmentId' in pdf_part.get('body', {}))
+
+
+def header_value(payload: dict, name: str, default: str) -> str:
+    return next((h['value'] for h in payload.get('headers', []) if h['name'] == name), default)
+
+
+def inline_body_bytes(part: dict) -> int:
+    """Body bytes a full fetch would carry inline for this part tree (attachments are fetched separately)."""
+    size = 0 if 'attachmentId' in part.get('body', {}) else part.get('body', {}).get('size', 0)
+    return size + sum(inline_body_bytes(p) for p in part.get('parts', []))
+
+
+def find_body_content(params):
+    """Decoded (text/plain, text/html) bodies found in the given MIME parts, recursively."""
+    found_text = None
+    found_html = None
+    for part in params:
+        mime = part.get('mimeType')
+        body_data = part.get('body', {}).get('data')
+
+        if mime == 'text/plain' and body_data:
+            found_text = base64.urlsafe_b64decode(body_data).decode('utf-8')
+        elif mime == 'text/html' and body_data:
+            found_html = base64.urlsafe_b64decode(body_data).decode('utf-8')
+
+        if 'parts' in part:
+            nested_text, nested_html = find_body_content(part['parts'])
+            if nested_text: found_text = nested_text
+            if nested_html: found_html = nested_html
+
+        if found_text and found_html: break # Found both
+
+    return found_text, found_html
 
 
 import io
@@ -31,7 +131,7 @@ def process_text_for_pdf(text):
 
 from backend.services.pdf_utils import generate_pdf_from_html
 
-def convert_html_to_pdf(source_html, output_path):
+def convert_html_to_pdf(source_html, output_path=None):
     # Sanitize Source HTML & Handle Bidi
     try:
         soup = BeautifulSoup(source_html, 'html.parser')
@@ -91,8 +191,7 @@ def convert_html_to_pdf(source_html, output_path):
     """
     
     try:
-        generate_pdf_from_html(styled_html, output_path=output_path)
-        return True
+        return generate_pdf_from_html(styled_html, output_path=output_path)
     except Exception as e:
         print(f"Error generating PDF: {e}")
         return False
@@ -104,12 +203,137 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+
+def _throttled_seconds(limiter=None) -> float:
+    """Seconds Gmail calls have waited for quota, a free slot or a retry, so far."""
+    stats = (limiter or gmail_rate_limiter).stats()
+    return stats["throttle_seconds"] + stats["concurrency_wait_seconds"] + stats["backoff_seconds"]
+
+class ScanContext:
+    """
+    Options, counters and hooks of one scan, shared by its pipeline workers.
+    `on_invoice(invoice)` is called for each invoice as soon as it is built (in the scanning
+    thread); `on_progress()` after every counter change.
+    A scan of several accounts gives each one a child context (child()); the parent cancels
+    them together and its progress() adds them up.
+    """
+
+    COUNTERS = ("listed", "skipped", "fetched", "rejected", "downloaded", "extracted", "built", "saved", "failed")
+
+    def __init__(self, reject_early: Optional[Callable[[str, str], bool]] = None,
+                 on_invoice: Optional[Callable[[InvoiceData], None]] = None,
+                 on_progress: Optional[Callable[[], None]] = None):
+        self.reject_early = reject_early
+        self.on_invoice = on_invoice
+        self.on_progress = on_progress
+        self.rejected_ids: List[str] = []
+        self.full_fetches_skipped = 0
+        self.bytes_saved = 0
+        self.counts = {name: 0 for name in self.COUNTERS}
+        self.timings: Dict[str, float] = {}
+        self.pipeline: Optional[Pipeline] = None
+        # Set for checkpointed scans; finished messages are recorded in it
+        self.checkpoint = None
+        self.cancelled = threading.Event()
+        # The account's rate limiter, and its wait time when the scan started (the limiter is shared)
+        self.rate_limiter = None
+        self.throttle_baseline = _throttled_seconds()
+        # Set by scan_invoices: the mailbox the invoices come from
+        self.account: Optional[str] = None
+        self.children: List["ScanContext"] = []
+        self._lock = threading.Lock()
+
+    def child(self) -> "ScanContext":
+        """Context for one account of a multi-account scan, cancelled with this one."""
+        child = ScanContext(self.reject_early, on_progress=self.on_progress)
+        child.cancelled = self.cancelled
+        with self._lock:
+            self.children.append(child)
+        return child
+
+    def add(self, rejected_ids=(), full_fetches_skipped=0, bytes_saved=0):
+        with self._lock:
+            self.rejected_ids.extend(rejected_ids)
+            self.full_fetches_skipped += full_fetches_skipped
+            self.bytes_saved += bytes_saved
+        if rejected_ids:
+            self.count("rejected", len(rejected_ids))
+            self.finished(rejected_ids)
+
+    def finished(self, ids):
+        """Messages that need no more work (saved, skipped or rejected)."""
+        if self.checkpoint:
+            self.checkpoint.finished(ids)
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+        if self.on_progress:
+            self.on_progress()
+
+    def add_time(self, name: str, seconds: float):
+        with self._lock:
+            self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def cancel(self):
+        """Stops the scan; invoices already built are still handed to on_invoice."""
+        self.cancelled.set()
+        if self.pipeline:
+            self.pipeline.cancel()
+        for child in list(self.children):
+            if child.pipeline:
+                child.pipeline.cancel()
+        if self.on_progress:
+            self.on_progress()
+
+    def progress(self) -> Dict:
+        """{"counts": {...}, "timings": {phase: seconds}}, stage timings being the busy time of their workers."""
+        with self._lock:
+            counts = dict(self.counts)
+            timings = dict(self.timings)
+            children = list(self.children)
+        if children:
+            # Accounts are scanned side by side: their counters and busy times add up
+            for child in children:
+                progress = child.progress()
+                for name, value in progress["counts"].items():
+                    counts[name] = counts.get(name, 0) + value
+                for name, seconds in progress["timings"].items():
+                    timings[name] = timings.get(name, 0.0) + seconds
+            return {"counts": counts, "timings": {name: round(seconds, 3) for name, seconds in timings.items()}}
+        if self.pipeline:
+            for name, stats in self.pipeline.stats().items():
+                timings[name] = stats["busy_seconds"]
+        timings["throttled"] = _throttled_seconds(self.rate_limiter) - self.throttle_baseline
+        return {"counts": counts, "timings": {name: round(seconds, 3) for name, seconds in timings.items()}}
+
 class GmailService:
-    def __init__(self):
+    """
+    One Gmail account: its credentials (`token_file`, None for an account signed in but not
+    saved yet), its API host (`root_url`, default GMAIL_API_ROOT_URL) and the rate limiter its
+    calls go through (default: the shared gmail_rate_limiter). Gmail's quota is per user, so
+    every account can have a limiter of its own.
+    """
+
+    def __init__(self, token_file: Optional[str] = TOKEN_FILE, root_url: Optional[str] = None, rate_limiter=None):
+        self.token_file = token_file
+        self.root_url = root_url
+        self.rate_limiter = rate_limiter
         self.creds = None
         self.service = None
+        # Address of the mailbox, once a profile or scan has returned it
+        self.email: Optional[str] = None
         self._lock = threading.Lock()
-        
+        # Per-thread Gmail clients for the scan pipeline
+        self._local = threading.local()
+
+    @property
+    def limiter(self):
+        return self.rate_limiter or gmail_rate_limiter
+
+    def _root_url(self) -> Optional[str]:
+        return self.root_url or GMAIL_API_ROOT_URL
+
     def authenticate(self):
         """Shows the consent screen and creates a token.json"""
         with self._lock:
@@ -117,9 +341,13 @@ class GmailService:
 
     def _authenticate_no_lock(self):
         """Internal authentication without locking to avoid recursion if called from within locked block."""
-        if os.path.exists('backend/token.json'):
+        if self._root_url():
+            self.service = build_gmail_service(root_url=self._root_url())
+            return
+
+        if self.token_file and os.path.exists(self.token_file):
             try:
-                self.creds = Credentials.from_authorized_user_file('backend/token.json', SCOPES)
+                self.creds = Credentials.from_authorized_user_file(self.token_file, SCOPES)
             except Exception as e:
                 logger.error(f"Failed to load credentials: {e}")
                 self.creds = None
@@ -142,16 +370,94 @@ class GmailService:
                 self.creds = flow.run_local_server(port=0)
                 
             # Save the credentials for the next run
-            with open('backend/token.json', 'w') as token:
-                token.write(self.creds.to_json())
-
-        self.service = build('gmail', 'v1', credentials=self.creds)
+            if self.token_file:
+                with open(self.token_file, 'w') as token:
+                    token.write(self.creds.to_json())
+
+        self.service = build_gmail_service(credentials=self.creds)
+
+    def fetch_messages(self, service, message_ids: List[str], **params) -> Dict[str, dict]:
+        """
+        Fetches message details through Gmail's batch endpoint, GMAIL_BATCH_SIZE per HTTP request.
+        Each item succeeds or fails on its own: rate-limited/server errors are retried in a
+        follow-up batch, other failures are logged and the message is left out of the result.
+        Batches go through the shared rate limiter, each item counting as one messages.get.
+        """
+        details = {}
+        pending = list(dict.fromkeys(message_ids)) # Request ids must be unique within a batch
+        for attempt in range(MAX_RETRIES + 1):
+            retry = []
+            retry_after = []
+
+            def on_response(request_id, response, exception):
+                if exception is None:
+                    self.limiter.on_response(None)
+                    details[request_id] = response
+                    return
+                status = error_status(exception)
+                if status is not None:
+                    self.limiter.on_response(status)
+                if status in RETRYABLE_STATUSES and attempt < MAX_RETRIES:
+                    retry.append(request_id)
+                    retry_after.append(retry_after_seconds(exception) or 0)
+                else:
+                    print(f"Error fetching message {request_id}: {exception}")
 
-    def scan_invoices(self, start_date: date, end_date: date) -> ScanResult:
-        with self._lock:
-            if not self.service:
-                self._authenticate_no_lock()
-            current_service = self.service
+            for start in range(0, len(pending), GMAIL_BATCH_SIZE):
+                chunk = pending[start:start + GMAIL_BATCH_SIZE]
+                batch = service.new_batch_http_request(callback=on_response)
+                for msg_id in chunk:
+                    batch.add(service.users().messages().get(userId='me', id=msg_id, **params), request_id=msg_id)
+                try:
+                    with self.limiter.acquire("messages.get", len(chunk)):
+                        batch.execute()
+                except Exception as e:
+                    # The whole round trip failed (network, auth, 429 on the batch): none of the chunk came back
+                    print(f"Error executing batch of {len(chunk)} message fetches: {e}")
+                    status = error_status(e)
+                    if status is not None:
+                        self.limiter.on_response(status)
+                    if attempt < MAX_RETRIES:
+                        retry.extend(msg_id for msg_id in chunk if msg_id not in details and msg_id not in retry)
+
+            if not retry:
+                break
+            pending = retry
+            self.limiter.backoff(attempt, max(retry_after, default=None))
+        return details
+
+    def scan_invoices(self, start_date: date, end_date: date, workers: Optional[Dict[str, int]] = None, incremental: bool = False,
+                      known_ids: Optional[Callable[[List[str]], Set[str]]] = None,
+                      reject_early: Optional[Callable[[str, str], bool]] = None,
+                      scan: Optional[ScanContext] = None) -> ScanResult:
+        """
+        Lists matching emails and turns them into invoices through the scan pipeline.
+        `workers` overrides SCAN_WORKERS (threads per stage) for this scan.
+        With `incremental`, only mail added since the account's last sync is scanned (Gmail
+        history); the date range is scanned instead when there is no usable sync point.
+        The caller stores result.history_id as the new sync point once the invoices are saved.
+        `known_ids(ids)` returns the listed ids that need no fetching (already stored, or
+        rejected before); they are reported in result.skipped_ids instead.
+        `reject_early(sender, subject)` drops an email from its headers alone, before its body
+        or attachment is downloaded; dropped ids end up in result.rejected_ids.
+        `scan` receives progress counters and each invoice as it is built, and can cancel the
+        scan; the result then holds only the invoices built so far.
+        Range scans keep a checkpoint while they run (see scan_checkpoint_service): a scan of
+        the same range after a crash, error or cancel continues from it instead of starting over.
+        """
+        scan = scan or ScanContext()
+        if reject_early:
+            scan.reject_early = reject_early
+        scan.rate_limiter = self.limiter
+        scan.throttle_baseline = _throttled_seconds(self.limiter)
+        current_service = self._thread_service()
+        list_start = time.perf_counter()
+
+        # Mailbox position taken before listing, so mail arriving mid-scan is caught by the next incremental sync
+        profile = self.limiter.execute(current_service.users().getProfile(userId='me'), "getProfile")
+        account = profile.get('emailAddress')
+        history_id = profile.get('historyId')
+        self.email = scan.account = account
 
         # Convert dates to query format (YYYY/MM/DD)
         # after:YYYY/MM/DD before:YYYY/MM/DD
@@ -161,196 +467,384 @@ class GmailService:
         keywords = ['invoice', 'receipt', 'bill', 'חשבונית', 'קבלה']
         keyword_query = " OR ".join(keywords)
         full_query = f"({keyword_query}) {query}"
-        
-        print(f"Searching Gmail with query: {full_query}")
-        
-        messages = []
-        next_page_token = None
-        
-        # Safety limit to prevent infinite scanning
-        MAX_EMAILS = 500 
-        
-        while len(messages) < MAX_EMAILS:
-            results = current_service.users().messages().list(
+
+        pages = None
+        if incremental:
+            messages = self._list_added_since_last_sync(current_service, account, keyword_query)
+            if messages is not None:
+                pages = lambda: iter([(None, None, messages)])
+        scan.add_time("list", time.perf_counter() - list_start)
+        used_history = pages is not None
+        checkpoint = None
+        if not used_history:
+            # Range scans are listed page by page and checkpointed, so an interrupted scan resumes
+            checkpoint = scan_checkpoint_service.open(f"{account}|{full_query}")
+            if checkpoint.resumed:
+                print(f"Resuming interrupted scan of {account} ({checkpoint.listed} emails listed before)")
+                # The older position: mail that arrived since the first attempt is caught by the next sync
+                history_id = checkpoint.history_id
+            else:
+                checkpoint.history_id = history_id
+            print(f"Searching Gmail with query: {full_query}")
+            pages = lambda: self._resumed_pages(checkpoint, full_query)
+        scan.checkpoint = checkpoint
+        # A range scan only becomes the new sync point if it reached the present
+        if not used_history and end_date < date.today():
+            history_id = None
+
+        skipped_ids = []
+        listing_errors = []
+
+        def chunks():
+            # Runs on the pipeline's feeder thread, so the next page is only listed once the
+            # pipeline has room for it. Known messages are skipped before any messages.get or
+            # attachment download. Items carry their listing position to return invoices in Gmail's order.
+            position = 0
+            try:
+                page_iter = pages()
+                while not scan.cancelled.is_set():
+                    start = time.perf_counter()
+                    page = next(page_iter, None)
+                    scan.add_time("list", time.perf_counter() - start)
+                    if page is None:
+                        break
+                    page_token, next_page_token, messages = page
+                    ids = [m['id'] for m in messages]
+                    scan.count("listed", len(ids))
+                    skipped = []
+                    if checkpoint:
+                        checkpoint.page_listed(page_token, next_page_token, ids)
+                    if known_ids and ids:
+                        known = known_ids(ids)
+                        skipped += [msg_id for msg_id in ids if msg_id in known]
+                        ids = [msg_id for msg_id in ids if msg_id not in known]
+                    skipped_ids.extend(skipped)
+                    scan.finished(skipped)
+                    scan.count("skipped", len(skipped))
+                    for index in range(0, len(ids), GMAIL_BATCH_SIZE):
+                        yield [(position + offset, msg_id) for offset, msg_id in enumerate(ids[index:index + GMAIL_BATCH_SIZE], index)]
+                    position += len(ids)
+            except Exception as e:
+                print(f"Error listing emails: {e}")
+                listing_errors.append(e)
+
+        # fetch -> download -> extract -> build, each stage on its own threads, so batch
+        # round trips and attachment downloads overlap with PDF parsing.
+        pipeline = self._build_pipeline(scan, workers)
+        scan.pipeline = pipeline
+        if scan.cancelled.is_set():
+            pipeline.cancel() # Cancelled while listing
+        results = []
+        try:
+            for result in pipeline.run(chunks()):
+                results.append(result)
+                if scan.on_invoice:
+                    scan.on_invoice(result[1]) # Marks it finished once it is saved
+                else:
+                    scan.finished([result[1].id])
+        finally:
+            complete = not (listing_errors or scan.counts["failed"] or scan.cancelled.is_set())
+            if checkpoint and not complete:
+                # Saves are throttled while the scan runs: write out where it stopped
+                checkpoint.save()
+        if listing_errors:
+            # The checkpoint stays, so the next scan of this range resumes here
+            raise listing_errors[0]
+        if scan.counts["failed"]:
+            # Kept with only the failed messages unfinished: scanning this range again retries them
+            print(f"{scan.counts['failed']} emails failed; scan the same range again to retry them")
+        elif checkpoint and not scan.cancelled.is_set():
+            checkpoint.clear()
+        results.sort(key=lambda result: result[0])
+        invoices = [invoice for _, invoice in results]
+        print(f"Scanned {scan.counts['listed']} emails, skipped {len(skipped_ids)} already known")
+        print(f"Scan pipeline stats: {pipeline.stats()}")
+        print(f"Gmail rate limiter ({account}): {self.limiter.stats()}")
+        print(f"Rejected {len(scan.rejected_ids)} emails by their headers; "
+              f"{scan.full_fetches_skipped} full payloads not downloaded, ~{scan.bytes_saved // 1024} KB saved")
+
+        return ScanResult(
+            total_emails_scanned=scan.counts['listed'],
+            invoices_found=len(invoices),
+            invoices=invoices,
+            account=account,
+            incremental=used_history,
+            history_id=history_id,
+            skipped_ids=skipped_ids,
+            rejected_ids=scan.rejected_ids,
+            bytes_saved=scan.bytes_saved,
+            failed_emails=scan.counts["failed"],
+        )
+
+    def _list_messages(self, service, full_query: str) -> List[dict]:
+        return [m for _, _, page in self._list_message_pages(service, full_query) for m in page]
+
+    def _resumed_pages(self, checkpoint, full_query: str):
+        """
+        The pages of a checkpointed range scan: first the messages an interrupted run listed but
+        did not finish (as one page), then the listing from where that run stopped.
+        """
+        if checkpoint.resume_pending:
+            next_token = None if checkpoint.listing_done else checkpoint.resume_token
+            yield checkpoint.resume_token, next_token, [{'id': msg_id} for msg_id in checkpoint.resume_pending]
+        if not checkpoint.listing_done:
+            yield from self._list_message_pages(self._thread_service(), full_query, checkpoint.resume_token)
+
+    def _list_message_pages(self, service, full_query: str, page_token: Optional[str] = None):
+        """Yields (page token, next page token, messages) for each page of the listing, from `page_token` on."""
+        while True:
+            results = self.limiter.execute(service.users().messages().list(
                 userId='me', 
                 q=full_query, 
-                maxResults=min(50, MAX_EMAILS - len(messages)), # Fetch in batches
-                pageToken=next_page_token
-            ).execute()
+                maxResults=GMAIL_BATCH_SIZE,
+                pageToken=page_token
+            ), "messages.list")
             
             batch = results.get('messages', [])
-            messages.extend(batch)
-            
             next_page_token = results.get('nextPageToken')
+            yield page_token, next_page_token, batch
             if not next_page_token or not batch:
                 break
-        
-        print(f"Found {len(messages)} potential invoice emails. Processing...")
-        
-        invoices = []
-        
-        # Ensure temp folder exists for PDFs
-        import os
-        pdf_dir = "backend/static/invoices" 
-        os.makedirs(pdf_dir, exist_ok=True)
+            page_token = next_page_token
+
+    def _list_added_since_last_sync(self, service, account: str, keyword_query: str) -> Optional[List[dict]]:
+        """
+        Messages added to the mailbox since the account's last sync, newest first, or None
+        when a full range scan is needed (never synced, or Gmail no longer has that history).
+        """
+        state = sync_state_service.get(account)
+        if not state:
+            print(f"No previous sync for {account}, running a full scan")
+            return None
 
-        for msg in messages:
-            # Get full message details
+        added = {}
+        page_token = None
+        try:
+            while True:
+                results = self.limiter.execute(service.users().history().list(
+                    userId='me',
+                    startHistoryId=state['history_id'],
+                    historyTypes=['messageAdded'],
+                    maxResults=500,
+                    pageToken=page_token
+                ), "history.list")
+                for record in results.get('history', []):
+                    for entry in record.get('messagesAdded', []):
+                        message = entry['message']
+                        if 'DRAFT' not in message.get('labelIds', []):
+                            added[message['id']] = message
+                page_token = results.get('nextPageToken')
+                if not page_token:
+                    break
+        except HttpError as e:
+            # Gmail only keeps about a week of history; older ids are answered with 404
+            if e.resp.status == 404:
+                print(f"History {state['history_id']} of {account} has expired, running a full scan")
+                return None
+            raise
+
+        print(f"{len(added)} messages added to {account} since the last sync")
+        if not added:
+            return []
+        # History can't be searched, so keep only the ids that match the keyword query too:
+        # one id-only listing since the last sync (a day of slack covers time zones)
+        since = int(state['synced_at']) - 86400
+        matching = {m['id'] for m in self._list_messages(service, f"({keyword_query}) after:{since}")}
+        # History is oldest first, listings are newest first
+        return [{'id': msg_id, 'threadId': m.get('threadId')} for msg_id, m in reversed(added.items()) if msg_id in matching]
+
+    def _build_pipeline(self, scan: ScanContext, workers: Optional[Dict[str, int]] = None) -> Pipeline:
+        counts = dict(SCAN_WORKERS, **(workers or {}))
+
+        def counted(counter, fn):
+            # Counts what each stage hands on, for the scan's progress, and the messages it fails
+            def run(item):
+                try:
+                    results = list(fn(item) or ())
+                except Exception:
+                    scan.count("failed", len(item) if isinstance(item, list) else 1)
+                    raise
+                scan.count(counter, len(results))
+                return results
+            return run
+
+        return Pipeline([
+            Stage("fetch", counted("fetched", lambda chunk: self._fetch_stage(scan, chunk)), counts["fetch"], queue_size=max(2, counts["fetch"] * 2)),
+            Stage("download", counted("downloaded", self._download_stage), counts["download"], SCAN_QUEUE_SIZE),
+            Stage("extract", counted("extracted", self._extract_stage), counts["extract"], SCAN_QUEUE_SIZE),
+            Stage("build", counted("built", lambda item: self._build_stage(item, scan.account)), counts["build"], SCAN_QUEUE_SIZE),
+        ], output_size=SCAN_QUEUE_SIZE)
+
+    def _thread_service(self):
+        """Gmail client owned by the calling thread (httplib2 connections are not thread-safe)."""
+        local = self._local
+        if getattr(local, 'service', None) is None or local.creds is not self.creds:
+            with self._lock:
+                if not self.service:
+                    self._authenticate_no_lock()
+                creds = self.creds
+            local.service = build_gmail_service(creds, self._root_url())
+            local.creds = creds
+        return local.service
+
+    def _fetch_stage(self, scan: ScanContext, chunk):
+        """
+        (position, id) pairs -> (position, message) for every message worth processing.
+        Fetches outlines first (headers + part tree) and drops what reject_early refuses.
+        Messages with a PDF continue with their outline, as only the attachment is needed;
+        the rest are fetched in full for their bodies.
+        """
+        service = self._thread_service()
+        outlines = self.fetch_messages(service, [msg_id for _, msg_id in chunk], format='full', fields=MESSAGE_OUTLINE_FIELDS)
+
+        candidates, rejected, saved = [], [], 0
+        for position, msg_id in chunk:
+            outline = outlines.get(msg_id)
+            if outline is None:
+                continue
+            payload = outline.get('payload', {})
+            if scan.reject_early and scan.reject_early(header_value(payload, 'From', "Unknown Sender"), header_value(payload, 'Subject', "No Subject")):
+                rejected.append(msg_id)
+                # Neither the bodies nor the attachment are downloaded (base64 adds a third)
+                pdf_part = find_pdf_part(payload)
+                saved += (inline_body_bytes(payload) + (pdf_part or {}).get('body', {}).get('size', 0)) * 4 // 3
+                continue
+            candidates.append((position, outline))
+
+        needs_body = [outline['id'] for _, outline in candidates if not _has_pdf_attachment(outline)]
+        full = self.fetch_messages(service, needs_body) if needs_body else {}
+
+        # Left out by fetch_messages after its retries: failed, a later scan tries them again
+        failed = sum(1 for _, msg_id in chunk if msg_id not in outlines)
+        failed += sum(1 for msg_id in needs_body if msg_id not in full)
+        if failed:
+            scan.count("failed", failed)
+
+        results = []
+        for position, outline in candidates:
+            if outline['id'] in full:
+                # The outline was an extra download for this one
+                saved -= len(json.dumps(outline))
+                results.append((position, full[outline['id']]))
+            elif _has_pdf_attachment(outline):
+                saved += inline_body_bytes(outline.get('payload', {})) * 4 // 3
+                results.append((position, outline))
+        scan.add(rejected, len(candidates) - len(needs_body) + len(rejected), saved)
+        return results
+
+    def _download_stage(self, item):
+        """Downloads the message's PDF attachment, if it has one, into the attachment store."""
+        position, msg_detail = item
+        msg_id = msg_detail['id']
+        scan_item = {"position": position, "message": msg_detail, "pdf_data": None, "filename": "unknown.pdf", "sha256": None}
+
+        pdf_part = find_pdf_part(msg_detail.get('payload', {}))
+        if pdf_part and 'body' in pdf_part and 'attachmentId' in pdf_part['body']:
             try:
-                msg_detail = current_service.users().messages().get(userId='me', id=msg['id']).execute()
+                att_id = pdf_part['body']['attachmentId']
+                request = self._thread_service().users().messages().attachments().get(userId='me', messageId=msg_id, id=att_id)
+                att = self.limiter.execute(request, "messages.attachments.get")
+                data = att['data']
+                scan_item["pdf_data"] = base64.urlsafe_b64decode(data.encode('UTF-8'))
+                scan_item["filename"] = pdf_part['filename']
+
+                # Save to disk for viewing (skipped if the same PDF is already stored)
+                scan_item["sha256"] = attachment_store.put(scan_item["pdf_data"])
             except Exception as e:
-                print(f"Error fetching message {msg['id']}: {e}")
-                continue
+                if error_status(e) in RETRYABLE_STATUSES or isinstance(e, OSError):
+                    # Still throttled after every retry: fail the message (a later scan retries it)
+                    # rather than saving it without its PDF
+                    raise
+                print(f"Error downloading PDF for msg {msg_id}: {e}")
+        return [scan_item]
+
+    def _extract_stage(self, item):
+        """Extracts invoice fields from the PDF, or from the body (rendering it to a PDF) if there is none."""
+        from backend.services.extraction_service import extraction_service
+        msg_detail = item["message"]
+        msg_id = msg_detail['id']
+
+        if item["pdf_data"]:
+            # Parsed in a worker process (see extraction_executor)
+            item["extracted"] = extraction_executor.extract_pdf(item["pdf_data"], item["filename"], sha256=item["sha256"])
+            return [item]
+
+        # Fallback: Extract from Body
+        # 1. Try to find HTML body
+        # 2. Try to find Text body
+        # 3. Fallback to Snippet
+        text_part, html_part = find_body_content([msg_detail.get('payload', {})]) # Wrap payload in list for recursion compatibility
+        if html_part:
+            soup = BeautifulSoup(html_part, 'html.parser')
+            body_text = soup.get_text(separator='\\n')
+        elif text_part:
+            body_text = text_part
+        else:
+            body_text = msg_detail.get('snippet', '')
 
-            payload = msg_detail.get('payload', {})
-            headers = payload.get('headers', [])
-            parts = payload.get('parts', [])
-            
-            subject = next((h['value'] for h in headers if h['name'] == 'Subject'), "No Subject")
-            sender = next((h['value'] for h in headers if h['name'] == 'From'), "Unknown Sender")
-            
-            # Find PDF Attachment
-            pdf_data = None
-            filename = "unknown.pdf"
-            
-            # Recursive search for attachment in parts
-            def find_pdf(params):
-                for part in params:
-                    if part.get('mimeType') == 'application/pdf' or part.get('filename', '').lower().endswith('.pdf'):
-                        return part
-                    if 'parts' in part:
-                         found = find_pdf(part['parts'])
-                         if found: return found
-                return None
-            
-            pdf_part = find_pdf(parts)
-            if not pdf_part and payload.get('mimeType') == 'application/pdf':
-                pdf_part = payload  # The message itself is the PDF
+        if not body_text:
+            return []
 
-            if pdf_part and 'body' in pdf_part and 'attachmentId' in pdf_part['body']:
-                try:
-                    att_id = pdf_part['body']['attachmentId']
-                    att = current_service.users().messages().attachments().get(userId='me', messageId=msg['id'], id=att_id).execute()
-                    data = att['data']
-                    pdf_data = base64.urlsafe_b64decode(data.encode('UTF-8'))
-                    filename = pdf_part['filename']
-                    
-                    # Save to disk for viewing
-                    file_path = os.path.join(pdf_dir, f"{msg['id']}_{filename}")
-                    with open(file_path, 'wb') as f:
-                        f.write(pdf_data)
-                except Exception as e:
-                    print(f"Error downloading PDF for msg {msg['id']}: {e}")
-            
-            # Extract Data
-            extracted = {}
-            if pdf_data:
-                from backend.services.extraction_service import extraction_service
-                extracted = extraction_service.extract_from_pdf(pdf_data, filename)
-            else:
-                # Fallback: Extract from Body
-                # 1. Try to find HTML body
-                # 2. Try to find Text body
-                # 3. Fallback to Snippet
-                
-                body_text = ""
-                html_body = ""
-                
-                def find_body_content(params):
-                    found_text = None
-                    found_html = None
-                    for part in params:
-                        mime = part.get('mimeType')
-                        body_data = part.get('body', {}).get('data')
-                        
-                        if mime == 'text/plain' and body_data:
-                            found_text = base64.urlsafe_b64decode(body_data).decode('utf-8')
-                        elif mime == 'text/html' and body_data:
-                            found_html = base64.urlsafe_b64decode(body_data).decode('utf-8')
-                        
-                        if 'parts' in part:
-                            nested_text, nested_html = find_body_content(part['parts'])
-                            if nested_text: found_text = nested_text
-                            if nested_html: found_html = nested_html
-                            
-                        if found_text and found_html: break # Found both
-                        
-                    return found_text, found_html
-
-                text_part, html_part = find_body_content([payload]) # Wrap payload in list for recursion compatibility
-
-                if not body_text:
-                    if html_part:
-                        soup = BeautifulSoup(html_part, 'html.parser')
-                        body_text = soup.get_text(separator='\\n')
-                    elif text_part:
-                        body_text = text_part
-                    else:
-                        body_text = msg_detail.get('snippet', '')
-
-                if not body_text:
-                    continue
+        item["extracted"] = extraction_service.extract_from_body(body_text, "email_body")
+
+        # --- Generate PDF from Body if no attachment ---
+        try:
+            # Prefer HTML if available
+            content_to_render = html_part if html_part else f"<pre>{body_text}</pre>"
 
-                if body_text:
-                    from backend.services.extraction_service import extraction_service
-                    extracted = extraction_service.extract_from_body(body_text, "email_body")
+            pdf_bytes = extraction_executor.render_html_pdf(content_to_render)
+            if pdf_bytes:
+                print(f"Generated PDF for {msg_id}")
+                item["sha256"] = attachment_store.put(pdf_bytes)
+        except Exception as e:
+            print(f"Failed to generate PDF for {msg_id}: {e}")
+        return [item]
 
-                # --- Generate PDF from Body if no attachment ---
-                try:
-                    pdf_filename = f"generated_{msg['id']}.pdf"
-                    full_pdf_path = os.path.join(STATIC_INVOICES_DIR, pdf_filename)
-                    
-                    # Prefer HTML if available, use html_part from scope
-                    content_to_render = html_part if html_part else f"<pre>{body_text}</pre>"
-                    
-                    if convert_html_to_pdf(content_to_render, full_pdf_path):
-                        print(f"Generated PDF for {msg['id']}")
-                        pdf_data_exists = True 
-                        generated_url = f"{BASE_URL}/{pdf_filename}"
-                        generated_filename = pdf_filename
-                    else:
-                        pdf_data_exists = False
-                except Exception as e:
-                    print(f"Failed to generate PDF for {msg['id']}: {e}")
-                    pdf_data_exists = False
-                # ----------------------------------------------------
+    def _build_stage(self, item, account: Optional[str] = None):
+        msg_detail = item["message"]
+        msg_id = msg_detail['id']
+        extracted = item["extracted"]
+        payload = msg_detail.get('payload', {})
 
-            # Extract Email Date (internalDate is in milliseconds)
-            email_date = None
-            if 'internalDate' in msg_detail:
-                try:
-                    timestamp = int(msg_detail['internalDate']) / 1000
-                    email_date = datetime.fromtimestamp(timestamp).date()
-                except Exception as e:
-                    print(f"Error parsing internalDate for {msg['id']}: {e}")
-
-            invoice = InvoiceData(
-                id=msg['id'],
-                filename=filename, 
-                sender_email=sender,
-                subject=subject,
-                invoice_date=email_date, # Use email receipt date instead of extracted date
-                vendor_name=extracted.get("vendor_name") or sender.split('<')[0].strip().replace('"', ''),
-                total_amount=extracted.get("total_amount"),
-                currency="ILS",
-                vat_amount=extracted.get("vat_amount"),
-                download_url=f"http://127.0.0.1:8000/files/{msg['id']}_{filename}" if pdf_data else (generated_url if 'generated_url' in locals() and generated_url else None),
-                status="Pending" # Default to Pending, Rules will override if applicable
-            )
-            invoices.append(invoice)
+        subject = header_value(payload, 'Subject', "No Subject")
+        sender = header_value(payload, 'From', "Unknown Sender")
 
-        return ScanResult(
-            total_emails_scanned=len(messages), 
-            invoices_found=len(invoices),
-            invoices=invoices
+        # Extract Email Date (internalDate is in milliseconds)
+        email_date = None
+        if 'internalDate' in msg_detail:
+            try:
+                timestamp = int(msg_detail['internalDate']) / 1000
+                email_date = datetime.fromtimestamp(timestamp).date()
+            except Exception as e:
+                print(f"Error parsing internalDate for {msg_id}: {e}")
+
+        invoice = InvoiceData(
+            id=msg_id,
+            filename=item["filename"],
+            sender_email=sender,
+            subject=subject,
+            invoice_date=email_date, # Use email receipt date instead of extracted date
+            vendor_name=extracted.get("vendor_name") or sender.split('<')[0].strip().replace('"', ''),
+            total_amount=extracted.get("total_amount"),
+            currency="ILS",
+            vat_amount=extracted.get("vat_amount"),
+            download_url=attachment_store.url(item["sha256"]) if item["sha256"] else None,
+            attachment_sha256=item["sha256"],
+            account=account,
+            status="Pending" # Default to Pending, Rules will override if applicable
         )
+        return [(item["position"], invoice)]
+
+    def is_signed_in(self) -> bool:
+        """Whether the account can be used without a consent screen: signed in, a saved token, or a test host."""
+        return self.service is not None or bool(self.token_file and os.path.exists(self.token_file)) or bool(self._root_url())
 
     def get_user_profile(self) -> Optional[dict]:
         """Fetches the connected user's profile (email address)."""
         with self._lock:
             # Do not force authentication if not already signed in (file doesn't exist)
             if not self.service:
-                if os.path.exists('backend/token.json'):
+                if (self.token_file and os.path.exists(self.token_file)) or self._root_url():
                     try:
                         self._authenticate_no_lock()
                     except Exception as e:
@@ -367,7 +861,8 @@ class GmailService:
 
         try:
             profile = current_service.users().getProfile(userId='me').execute()
-            return {"email": profile.get("emailAddress")}
+            self.email = profile.get("emailAddress")
+            return {"email": self.email}
         except Exception as e:
             print(f"Error fetching profile: {e}")
             return None
@@ -378,15 +873,16 @@ class GmailService:
         with self._lock:
             self.creds = None
             self.service = None
+            self.email = None
             
-            if os.path.exists('backend/token.json'):
+            if self.token_file and os.path.exists(self.token_file):
                 try:
-                    os.remove('backend/token.json')
+                    os.remove(self.token_file)
                 except PermissionError:
                     # Retry once after a short delay, as antivirus or other processes might lock it momentarily
                     time.sleep(0.5)
                     try:
-                        os.remove('backend/token.json')
+                        os.remove(self.token_file)
                     except Exception as e:
                         print(f"CRITICAL: Failed to delete token.json on retry: {e}")
                         raise e # re-raise to notify caller
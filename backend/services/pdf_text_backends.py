@@ -0,0 +1,248 @@
+import io
+import os
+import importlib
+import threading
+from importlib import metadata
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Backends to read PDF text with, in order: when one fails on a document (or finds no text in it)
+# the next is tried. "pdfium" is the fastest; "pdfplumber" is what invoices were always read with.
+PDF_TEXT_BACKENDS = os.getenv("PDF_TEXT_BACKENDS", "pdfplumber,pdfium,pdfminer")
+# Pages read before the last one: dates are near the top of the first pages, totals on the last
+LEADING_PAGES = 2
+
+
+def _package_version(package: str) -> str:
+    try:
+        return metadata.version(package)
+    except metadata.PackageNotFoundError:
+        return "missing"
+
+
+def page_order(page_count: int, max_pages: int = 0) -> List[int]:
+    """
+    Pages in the order they are read: the first LEADING_PAGES, the last, then the rest from
+    the front. With `max_pages` only the first that many of them are read.
+    """
+    leading = list(range(min(LEADING_PAGES, page_count)))
+    rest = list(range(len(leading), page_count))
+    order = leading + rest[-1:] + rest[:-1]
+    return order[:max_pages] if max_pages > 0 else order
+
+
+class PdfTextDocument:
+    """An open PDF whose pages are read one at a time."""
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def page_text(self, index: int) -> str:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PdfTextBackend:
+    """A PDF text library. open() raises if the document can't be read."""
+    name = ""
+    package = ""
+    module = ""
+
+    @property
+    def version(self) -> str:
+        return f"{self.name}-{_package_version(self.package)}"
+
+    def open(self, pdf_bytes: bytes) -> PdfTextDocument:
+        raise NotImplementedError
+
+    def extract_text(self, pdf_bytes: bytes, max_pages: int = 0, enough: Optional[Callable[[str], bool]] = None) -> str:
+        """
+        Text of the pages read (see page_order), in document order, each followed by a newline.
+        `enough(text)` is asked about the text read so far once the first and last pages are in,
+        then each time the number of pages read has doubled; reading stops when it returns True.
+        """
+        return self.read_text(pdf_bytes, max_pages, enough)[0]
+
+    def read_text(self, pdf_bytes: bytes, max_pages: int = 0,
+                  enough: Optional[Callable[[str], bool]] = None) -> Tuple[str, bool]:
+        """extract_text's text, and whether every page of the document is in it."""
+        with self.open(pdf_bytes) as document:
+            order = page_order(len(document), max_pages)
+            pages: Dict[int, str] = {}
+            check_at = LEADING_PAGES + 1
+            for index in order:
+                pages[index] = document.page_text(index)
+                if enough and len(pages) == check_at and len(pages) < len(order):
+                    if enough(self._join(pages)):
+                        break
+                    check_at *= 2
+            return self._join(pages), len(pages) == len(document)
+
+    @staticmethod
+    def _join(pages: Dict[int, str]) -> str:
+        return "".join(pages[index] + "\n" for index in sorted(pages))
+
+
+class _PdfplumberDocument(PdfTextDocument):
+    def __init__(self, pdf_bytes: bytes):
+        import pdfplumber
+        self._pdf = pdfplumber.open(io.BytesIO(pdf_bytes))
+
+    def __len__(self) -> int:
+        return len(self._pdf.pages)
+
+    def page_text(self, index: int) -> str:
+        return self._pdf.pages[index].extract_text() or ""
+
+    def close(self):
+        self._pdf.close()
+
+
+class PdfplumberBackend(PdfTextBackend):
+    """pdfplumber: lays characters out by position. Hebrew comes out in visual (reversed) order."""
+    name = "pdfplumber"
+    package = "pdfplumber"
+    module = "pdfplumber"
+
+    def open(self, pdf_bytes: bytes) -> PdfTextDocument:
+        return _PdfplumberDocument(pdf_bytes)
+
+
+class _PdfminerDocument(PdfTextDocument):
+    def __init__(self, pdf_bytes: bytes):
+        from pdfminer.converter import PDFPageAggregator
+        from pdfminer.layout import LAParams
+        from pdfminer.pdfdocument import PDFDocument
+        from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+        from pdfminer.pdfpage import PDFPage
+        from pdfminer.pdfparser import PDFParser
+
+        document = PDFDocument(PDFParser(io.BytesIO(pdf_bytes)))
+        # Page objects only; their content is parsed in page_text
+        self._pages = list(PDFPage.create_pages(document))
+        self._device = PDFPageAggregator(PDFResourceManager(), laparams=LAParams())
+        self._interpreter = PDFPageInterpreter(self._device.rsrcmgr, self._device)
+
+    def __len__(self) -> int:
+        return len(self._pages)
+
+    def page_text(self, index: int) -> str:
+        from pdfminer.layout import LTTextContainer
+        self._interpreter.process_page(self._pages[index])
+        return "".join(box.get_text() for box in self._device.get_result() if isinstance(box, LTTextContainer))
+
+
+class PdfminerBackend(PdfTextBackend):
+    """pdfminer.six driven directly (pdfplumber runs on it, plus its own character layout on top)."""
+    name = "pdfminer"
+    package = "pdfminer.six"
+    module = "pdfminer.pdfinterp"
+
+    def open(self, pdf_bytes: bytes) -> PdfTextDocument:
+        return _PdfminerDocument(pdf_bytes)
+
+
+# PDFium is not thread-safe: with EXTRACTION_WORKERS=0 several scan threads parse at once
+_pdfium_lock = threading.RLock()
+
+
+class _PdfiumDocument(PdfTextDocument):
+    def __init__(self, pdf_bytes: bytes):
+        import pypdfium2
+        with _pdfium_lock:
+            self._pdf = pypdfium2.PdfDocument(pdf_bytes)
+
+    def __len__(self) -> int:
+        return len(self._pdf)
+
+    def page_text(self, index: int) -> str:
+        with _pdfium_lock:
+            page = self._pdf[index]
+            textpage = page.get_textpage()
+            try:
+                text = textpage.get_text_range()
+            finally:
+                textpage.close()
+                page.close()
+        return text.replace("\r\n", "\n")
+
+    def close(self):
+        with _pdfium_lock:
+            self._pdf.close()
+
+
+class PdfiumBackend(PdfTextBackend):
+    """PDFium (Chrome's PDF engine) through pypdfium2. Hebrew comes out in logical order."""
+    name = "pdfium"
+    package = "pypdfium2"
+    module = "pypdfium2"
+
+    def open(self, pdf_bytes: bytes) -> PdfTextDocument:
+        return _PdfiumDocument(pdf_bytes)
+
+
+BACKENDS: Dict[str, PdfTextBackend] = {
+    backend.name: backend for backend in (PdfplumberBackend(), PdfminerBackend(), PdfiumBackend())
+}
+
+
+class PdfTextExtractor:
+    """
+    Reads PDF text with the first backend that manages to. Parse errors of one backend are
+    printed and the next is tried; a PDF none of them can read gives None.
+    """
+
+    def __init__(self, names: str = PDF_TEXT_BACKENDS):
+        self.backends: List[PdfTextBackend] = []
+        for name in (n.strip() for n in names.split(",")):
+            if name in BACKENDS:
+                self.backends.append(BACKENDS[name])
+            elif name:
+                print(f"Unknown PDF text backend '{name}' ignored (known: {', '.join(BACKENDS)})")
+        if not self.backends:
+            self.backends = [BACKENDS["pdfplumber"]]
+
+    @property
+    def version(self) -> str:
+        # Part of the extraction cache key: other backends (or versions of them) read other text
+        return "+".join(backend.version for backend in self.backends)
+
+    def warm_up(self):
+        """Imports the backends' libraries ahead of the first PDF."""
+        for backend in self.backends:
+            try:
+                importlib.import_module(backend.module)
+            except ImportError as e:
+                print(f"PDF text backend {backend.name} is not available: {e}")
+
+    def extract_text(self, pdf_bytes: bytes, filename: str, max_pages: int = 0,
+                     enough: Optional[Callable[[str], bool]] = None) -> Optional[str]:
+        """Text of the PDF as PdfTextBackend.extract_text reads it, from the first backend that can."""
+        result = self.read_text(pdf_bytes, filename, max_pages, enough)
+        return result[0] if result is not None else None
+
+    def read_text(self, pdf_bytes: bytes, filename: str, max_pages: int = 0,
+                  enough: Optional[Callable[[str], bool]] = None) -> Optional[Tuple[str, bool]]:
+        """(text, every page read) as PdfTextBackend.read_text gives it, or None if no backend can read the PDF."""
+        found: Optional[Tuple[str, bool]] = None
+        for backend in self.backends:
+            try:
+                text, complete = backend.read_text(pdf_bytes, max_pages, enough)
+            # Exception only: a worker's timeout (a BaseException) must stop the whole chain
+            except Exception as e:
+                print(f"Error reading PDF {filename} with {backend.name}: {e}")
+                continue
+            if text.strip():
+                return text, complete
+            # No text: a scanned PDF, or fonts this backend can't map; another one may do better
+            found = found if found is not None else (text, complete)
+        return found
+
+pdf_text_extractor = PdfTextExtractor()
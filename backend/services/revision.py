@@ -0,0 +1,47 @@
+import os
+import threading
+import uuid
+from typing import Callable, Optional
+
+# Revisions restart with the process, so ETags also carry a per-process id
+BOOT_ID = uuid.uuid4().hex[:8]
+
+
+def file_token(path: str) -> Optional[tuple]:
+    """Cheap change detector for a file: (mtime, size), or None if it does not exist."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+class RevisionTracker:
+    """
+    Monotonically increasing revision for a store.
+    Bumped by the store after each of its own writes, and whenever the backing
+    token (file stats, database version, ...) moves because of an outside edit.
+    Checking it never loads the store's data.
+    """
+
+    def __init__(self, token_fn: Callable[[], object]):
+        self._token_fn = token_fn
+        self._lock = threading.Lock()
+        self._revision = 0
+        self._token = object() # Never equal: the first check starts at revision 1
+
+    def bump(self):
+        with self._lock:
+            self._revision += 1
+            self._token = self._token_fn()
+
+    def current(self) -> int:
+        with self._lock:
+            token = self._token_fn()
+            if token != self._token:
+                self._revision += 1
+                self._token = token
+            return self._revision
+
+    def etag(self, name: str) -> str:
+        return f'W/"{name}-{BOOT_ID}-{self.current()}"'
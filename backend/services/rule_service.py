@@ -2,14 +2,21 @@
 import json
 import os
 import uuid
-from typing import List, Optional
+from types import SimpleNamespace
+from typing import Iterable, List, Optional, Set
 from ..models import Rule, InvoiceData
+from .revision import RevisionTracker, file_token
 
 RULES_FILE = "backend/data/rules.json"
+# Message ids whose invoices the current rules deleted, so scans don't fetch them again
+REJECTED_IDS_FILE = "backend/data/rejected_ids.json"
+# Invoice fields that come straight from email headers (known before anything is downloaded)
+HEADER_FIELDS = {"sender_email", "subject"}
 
 class RuleService:
     def __init__(self):
         self._ensure_file()
+        self.revision = RevisionTracker(lambda: file_token(RULES_FILE))
 
     def _ensure_file(self):
         if not os.path.exists(RULES_FILE):
@@ -25,6 +32,26 @@ class RuleService:
     def _save_rules(self, rules: List[Rule]):
         with open(RULES_FILE, "w") as f:
             json.dump([rule.dict() for rule in rules], f, indent=2)
+        self.revision.bump()
+        # Different rules may keep what the old ones deleted
+        if os.path.exists(REJECTED_IDS_FILE):
+            os.remove(REJECTED_IDS_FILE)
+
+    def get_rejected_ids(self) -> Set[str]:
+        """Ids of scanned messages that the rules (as they are now) deleted."""
+        try:
+            with open(REJECTED_IDS_FILE, "r") as f:
+                return set(json.load(f))
+        except FileNotFoundError:
+            return set()
+
+    def add_rejected_ids(self, invoice_ids: Iterable[str]):
+        new_ids = set(invoice_ids)
+        if not new_ids:
+            return
+        rejected = self.get_rejected_ids() | new_ids
+        with open(REJECTED_IDS_FILE, "w") as f:
+            json.dump(sorted(rejected), f)
 
     def create_rule(self, rule: Rule) -> Rule:
         if not rule.id:
@@ -65,6 +92,25 @@ class RuleService:
                         return True
         return False
 
+    def rejects_headers(self, sender: str, subject: str) -> bool:
+        """
+        True if a delete rule is sure to drop the invoice of an email with this sender and
+        subject, whatever its other fields turn out to be (so it need not be downloaded).
+        """
+        preview = SimpleNamespace(sender_email=sender, subject=subject)
+        for rule in self.get_all_rules():
+            if not rule.is_active or not any(a.action_type == "delete_invoice" for a in rule.actions):
+                continue
+            header_conditions = [c for c in rule.conditions if c.field in HEADER_FIELDS]
+            if getattr(rule, 'logic', 'AND') == 'OR':
+                # One matching condition is enough, so the header ones decide on their own
+                if header_conditions and self._check_conditions(rule.model_copy(update={"conditions": header_conditions}), preview):
+                    return True
+            elif rule.conditions and len(header_conditions) == len(rule.conditions):
+                if self._check_conditions(rule, preview):
+                    return True
+        return False
+
     def apply_rules(self, invoice: InvoiceData) -> Optional[InvoiceData]:
         rules = self.get_all_rules()
         
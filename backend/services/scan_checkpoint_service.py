@@ -0,0 +1,130 @@
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+SCAN_CHECKPOINTS_FILE = "backend/data/scan_checkpoints.json"
+# Progress is written out at most this often while a scan runs; an unfinished scan saves on its way out
+CHECKPOINT_SAVE_SECONDS = 2.0
+
+class ScanCheckpoint:
+    """
+    Progress of one paged scan, kept so an interrupted scan can resume where it stopped.
+    The resume point is the page token after the last listed page, plus the ids listed
+    before it that are not finished yet: only those are tried again, so the saved state
+    stays as small as the work left, however long the scan has run.
+    Messages that fail are left unfinished, so a resumed scan tries them again.
+    """
+
+    def __init__(self, key: str, store: "ScanCheckpointService", state: Optional[Dict] = None):
+        state = state or {}
+        self.key = key
+        self.store = store
+        self.history_id: Optional[str] = state.get("history_id")
+        self.started_at: float = state.get("started_at") or time.time()
+        self.listed: int = state.get("listed", 0)
+        # Where listing resumes, whether it had reached the end, and what was listed but not finished
+        self.resume_token: Optional[str] = state.get("page_token")
+        self.listing_done: bool = state.get("listing_done", False)
+        self.resume_pending: List[str] = state.get("pending_ids", [])
+        self._pending = set(self.resume_pending)
+        self._next_token: Optional[str] = self.resume_token
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._saved_at = 0.0
+        self._closed = False
+
+    @property
+    def resumed(self) -> bool:
+        return bool(self.resume_token or self.resume_pending or self.listing_done)
+
+    def page_listed(self, page_token: Optional[str], next_page_token: Optional[str], ids: Iterable[str]):
+        """Records a listed page: its ids are pending until finished, listing resumes at `next_page_token`."""
+        with self._lock:
+            new = [msg_id for msg_id in ids if msg_id not in self._pending]
+            self._pending.update(new)
+            self.listed += len(new)
+            self._next_token = next_page_token
+            self.listing_done = next_page_token is None
+        self._save_soon()
+
+    def finished(self, ids: Iterable[str]):
+        """Marks messages as done (saved, skipped or rejected)."""
+        with self._lock:
+            self._pending.difference_update(ids)
+        self._save_soon()
+
+    def state(self) -> Dict:
+        with self._lock:
+            return {
+                "page_token": self._next_token,
+                "listing_done": self.listing_done,
+                "pending_ids": sorted(self._pending),
+                "listed": self.listed,
+                "history_id": self.history_id,
+                "started_at": self.started_at,
+                "updated_at": time.time(),
+            }
+
+    def _save_soon(self):
+        if time.monotonic() - self._saved_at >= CHECKPOINT_SAVE_SECONDS:
+            self.save()
+
+    def save(self):
+        # Serialized so an older state never overwrites a newer one
+        with self._save_lock:
+            if not self._closed:
+                self._saved_at = time.monotonic()
+                self.store.save(self.key, self.state())
+
+    def clear(self):
+        """Removes the checkpoint once the scan is complete; later updates are ignored."""
+        with self._save_lock:
+            self._closed = True
+            self.store.clear(self.key)
+
+
+class ScanCheckpointService:
+    """Checkpoints of unfinished scans, by scan key (account and query)."""
+
+    def __init__(self, checkpoints_file: str = SCAN_CHECKPOINTS_FILE):
+        self.checkpoints_file = checkpoints_file
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict:
+        try:
+            with open(self.checkpoints_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            print(f"Error reading scan checkpoints, starting over: {e}")
+            return {}
+
+    def _save(self, data: Dict):
+        os.makedirs(os.path.dirname(self.checkpoints_file), exist_ok=True)
+        tmp_file = self.checkpoints_file + ".tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_file, self.checkpoints_file)
+
+    def open(self, key: str) -> ScanCheckpoint:
+        """The saved checkpoint for `key` (resuming it), or a fresh one."""
+        with self._lock:
+            state = self._load().get(key)
+        return ScanCheckpoint(key, self, state)
+
+    def save(self, key: str, state: Dict):
+        with self._lock:
+            data = self._load()
+            data[key] = state
+            self._save(data)
+
+    def clear(self, key: str):
+        with self._lock:
+            data = self._load()
+            if data.pop(key, None) is not None:
+                self._save(data)
+
+scan_checkpoint_service = ScanCheckpointService()
@@ -0,0 +1,307 @@
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from typing import Iterable, List, Optional
+from backend.models import InvoiceData, ScanResult, ScanJobInfo
+from backend.services.gmail_service import GmailService, ScanContext
+from backend.services.gmail_account_service import gmail_account_service
+from backend.services.storage_service import storage_service
+from backend.services.rule_service import rule_service
+from backend.services.sync_state_service import sync_state_service
+
+# While a scan runs, invoices are saved in batches of this size (or this often)
+SAVE_EVERY = 25
+SAVE_INTERVAL_SECONDS = 2.0
+# Finished jobs kept in memory for status queries
+MAX_FINISHED_JOBS = 50
+FINISHED_STATUSES = ("done", "cancelled", "failed")
+# Accounts scanned side by side save through one writer, a batch at a time
+_save_lock = threading.Lock()
+
+
+def save_scan_results(invoices: List[InvoiceData], skipped_ids: Iterable[str] = (), rejected_ids: Iterable[str] = ()) -> List[InvoiceData]:
+    """
+    Merges scanned invoices into history and returns them as stored.
+    If an invoice already exists in history we prefer the stored version (it has the right
+    status and maybe manual edits); new ones go through the rules first.
+    `skipped_ids` were known and not fetched; `rejected_ids` were dropped by rules from their headers.
+    """
+    final_invoices = []
+    skipped_ids = list(skipped_ids)
+    rejected_ids = list(rejected_ids)
+    newly_rejected = list(rejected_ids)
+
+    # One load + one write for the whole batch instead of a read/write per message
+    with storage_service.batch([inv.id for inv in invoices] + skipped_ids + rejected_ids) as batch:
+        # Dropped by a delete rule from the headers alone (not downloaded): same as should_delete
+        for invoice_id in rejected_ids:
+            if batch.get_by_id(invoice_id):
+                batch.delete_invoice(invoice_id)
+
+        for fresh_inv in invoices:
+            existing = batch.get_by_id(fresh_inv.id)
+            if existing:
+                if fresh_inv.account and not existing.account:
+                    batch.update_invoice(existing.id, {"account": fresh_inv.account})
+                    existing.account = fresh_inv.account
+                # Backfill the URL if we downloaded a PDF now and the stored one has none
+                if fresh_inv.download_url and not existing.download_url:
+                    batch.update_invoice(existing.id, {"download_url": fresh_inv.download_url, "attachment_sha256": fresh_inv.attachment_sha256})
+                    existing.download_url = fresh_inv.download_url
+                    existing.attachment_sha256 = fresh_inv.attachment_sha256
+
+                # Check if it should be deleted by rules (even if existing)
+                if rule_service.should_delete(existing):
+                    batch.delete_invoice(existing.id)
+                    newly_rejected.append(existing.id)
+                else:
+                    final_invoices.append(existing)
+            else:
+                # NEW Invoice found! Apply rules here.
+                processed_inv = rule_service.apply_rules(fresh_inv)
+                if processed_inv:
+                    batch.save_invoice(processed_inv)
+                    final_invoices.append(processed_inv)
+                else:
+                    newly_rejected.append(fresh_inv.id)
+
+        # Known emails were not fetched again; report their stored invoice
+        for invoice_id in skipped_ids:
+            existing = batch.get_by_id(invoice_id)
+            if not existing:
+                continue # Deleted by rules on an earlier scan
+            if rule_service.should_delete(existing):
+                batch.delete_invoice(existing.id)
+                newly_rejected.append(existing.id)
+            else:
+                final_invoices.append(existing)
+
+    rule_service.add_rejected_ids(newly_rejected)
+    return final_invoices
+
+
+def run_scan(start_date: date, end_date: date, incremental: bool = False, refresh: bool = False,
+             scan: Optional[ScanContext] = None, accounts: Optional[List[str]] = None) -> ScanResult:
+    """
+    Scans Gmail and saves the invoices to history while the scan is still running, so a
+    cancelled or failed scan keeps what it got. An account's sync point only moves
+    forward when its scan completes.
+    `accounts` (email addresses, default: every signed-in account) are scanned concurrently,
+    each through its own rate limiter, so several mailboxes take about as long as the
+    slowest one. An account that fails does not stop the others (see failed_accounts).
+    """
+    scan = scan or ScanContext()
+    scan.reject_early = rule_service.rejects_headers
+    services = gmail_account_service.services(accounts)
+    if len(services) == 1:
+        return _scan_account(services[0], start_date, end_date, incremental, refresh, scan)
+
+    children = [scan.child() for _ in services]
+    with ThreadPoolExecutor(max_workers=len(services), thread_name_prefix="scan-account") as executor:
+        futures = [executor.submit(_scan_account, service, start_date, end_date, incremental, refresh, child)
+                   for service, child in zip(services, children)]
+    results, failed_accounts, errors = [], [], []
+    for service, future in zip(services, futures):
+        try:
+            results.append(future.result())
+        except Exception as e:
+            print(f"Scan of {service.email or 'Gmail account'} failed: {e}")
+            failed_accounts.append(service.email or "unknown")
+            errors.append(e)
+    if not results:
+        raise errors[0]
+
+    invoices = [inv for result in results for inv in result.invoices]
+    return ScanResult(
+        total_emails_scanned=sum(result.total_emails_scanned for result in results),
+        invoices_found=len(invoices),
+        invoices=invoices,
+        accounts=[result.account for result in results],
+        failed_accounts=failed_accounts,
+        incremental=all(result.incremental for result in results),
+        bytes_saved=sum(result.bytes_saved for result in results),
+        failed_emails=sum(result.failed_emails for result in results),
+    )
+
+
+def _scan_account(service: GmailService, start_date: date, end_date: date, incremental: bool, refresh: bool,
+                  scan: ScanContext) -> ScanResult:
+    pending: List[InvoiceData] = []
+    saved: List[InvoiceData] = []
+    last_save = time.monotonic()
+
+    def save(invoices, skipped_ids=(), rejected_ids=()):
+        with _save_lock:
+            return save_scan_results(invoices, skipped_ids, rejected_ids)
+
+    def flush():
+        nonlocal last_save
+        start = time.perf_counter()
+        saved.extend(save(pending))
+        scan.add_time("save", time.perf_counter() - start)
+        scan.count("saved", len(pending))
+        scan.finished([inv.id for inv in pending])
+        pending.clear()
+        last_save = time.monotonic()
+
+    def on_invoice(invoice: InvoiceData):
+        pending.append(invoice)
+        if len(pending) >= SAVE_EVERY or time.monotonic() - last_save >= SAVE_INTERVAL_SECONDS:
+            flush()
+
+    def known_ids(ids):
+        return storage_service.existing_ids(ids) | (rule_service.get_rejected_ids() & set(ids))
+
+    scan.on_invoice = on_invoice
+    scan_started = time.time()
+    try:
+        scan_result = service.scan_invoices(
+            start_date, end_date, incremental=incremental, known_ids=None if refresh else known_ids, scan=scan
+        )
+    finally:
+        if pending:
+            flush()
+
+    final_invoices = saved + save([], scan_result.skipped_ids, scan_result.rejected_ids)
+    # Saved in the order they were finished; report them in Gmail's order like before
+    order = {inv.id: n for n, inv in enumerate(scan_result.invoices)}
+    final_invoices.sort(key=lambda inv: order.get(inv.id, len(order)))
+
+    # Only a complete scan moves the account's sync point forward
+    if not scan.cancelled.is_set() and not scan_result.failed_emails and scan_result.account and scan_result.history_id:
+        sync_state_service.set_history_id(scan_result.account, scan_result.history_id, synced_at=scan_started)
+
+    return ScanResult(
+        total_emails_scanned=scan_result.total_emails_scanned,
+        invoices_found=len(final_invoices),
+        invoices=final_invoices,
+        account=scan_result.account,
+        accounts=[scan_result.account] if scan_result.account else [],
+        incremental=scan_result.incremental,
+        history_id=scan_result.history_id,
+        bytes_saved=scan_result.bytes_saved,
+        failed_emails=scan_result.failed_emails,
+    )
+
+
+class ScanJob:
+    """A scan running in the background. Progress is readable at any time; waiters are woken on every change."""
+
+    def __init__(self, start_date: date, end_date: date, incremental: bool = False, refresh: bool = False,
+                 accounts: Optional[List[str]] = None):
+        self.id = uuid.uuid4().hex[:12]
+        self.status = "queued"
+        self.start_date = start_date
+        self.end_date = end_date
+        self.incremental = incremental
+        self.refresh = refresh
+        self.accounts = accounts
+        self.created_at = datetime.now()
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.result: Optional[ScanResult] = None
+        self.error: Optional[str] = None
+        self.scan = ScanContext(on_progress=self._touch)
+        # Bumped on every change, so event streams know when there is something new
+        self.version = 0
+        self._changed = threading.Condition()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
+
+    def _touch(self):
+        with self._changed:
+            self.version += 1
+            self._changed.notify_all()
+
+    def set_status(self, status: str, error: Optional[str] = None):
+        self.status = status
+        self.error = error
+        if status == "running":
+            self.started_at = datetime.now()
+        elif status in FINISHED_STATUSES:
+            self.finished_at = datetime.now()
+        self._touch()
+
+    def wait_for_change(self, seen_version: int, timeout: float) -> int:
+        """Blocks until the job changes past `seen_version` (or the timeout) and returns the current version."""
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != seen_version, timeout)
+            return self.version
+
+    def info(self) -> ScanJobInfo:
+        progress = self.scan.progress()
+        return ScanJobInfo(
+            id=self.id,
+            status=self.status,
+            start_date=self.start_date,
+            end_date=self.end_date,
+            incremental=self.incremental,
+            refresh=self.refresh,
+            accounts=self.accounts,
+            created_at=self.created_at,
+            started_at=self.started_at,
+            finished_at=self.finished_at,
+            counts=progress["counts"],
+            timings=progress["timings"],
+            total_emails_scanned=self.result.total_emails_scanned if self.result else None,
+            invoices_found=self.result.invoices_found if self.result else None,
+            error=self.error,
+        )
+
+
+class ScanJobService:
+    """Runs scans in background workers (one at a time by default) and keeps track of them."""
+
+    def __init__(self, workers: int = 1):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scan-job")
+        self._jobs: "OrderedDict[str, ScanJob]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start(self, start_date: date, end_date: date, incremental: bool = False, refresh: bool = False,
+              accounts: Optional[List[str]] = None) -> ScanJob:
+        job = ScanJob(start_date, end_date, incremental, refresh, accounts)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(self._run, job)
+        return job
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[ScanJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list_jobs(self) -> List[ScanJob]:
+        with self._lock:
+            return list(reversed(self._jobs.values()))
+
+    def cancel(self, job_id: str) -> Optional[ScanJob]:
+        """Stops the job. Invoices saved so far stay saved."""
+        job = self.get(job_id)
+        if job and not job.finished:
+            job.scan.cancel()
+            if job.status == "queued":
+                job.set_status("cancelled")
+        return job
+
+    def _run(self, job: ScanJob):
+        if job.scan.cancelled.is_set():
+            return
+        job.set_status("running")
+        try:
+            job.result = run_scan(job.start_date, job.end_date, job.incremental, job.refresh, scan=job.scan, accounts=job.accounts)
+            job.set_status("cancelled" if job.scan.cancelled.is_set() else "done")
+        except Exception as e:
+            print(f"Scan job {job.id} failed: {e}")
+            job.set_status("failed", error=str(e))
+
+scan_job_service = ScanJobService()
@@ -0,0 +1,138 @@
+import queue
+import threading
+import time
+from typing import Callable, Iterable, Iterator, List, Optional
+
+# Marks the end of a stage's input
+_DONE = object()
+
+
+class Stage:
+    """
+    One step of a Pipeline: `workers` threads applying `fn` to items from a bounded queue.
+    `fn` returns an iterable of items for the next stage (empty or None drops the item).
+    """
+
+    def __init__(self, name: str, fn: Callable[[object], Optional[Iterable]], workers: int = 1, queue_size: int = 100):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.inbox = queue.Queue(maxsize=max(1, queue_size))
+        self.processed = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self._running = self.workers
+        self._lock = threading.Lock()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"processed": self.processed, "failed": self.failed, "busy_seconds": round(self.busy_seconds, 3)}
+
+
+class Pipeline:
+    """
+    Chain of stages connected by bounded queues, so slow stages push back on fast ones
+    and network waits in one stage overlap with CPU work in another.
+    A failing item is logged and dropped; the rest keep flowing.
+    """
+
+    def __init__(self, stages: List[Stage], output_size: int = 100):
+        self.stages = stages
+        self.output = queue.Queue(maxsize=max(1, output_size))
+        self.cancelled = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def cancel(self):
+        """Stops taking new items. Items already past the last stage are still returned."""
+        self.cancelled.set()
+
+    def _put(self, target: queue.Queue, item) -> bool:
+        # Blocking put that gives up once the pipeline is cancelled (nobody may be reading anymore)
+        while not self.cancelled.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _next_queue(self, index: int) -> queue.Queue:
+        return self.stages[index + 1].inbox if index + 1 < len(self.stages) else self.output
+
+    def _worker(self, index: int):
+        stage = self.stages[index]
+        downstream = self._next_queue(index)
+        while True:
+            item = stage.inbox.get()
+            if item is _DONE:
+                break
+            if self.cancelled.is_set():
+                continue # Drain so producers blocked on this queue can finish
+            start = time.perf_counter()
+            try:
+                results = list(stage.fn(item) or ())
+            except Exception as e:
+                print(f"Error in {stage.name} stage: {e}")
+                with stage._lock:
+                    stage.failed += 1
+                    stage.busy_seconds += time.perf_counter() - start
+                continue
+            with stage._lock:
+                stage.processed += 1
+                stage.busy_seconds += time.perf_counter() - start
+            for result in results:
+                if not self._put(downstream, result):
+                    break
+
+        # The last worker of a stage to finish tells every worker of the next stage
+        with stage._lock:
+            stage._running -= 1
+            last = stage._running == 0
+        if last:
+            if index + 1 < len(self.stages):
+                for _ in range(self.stages[index + 1].workers):
+                    self._next_queue(index).put(_DONE)
+            else:
+                self.output.put(_DONE)
+
+    def _feed(self, items: Iterable):
+        first = self.stages[0]
+        try:
+            for item in items:
+                if not self._put(first.inbox, item):
+                    break
+        except Exception as e:
+            print(f"Error producing pipeline input: {e}")
+        finally:
+            for _ in range(first.workers):
+                first.inbox.put(_DONE)
+
+    def run(self, items: Iterable) -> Iterator:
+        """Feeds `items` through every stage and yields what comes out of the last one."""
+        for index, stage in enumerate(self.stages):
+            for n in range(stage.workers):
+                thread = threading.Thread(target=self._worker, args=(index,), name=f"scan-{stage.name}-{n}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        feeder = threading.Thread(target=self._feed, args=(items,), name="scan-feed", daemon=True)
+        feeder.start()
+        self._threads.append(feeder)
+
+        try:
+            while True:
+                result = self.output.get()
+                if result is _DONE:
+                    break
+                yield result
+        finally:
+            # Consumer stopped early: unblock everything upstream
+            if any(thread.is_alive() for thread in self._threads):
+                self.cancel()
+                while any(thread.is_alive() for thread in self._threads):
+                    try:
+                        self.output.get(timeout=0.1)
+                    except queue.Empty:
+                        pass
+
+    def stats(self) -> dict:
+        return {stage.name: stage.stats() for stage in self.stages}
@@ -0,0 +1,103 @@
+import re
+import bisect
+from typing import Dict, Iterable, List, Set
+from backend.models import InvoiceData
+
+# Fields that are searchable, in the order they are tokenized
+SEARCH_FIELDS = ("subject", "vendor_name", "sender_email", "comments")
+
+# Prefix queries shorter than this only match whole words (a 1-letter prefix matches everything)
+MIN_PREFIX_LENGTH = 2
+
+_TOKEN_RE = re.compile(r"\w+")
+# Hebrew vowel points & cantillation marks (but not maqaf/paseq/sof pasuq, which separate words)
+_NIQQUD_RE = re.compile("[\u0591-\u05BD\u05BF\u05C1\u05C2\u05C4\u05C5\u05C7]")
+# Quote marks inside words: gershayim/geresh (בע"מ, ח'), apostrophes (don't)
+_INNER_QUOTES_RE = re.compile("[\"'\u05F3\u05F4\u2019]")
+# Final forms -> regular forms, so "חשבון" matches "חשבונות"
+_FINAL_LETTERS = str.maketrans("ךםןףץ", "כמנפצ")
+# One-letter prefixes attached to Hebrew words (and, the, in, to, from, that, as)
+_HEBREW_PREFIXES = "והבלמשכ"
+_HEBREW_LETTER_RE = re.compile("[\u05D0-\u05EA]")
+
+
+def tokenize(text: str) -> List[str]:
+    """Splits text into normalized search tokens (lowercase English, normalized Hebrew)."""
+    if not text:
+        return []
+    text = _NIQQUD_RE.sub("", text)
+    text = _INNER_QUOTES_RE.sub("", text)
+    text = text.lower().translate(_FINAL_LETTERS)
+    return _TOKEN_RE.findall(text)
+
+
+def _index_terms(token: str) -> Iterable[str]:
+    yield token
+    # "לחשבונית" should also be found as "חשבונית"
+    if len(token) >= 3 and token[0] in _HEBREW_PREFIXES and _HEBREW_LETTER_RE.match(token[1]):
+        yield token[1:]
+
+
+class SearchIndex:
+    """
+    In-memory inverted index over the searchable invoice fields.
+    Updated incrementally: add() replaces whatever was indexed for that id.
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Set[str]] = {}
+        self._terms_by_id: Dict[str, Set[str]] = {}
+        # Sorted vocabulary for prefix lookups
+        self._vocabulary: List[str] = []
+
+    def add(self, invoice: InvoiceData):
+        self.remove(invoice.id)
+        terms = set()
+        for field in SEARCH_FIELDS:
+            for token in tokenize(getattr(invoice, field, None)):
+                terms.update(_index_terms(token))
+        for term in terms:
+            ids = self._postings.get(term)
+            if ids is None:
+                ids = self._postings[term] = set()
+                bisect.insort(self._vocabulary, term)
+            ids.add(invoice.id)
+        self._terms_by_id[invoice.id] = terms
+
+    def remove(self, invoice_id: str):
+        terms = self._terms_by_id.pop(invoice_id, None)
+        if not terms:
+            return
+        for term in terms:
+            ids = self._postings[term]
+            ids.discard(invoice_id)
+            if not ids:
+                del self._postings[term]
+                pos = bisect.bisect_left(self._vocabulary, term)
+                del self._vocabulary[pos]
+
+    def _match_token(self, token: str) -> Set[str]:
+        if len(token) < MIN_PREFIX_LENGTH:
+            return set(self._postings.get(token, ()))
+        matched = set()
+        vocabulary = self._vocabulary
+        pos = bisect.bisect_left(vocabulary, token)
+        # Walk the sorted vocabulary in place; slicing it would copy every later term
+        while pos < len(vocabulary) and vocabulary[pos].startswith(token):
+            matched |= self._postings[vocabulary[pos]]
+            pos += 1
+        return matched
+
+    def search(self, query: str) -> Set[str]:
+        """Ids of invoices matching every query word (each word also as a prefix)."""
+        tokens = tokenize(query)
+        if not tokens:
+            return set()
+        # Most selective words first so the intersection shrinks quickly
+        result = None
+        for token in sorted(set(tokens), key=len, reverse=True):
+            matched = self._match_token(token)
+            result = matched if result is None else result & matched
+            if not result:
+                break
+        return result or set()
@@ -1,12 +1,14 @@
 import json
 import os
 from typing import List, Dict
+from .revision import RevisionTracker, file_token
 
 SETTINGS_FILE = "backend/data/settings.json"
 
 class SettingsService:
     def __init__(self):
         self._ensure_settings()
+        self.revision = RevisionTracker(lambda: file_token(SETTINGS_FILE))
 
     def _ensure_settings(self):
         os.makedirs(os.path.dirname(SETTINGS_FILE), exist_ok=True)
@@ -24,6 +26,7 @@ class SettingsService:
     def _save(self, data: Dict):
         with open(SETTINGS_FILE, 'w', encoding='utf-8') as f:
             json.dump(data, f, indent=2)
+        self.revision.bump()
 
     def get_labels(self) -> List[str]:
         data = self._load()
@@ -0,0 +1,720 @@
+import json
+import os
+import sqlite3
+import sys
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+from backend.models import InvoiceQuery
+
+JSON_DB_FILE = "backend/data/invoices.json"
+SQLITE_DB_FILE = "backend/data/invoices.db"
+
+# Fold the journal into a fresh invoices.json once it grows past this size
+JOURNAL_COMPACT_BYTES = 1024 * 1024
+
+# On-disk record schema. Bump it and add a migration below when the stored shape changes;
+# backends upgrade their data once when they open it, so readers can trust stored records.
+SCHEMA_VERSION = 2
+
+
+def _migrate_v1(record: dict) -> dict:
+    # v1 -> v2: is_processed flag replaced by status
+    if "status" not in record:
+        record["status"] = "Processed" if record.get("is_processed") is True else "Pending"
+    record.pop("is_processed", None)
+    return record
+
+# from-version -> migration to from-version + 1
+SCHEMA_MIGRATIONS = {
+    1: _migrate_v1,
+}
+
+
+def upgrade_record(record: dict, from_version: int) -> dict:
+    for version in range(from_version, SCHEMA_VERSION):
+        record = SCHEMA_MIGRATIONS[version](record)
+    return record
+
+
+def vendor_sort_key(vendor_name: Optional[str]) -> str:
+    """
+    How vendors sort, case-insensitively. Computed here rather than with SQLite's lower(),
+    which folds ASCII letters only, so both backends order (and page through) vendors alike.
+    """
+    return (vendor_name or "").lower()
+
+
+def read_json_snapshot(json_file: str) -> Tuple[int, Dict[str, dict]]:
+    """Reads an invoices.json snapshot. Returns (schema version, ID -> record)."""
+    with open(json_file, 'r', encoding='utf-8') as f:
+        raw = json.load(f)
+    if isinstance(raw.get("schema_version"), int) and isinstance(raw.get("invoices"), dict):
+        return raw["schema_version"], raw["invoices"]
+    # Legacy (v1): a bare ID -> Invoice mapping
+    return 1, raw
+
+
+def replay_journal(journal_file: str, data: Dict[str, dict]) -> Tuple[int, Optional[int]]:
+    """
+    Applies an invoices.journal to `data` in place; never writes the file.
+    Returns (entries replayed, byte offset of a torn last line to cut off, or None).
+    """
+    if not os.path.exists(journal_file):
+        return 0, None
+    offset = 0
+    replayed = 0
+    bad_offset = None
+    with open(journal_file, 'rb') as f:
+        for line in f:
+            if bad_offset is not None:
+                # Entries follow the bad line, so it is corruption, not a torn append:
+                # skip it, but never cut off the writes after it
+                print(f"Journal: skipping corrupt entry at byte {bad_offset} of {journal_file} "
+                      f"(it is left out of the next compaction)")
+                bad_offset = None
+            try:
+                # A crash mid-append leaves a torn last line: no newline and/or invalid JSON
+                if not line.endswith(b"\n"):
+                    raise ValueError("no newline")
+                JsonStorageBackend._apply_entry(data, json.loads(line))
+                replayed += 1
+            except (ValueError, KeyError, TypeError, AttributeError):
+                bad_offset = offset
+            offset += len(line)
+    return replayed, bad_offset
+
+
+class ClosingIterator:
+    """
+    Iterates over `iterable` and calls `close` once: when it is exhausted, fails, or close()
+    is called. Unlike a generator's close(), that also runs when iteration never started.
+    """
+
+    def __init__(self, iterable: Iterable, close: Optional[Callable[[], None]] = None):
+        self._iterator = iter(iterable)
+        self._close = close
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._iterator)
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        close, self._close = self._close, None
+        if close is not None:
+            close()
+
+
+class StorageBackend:
+    """
+    Raw record store behind StorageService.
+    Records are JSON-ready dicts (dates already serialized) keyed by invoice id.
+    """
+
+    def load_all(self) -> Dict[str, dict]:
+        raise NotImplementedError
+
+    def get(self, invoice_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def get_many(self, invoice_ids: Iterable[str]) -> Dict[str, dict]:
+        found = {}
+        for invoice_id in invoice_ids:
+            record = self.get(invoice_id)
+            if record is not None:
+                found[invoice_id] = record
+        return found
+
+    def existing_ids(self, invoice_ids: Iterable[str]) -> Set[str]:
+        """Which of the given ids are stored, without loading their records if possible."""
+        return set(self.get_many(invoice_ids))
+
+    def put(self, invoice_id: str, record: dict):
+        raise NotImplementedError
+
+    def put_many(self, records: Iterable[Tuple[str, dict]]):
+        for invoice_id, record in records:
+            self.put(invoice_id, record)
+
+    def patch(self, invoice_id: str, updates: dict) -> Optional[dict]:
+        raise NotImplementedError
+
+    def delete(self, invoice_id: str) -> bool:
+        raise NotImplementedError
+
+    def apply(self, puts: Dict[str, dict], deletes: Iterable[str]):
+        """Applies a batch of upserts and deletes as a single write."""
+        raise NotImplementedError
+
+    def count(self) -> int:
+        return len(self.load_all())
+
+    def version_token(self):
+        """
+        Cheap value that changes whenever the stored data may have changed,
+        including edits made outside this process. Used to invalidate caches.
+        """
+        raise NotImplementedError
+
+
+class JsonStorageBackend(StorageBackend):
+    """
+    invoices.json snapshot plus an append-only journal next to it.
+    Every mutation appends one JSON line per put/patch/delete to the journal
+    instead of rewriting the snapshot. On startup the snapshot is loaded and
+    the journal replayed into memory; once the journal grows past
+    `compact_bytes` it is folded into a fresh snapshot in a background thread.
+    """
+
+    def __init__(self, db_file: str = JSON_DB_FILE, journal_file: Optional[str] = None,
+                 compact_bytes: int = JOURNAL_COMPACT_BYTES):
+        self.db_file = db_file
+        self.journal_file = journal_file or os.path.splitext(db_file)[0] + ".journal"
+        self.compact_bytes = compact_bytes
+        self._lock = threading.RLock()
+        self._compacting = False
+        # Moves whenever the in-memory data changes (our writes or an external edit)
+        self._generation = 0
+        self._ensure_db()
+        with self._lock:
+            self._reload()
+        self._maybe_compact()
+
+    def _ensure_db(self):
+        os.makedirs(os.path.dirname(self.db_file), exist_ok=True)
+        if not os.path.exists(self.db_file):
+             with open(self.db_file, 'w', encoding='utf-8') as f:
+                 json.dump({"schema_version": SCHEMA_VERSION, "invoices": {}}, f) # ID -> Invoice Mapping
+
+    def _load(self) -> Tuple[int, Dict[str, dict]]:
+        return read_json_snapshot(self.db_file)
+
+    def _file_stats(self) -> tuple:
+        stats = []
+        for path in (self.db_file, self.journal_file):
+            try:
+                st = os.stat(path)
+                stats.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                stats.append(None)
+        return tuple(stats)
+
+    def _journal_size(self) -> int:
+        try:
+            return os.path.getsize(self.journal_file)
+        except FileNotFoundError:
+            return 0
+
+    @staticmethod
+    def _apply_entry(data: Dict[str, dict], entry: dict):
+        op = entry.get("op")
+        invoice_id = entry.get("id")
+        if op == "put":
+            data[invoice_id] = entry["record"]
+        elif op == "patch":
+            if invoice_id in data:
+                # Never mutate records in place: compaction may be serializing them
+                data[invoice_id] = {**data[invoice_id], **entry["updates"]}
+        elif op == "delete":
+            data.pop(invoice_id, None)
+
+    def _replay_journal(self, data: Dict[str, dict]):
+        replayed, torn_offset = replay_journal(self.journal_file, data)
+        if torn_offset is not None:
+            print(f"Journal: dropping {self._journal_size() - torn_offset} bytes of truncated trailing record")
+            with open(self.journal_file, 'r+b') as f:
+                f.truncate(torn_offset)
+                f.flush()
+                os.fsync(f.fileno())
+        if replayed:
+            print(f"Journal: replayed {replayed} entries on top of {self.db_file}")
+
+    def _reload(self):
+        version, data = self._load()
+        self._replay_journal(data)
+        if version < SCHEMA_VERSION:
+            data = {invoice_id: upgrade_record(record, version) for invoice_id, record in data.items()}
+        self._data = data
+        self._stats = self._file_stats()
+        self._generation += 1
+        if version < SCHEMA_VERSION:
+            # Persist the upgrade right away so it only ever runs once
+            print(f"Upgrading {self.db_file} from schema v{version} to v{SCHEMA_VERSION}")
+            self.compact()
+
+    def _check_external(self):
+        # Someone edited invoices.json (or the journal) behind our back
+        if self._file_stats() != self._stats:
+            self._reload()
+
+    def _append(self, entries: List[dict]):
+        # Serialize first so a bad record never leaves a partial line behind
+        lines = "".join(json.dumps(e, ensure_ascii=False, default=str) + "\n" for e in entries)
+        with self._lock:
+            self._check_external()
+            with open(self.journal_file, 'a', encoding='utf-8') as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+            for line in lines.splitlines():
+                # Apply the serialized form so memory matches what a replay would produce
+                self._apply_entry(self._data, json.loads(line))
+            self._stats = self._file_stats()
+            self._generation += 1
+        self._maybe_compact()
+
+    def _maybe_compact(self):
+        with self._lock:
+            if self._compacting or self._journal_size() < self.compact_bytes:
+                return
+            self._compacting = True
+        threading.Thread(target=self._compact_in_background, daemon=True).start()
+
+    def _compact_in_background(self):
+        try:
+            self.compact()
+        except Exception as e:
+            print(f"CRITICAL: Journal compaction failed: {e}")
+        finally:
+            with self._lock:
+                self._compacting = False
+
+    def compact(self):
+        """Writes the current state as a new snapshot and drops the journal entries it covers."""
+        with self._lock:
+            self._check_external()
+            data = dict(self._data)
+            covered = self._journal_size()
+
+        # Serialize outside the lock; writers keep appending meanwhile
+        snapshot = {"schema_version": SCHEMA_VERSION, "invoices": data}
+        json_str = json.dumps(snapshot, indent=2, ensure_ascii=False, default=str)
+        tmp_snapshot = self.db_file + ".tmp"
+        with open(tmp_snapshot, 'w', encoding='utf-8') as f:
+            f.write(json_str)
+            f.flush()
+            os.fsync(f.fileno())
+
+        with self._lock:
+            os.replace(tmp_snapshot, self.db_file)
+            # Keep whatever was appended while we were writing the snapshot.
+            # A crash between the two replaces only means those entries are replayed twice,
+            # which is harmless since every entry is idempotent.
+            tail = b""
+            if os.path.exists(self.journal_file):
+                with open(self.journal_file, 'rb') as f:
+                    f.seek(covered)
+                    tail = f.read()
+            tmp_journal = self.journal_file + ".tmp"
+            with open(tmp_journal, 'wb') as f:
+                f.write(tail)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_journal, self.journal_file)
+            self._stats = self._file_stats()
+        print(f"--- JOURNAL COMPACTED into snapshot with {len(data)} items ---")
+
+    def load_all(self) -> Dict[str, dict]:
+        with self._lock:
+            self._check_external()
+            return dict(self._data)
+
+    def version_token(self):
+        with self._lock:
+            self._check_external()
+            return self._generation
+
+    def count(self) -> int:
+        with self._lock:
+            self._check_external()
+            return len(self._data)
+
+    def get(self, invoice_id: str) -> Optional[dict]:
+        with self._lock:
+            self._check_external()
+            return self._data.get(invoice_id)
+
+    def get_many(self, invoice_ids: Iterable[str]) -> Dict[str, dict]:
+        with self._lock:
+            self._check_external()
+            return {i: self._data[i] for i in invoice_ids if i in self._data}
+
+    def existing_ids(self, invoice_ids: Iterable[str]) -> Set[str]:
+        with self._lock:
+            self._check_external()
+            return {i for i in invoice_ids if i in self._data}
+
+    def put(self, invoice_id: str, record: dict):
+        self._append([{"op": "put", "id": invoice_id, "record": record}])
+
+    def put_many(self, records: Iterable[Tuple[str, dict]]):
+        entries = [{"op": "put", "id": invoice_id, "record": record} for invoice_id, record in records]
+        if entries:
+            self._append(entries)
+
+    def patch(self, invoice_id: str, updates: dict) -> Optional[dict]:
+        with self._lock:
+            self._check_external()
+            if invoice_id not in self._data:
+                return None
+            self._append([{"op": "patch", "id": invoice_id, "updates": updates}])
+            return self._data[invoice_id]
+
+    def delete(self, invoice_id: str) -> bool:
+        with self._lock:
+            self._check_external()
+            if invoice_id not in self._data:
+                return False
+            self._append([{"op": "delete", "id": invoice_id}])
+            return True
+
+    def apply(self, puts: Dict[str, dict], deletes: Iterable[str]):
+        entries = [{"op": "put", "id": invoice_id, "record": record} for invoice_id, record in puts.items()]
+        entries += [{"op": "delete", "id": invoice_id} for invoice_id in deletes]
+        if entries:
+            self._append(entries)
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS invoices (
+    id TEXT PRIMARY KEY,
+    invoice_date TEXT,
+    status TEXT,
+    vendor_name TEXT,
+    sender_email TEXT,
+    total_amount REAL,
+    vendor_sort TEXT NOT NULL DEFAULT '',
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_invoices_invoice_date ON invoices(invoice_date);
+CREATE INDEX IF NOT EXISTS idx_invoices_status ON invoices(status);
+CREATE INDEX IF NOT EXISTS idx_invoices_vendor_name ON invoices(vendor_name);
+CREATE INDEX IF NOT EXISTS idx_invoices_sender_email ON invoices(sender_email);
+CREATE INDEX IF NOT EXISTS idx_invoices_sort_date ON invoices(COALESCE(invoice_date, ''), id);
+CREATE INDEX IF NOT EXISTS idx_invoices_sort_amount ON invoices(COALESCE(total_amount, -1.0e308), id);
+"""
+# Created once the vendor_sort column exists (databases from before it get it in _add_vendor_sort)
+SQLITE_VENDOR_SORT_INDEX = "CREATE INDEX IF NOT EXISTS idx_invoices_sort_vendor_key ON invoices(vendor_sort, id)"
+
+# Must match the (expression) indexes above verbatim so SQLite can use them,
+# and mirror StorageService's in-memory SORT_KEYS so cursors mean the same thing.
+SQLITE_SORT_EXPRESSIONS = {
+    "id": "id",
+    "date": "COALESCE(invoice_date, '')",
+    "amount": "COALESCE(total_amount, -1.0e308)",
+    "vendor": "vendor_sort",
+}
+
+UPSERT_SQL = """
+INSERT INTO invoices (id, invoice_date, status, vendor_name, sender_email, total_amount, vendor_sort, data)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(id) DO UPDATE SET
+    invoice_date = excluded.invoice_date,
+    status = excluded.status,
+    vendor_name = excluded.vendor_name,
+    sender_email = excluded.sender_email,
+    total_amount = excluded.total_amount,
+    vendor_sort = excluded.vendor_sort,
+    data = excluded.data
+"""
+
+
+class SqliteStorageBackend(StorageBackend):
+    """
+    One row per invoice in a WAL-mode SQLite database.
+    The full record lives in the `data` column; the columns used for lookups
+    and filtering are mirrored next to it and indexed.
+    """
+
+    def __init__(self, db_file: str = SQLITE_DB_FILE):
+        self.db_file = db_file
+        os.makedirs(os.path.dirname(self.db_file), exist_ok=True)
+        # One shared connection, serialized by our own lock (FastAPI runs sync endpoints in a threadpool)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(self.db_file, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SQLITE_SCHEMA)
+        self._add_vendor_sort()
+        self._conn.execute(SQLITE_VENDOR_SORT_INDEX)
+        self._upgrade_schema()
+
+    def _add_vendor_sort(self):
+        # Databases from before the vendor_sort column sorted vendors by an expression index on lower()
+        with self._lock:
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(invoices)")}
+            if "vendor_sort" in columns:
+                return
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("ALTER TABLE invoices ADD COLUMN vendor_sort TEXT NOT NULL DEFAULT ''")
+                rows = self._conn.execute("SELECT id, vendor_name FROM invoices").fetchall()
+                self._conn.executemany("UPDATE invoices SET vendor_sort = ? WHERE id = ?",
+                                       [(vendor_sort_key(row[1]), row[0]) for row in rows])
+                self._conn.execute("DROP INDEX IF EXISTS idx_invoices_sort_vendor")
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _upgrade_schema(self):
+        with self._lock:
+            # user_version 0 = created before the schema was versioned (same shape as v1)
+            version = self._conn.execute("PRAGMA user_version").fetchone()[0] or 1
+            if version >= SCHEMA_VERSION:
+                return
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute("SELECT id, data FROM invoices").fetchall()
+                if rows:
+                    print(f"Upgrading {self.db_file} from schema v{version} to v{SCHEMA_VERSION}")
+                self._conn.executemany(UPSERT_SQL, [
+                    self._row_values(row[0], upgrade_record(json.loads(row[1]), version)) for row in rows
+                ])
+                self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _row_values(self, invoice_id: str, record: dict) -> tuple:
+        invoice_date = record.get("invoice_date")
+        total_amount = record.get("total_amount")
+        return (
+            invoice_id,
+            str(invoice_date) if invoice_date else None,
+            record.get("status"),
+            record.get("vendor_name"),
+            record.get("sender_email"),
+            float(total_amount) if total_amount is not None else None,
+            vendor_sort_key(record.get("vendor_name")),
+            json.dumps(record, ensure_ascii=False, default=str),
+        )
+
+    def load_all(self) -> Dict[str, dict]:
+        with self._lock:
+            rows = self._conn.execute("SELECT id, data FROM invoices").fetchall()
+        return {row[0]: json.loads(row[1]) for row in rows}
+
+    def get(self, invoice_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM invoices WHERE id = ?", (invoice_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_many(self, invoice_ids: Iterable[str]) -> Dict[str, dict]:
+        ids = list(invoice_ids)
+        found = {}
+        with self._lock:
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT id, data FROM invoices WHERE id IN ({placeholders})", chunk
+                ).fetchall()
+                found.update((row[0], json.loads(row[1])) for row in rows)
+        return found
+
+    def existing_ids(self, invoice_ids: Iterable[str]) -> Set[str]:
+        ids = list(invoice_ids)
+        found = set()
+        with self._lock:
+            # Answered from the primary key index alone, no JSON decoding
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(f"SELECT id FROM invoices WHERE id IN ({placeholders})", chunk)
+                found.update(row[0] for row in rows)
+        return found
+
+    def put(self, invoice_id: str, record: dict):
+        with self._lock:
+            self._conn.execute(UPSERT_SQL, self._row_values(invoice_id, record))
+
+    def put_many(self, records: Iterable[Tuple[str, dict]]):
+        rows = [self._row_values(invoice_id, record) for invoice_id, record in records]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(UPSERT_SQL, rows)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def patch(self, invoice_id: str, updates: dict) -> Optional[dict]:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT data FROM invoices WHERE id = ?", (invoice_id,)).fetchone()
+                if not row:
+                    self._conn.execute("ROLLBACK")
+                    return None
+                current = json.loads(row[0])
+                current.update(updates)
+                self._conn.execute(UPSERT_SQL, self._row_values(invoice_id, current))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return current
+
+    def delete(self, invoice_id: str) -> bool:
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM invoices WHERE id = ?", (invoice_id,))
+        return cur.rowcount > 0
+
+    def apply(self, puts: Dict[str, dict], deletes: Iterable[str]):
+        rows = [self._row_values(invoice_id, record) for invoice_id, record in puts.items()]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(UPSERT_SQL, rows)
+                self._conn.executemany("DELETE FROM invoices WHERE id = ?", [(i,) for i in deletes])
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM invoices").fetchone()[0]
+
+    def _where(self, query: InvoiceQuery) -> Tuple[List[str], list]:
+        clauses, params = [], []
+        if query.status:
+            clauses.append("status = ?")
+            params.append(query.status)
+        if query.label:
+            clauses.append("EXISTS (SELECT 1 FROM json_each(invoices.data, '$.labels') WHERE json_each.value = ?)")
+            params.append(query.label)
+        if query.account:
+            clauses.append("json_extract(data, '$.account') = ?")
+            params.append(query.account)
+        if query.start_date:
+            clauses.append("invoice_date >= ?")
+            params.append(query.start_date.isoformat())
+        if query.end_date:
+            clauses.append("invoice_date <= ?")
+            params.append(query.end_date.isoformat())
+        if query.min_amount is not None:
+            clauses.append("total_amount >= ?")
+            params.append(query.min_amount)
+        if query.max_amount is not None:
+            clauses.append("total_amount <= ?")
+            params.append(query.max_amount)
+        if query.text:
+            fields = [
+                "json_extract(data, '$.subject')",
+                "vendor_name",
+                "sender_email",
+                "json_extract(data, '$.comments')",
+            ]
+            clauses.append("(" + " OR ".join(f"instr(lower(COALESCE({f}, '')), ?) > 0" for f in fields) + ")")
+            params.extend([query.text.lower()] * len(fields))
+        return clauses, params
+
+    def _listing_sql(self, query: InvoiceQuery, after: Optional[tuple]) -> Tuple[str, list, str, list]:
+        """Builds (count sql, params, rows sql, params) for a filtered, keyset-paginated listing."""
+        sort_expr = SQLITE_SORT_EXPRESSIONS[query.sort]
+        direction = "DESC" if query.order == "desc" else "ASC"
+        clauses, params = self._where(query)
+        count_sql = "SELECT COUNT(*) FROM invoices WHERE " + (" AND ".join(clauses) or "1")
+
+        page_clauses, page_params = list(clauses), list(params)
+        if after is not None:
+            page_clauses.append(f"({sort_expr}, id) {'<' if direction == 'DESC' else '>'} (?, ?)")
+            page_params.extend(after)
+        rows_sql = (
+            "SELECT data FROM invoices WHERE " + (" AND ".join(page_clauses) or "1")
+            + f" ORDER BY {sort_expr} {direction}, id {direction}"
+        )
+        return count_sql, params, rows_sql, page_params
+
+    def query(self, query: InvoiceQuery, after: Optional[tuple], limit: Optional[int]) -> Tuple[List[dict], int]:
+        """
+        Filtered, keyset-paginated listing evaluated in SQL.
+        `after` is the (sort key, id) of the last row of the previous page.
+        Returns up to `limit` records plus the total number of matching rows.
+        """
+        count_sql, count_params, rows_sql, rows_params = self._listing_sql(query, after)
+        with self._lock:
+            total = self._conn.execute(count_sql, count_params).fetchone()[0]
+            rows = self._conn.execute(
+                rows_sql + " LIMIT ?", rows_params + [limit if limit is not None else -1]
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows], total
+
+    def iter_query(self, query: InvoiceQuery, after: Optional[tuple]) -> Tuple[int, ClosingIterator]:
+        """
+        Like query() without a limit, but yields records as they are read.
+        Uses its own connection (WAL lets it read alongside writers) so a slow
+        consumer never holds the shared connection's lock. The count and the rows
+        come from one read transaction, so they agree whatever is written meanwhile.
+        The caller must close() the iterator if it doesn't read it to the end.
+        """
+        count_sql, count_params, rows_sql, rows_params = self._listing_sql(query, after)
+        conn = sqlite3.connect(self.db_file, check_same_thread=False, isolation_level=None)
+
+        def close():
+            try:
+                if conn.in_transaction:
+                    conn.execute("COMMIT")
+            finally:
+                conn.close()
+
+        try:
+            conn.execute("PRAGMA query_only = ON")
+            conn.execute("BEGIN")
+            total = conn.execute(count_sql, count_params).fetchone()[0]
+            cur = conn.execute(rows_sql, rows_params)
+        except Exception:
+            close()
+            raise
+
+        def rows():
+            while True:
+                batch = cur.fetchmany(500)
+                if not batch:
+                    break
+                for row in batch:
+                    yield json.loads(row[0])
+
+        return total, ClosingIterator(rows(), close)
+
+    def version_token(self):
+        # data_version only moves when *another* connection commits;
+        # our own writes are tracked by StorageService itself
+        with self._lock:
+            return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def import_json_file(backend: StorageBackend, json_file: str = JSON_DB_FILE) -> int:
+    """
+    One-shot import of invoices.json (any schema version, plus its journal) into another backend.
+    The source is only read: a v1 file is upgraded in memory, never rewritten.
+    Existing rows with the same id are overwritten. Returns the number of records imported.
+    """
+    version, data = read_json_snapshot(json_file)
+    replay_journal(os.path.splitext(json_file)[0] + ".journal", data)
+    if version < SCHEMA_VERSION:
+        data = {invoice_id: upgrade_record(record, version) for invoice_id, record in data.items()}
+    backend.put_many(data.items())
+    return len(data)
+
+
+if __name__ == "__main__":
+    # Usage: python -m backend.services.storage_backends [invoices.json] [invoices.db]
+    source = sys.argv[1] if len(sys.argv) > 1 else JSON_DB_FILE
+    target = sys.argv[2] if len(sys.argv) > 2 else SQLITE_DB_FILE
+    imported = import_json_file(SqliteStorageBackend(target), source)
+    print(f"Imported {imported} invoices from {source} into {target}")
@@ -1,118 +1,447 @@
-import json
 import os
-from typing import List, Dict, Optional
-from backend.models import InvoiceData
+import json
+import base64
+import bisect
+import heapq
+import threading
+from typing import List, Dict, Iterable, Optional, Set, Tuple
+from backend.models import InvoiceData, InvoiceQuery, InvoicePage
+from backend.services.search_index import SearchIndex
+from backend.services.revision import RevisionTracker
+from backend.services.storage_backends import (
+    StorageBackend,
+    ClosingIterator,
+    JsonStorageBackend,
+    SqliteStorageBackend,
+    import_json_file,
+    vendor_sort_key,
+    JSON_DB_FILE,
+    SQLITE_DB_FILE,
+)
 
-DB_FILE = "backend/data/invoices.json"
+DB_FILE = JSON_DB_FILE
 
-class StorageService:
-    def __init__(self):
-        self._ensure_db()
+# "json" (default, the original invoices.json file) or "sqlite"
+STORAGE_BACKEND = os.getenv("INVOICE_STORAGE_BACKEND", "json")
+
+def _create_backend() -> StorageBackend:
+    if STORAGE_BACKEND == "sqlite":
+        backend = SqliteStorageBackend(SQLITE_DB_FILE)
+        # First start on SQLite: bring over the existing history once
+        if backend.count() == 0 and os.path.exists(DB_FILE):
+            imported = import_json_file(backend, DB_FILE)
+            print(f"Imported {imported} invoices from {DB_FILE} into {SQLITE_DB_FILE}")
+        return backend
+    return JsonStorageBackend(DB_FILE)
+
+def _to_record(invoice: InvoiceData) -> dict:
+    model_data = invoice.model_dump()
+    # Serialize dates to string for JSON
+    if model_data.get('invoice_date'):
+        model_data['invoice_date'] = str(model_data['invoice_date'])
+    return model_data
+
+# Sort keys for the in-memory listing; keep in sync with SQLITE_SORT_EXPRESSIONS.
+# Missing values sort first ascending / last descending.
+MISSING_AMOUNT = -1.0e308
+SORT_KEYS = {
+    "id": lambda inv: inv.id,
+    "date": lambda inv: inv.invoice_date.isoformat() if inv.invoice_date else "",
+    "amount": lambda inv: inv.total_amount if inv.total_amount is not None else MISSING_AMOUNT,
+    "vendor": lambda inv: vendor_sort_key(inv.vendor_name),
+}
+
+def _encode_cursor(query: InvoiceQuery, last: InvoiceData) -> str:
+    payload = {"s": query.sort, "o": query.order, "k": SORT_KEYS[query.sort](last), "id": last.id}
+    raw = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def _decode_cursor(query: InvoiceQuery) -> Optional[tuple]:
+    """Returns the (sort key, id) to continue after. Raises ValueError for a bad or mismatched cursor."""
+    if not query.cursor:
+        return None
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(query.cursor.encode("ascii")))
+        after = (payload["k"], payload["id"])
+        same_order = payload["s"] == query.sort and payload["o"] == query.order
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not same_order:
+        raise ValueError("Cursor was issued for a different sort order")
+    return after
+
+# InvoiceQuery fields that _matches filters on
+FILTER_FIELDS = ("status", "label", "account", "start_date", "end_date", "min_amount", "max_amount", "text")
+
+def _matches(inv: InvoiceData, query: InvoiceQuery) -> bool:
+    if query.status and inv.status != query.status:
+        return False
+    if query.label and query.label not in inv.labels:
+        return False
+    if query.account and inv.account != query.account:
+        return False
+    if query.start_date and (not inv.invoice_date or inv.invoice_date < query.start_date):
+        return False
+    if query.end_date and (not inv.invoice_date or inv.invoice_date > query.end_date):
+        return False
+    if query.min_amount is not None and (inv.total_amount is None or inv.total_amount < query.min_amount):
+        return False
+    if query.max_amount is not None and (inv.total_amount is None or inv.total_amount > query.max_amount):
+        return False
+    if query.text:
+        needle = query.text.lower()
+        haystacks = (inv.subject, inv.vendor_name, inv.sender_email, inv.comments)
+        if not any(h and needle in h.lower() for h in haystacks):
+            return False
+    return True
+
+def _to_model(record: dict) -> Optional[InvoiceData]:
+    """
+    Materializes a stored record.
+    Backends migrate records to the current schema once, when they open the data,
+    so this is plain validation. (model_construct is slower than pydantic-core
+    validation for this model - see bench_get_all.py.)
+    """
+    try:
+        return InvoiceData.model_validate(record)
+    except Exception as e:
+        print(f"Skipping invalid invoice {record.get('id')}: {e}")
+        return None
+
+class StorageBatch:
+    """
+    Unit of work over the invoice store.
+    Reads come from a single up-front load, writes are staged in memory
+    and reach the backend in one commit() (or are dropped on error).
+    """
+    def __init__(self, backend: StorageBackend, invoice_ids: Optional[Iterable[str]] = None, on_commit=None):
+        self.backend = backend
+        self._on_commit = on_commit
+        if invoice_ids is None:
+            self._records = backend.load_all()
+            self._preloaded_ids = None
+        else:
+            self._preloaded_ids = set(invoice_ids)
+            self._records = backend.get_many(self._preloaded_ids)
+        self._puts: Dict[str, dict] = {}
+        self._deletes = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        return False
 
-    def _ensure_db(self):
-        os.makedirs(os.path.dirname(DB_FILE), exist_ok=True)
-        if not os.path.exists(DB_FILE):
-             with open(DB_FILE, 'w', encoding='utf-8') as f:
-                 json.dump({}, f) # ID -> Invoice Mapping
+    def _get_record(self, invoice_id: str) -> Optional[dict]:
+        if invoice_id in self._deletes:
+            return None
+        if invoice_id in self._records:
+            return self._records[invoice_id]
+        if self._preloaded_ids is None or invoice_id in self._preloaded_ids:
+            # Already looked up during the initial load: it does not exist
+            return None
+        # Outside the preloaded ids: fall back to a point lookup
+        record = self.backend.get(invoice_id)
+        if record is not None:
+            self._records[invoice_id] = record
+        return record
+
+    def get_by_id(self, invoice_id: str) -> Optional[InvoiceData]:
+        record = self._get_record(invoice_id)
+        if record is not None:
+            return _to_model(record)
+        return None
+
+    def save_invoice(self, invoice: InvoiceData):
+        record = _to_record(invoice)
+        self._deletes.discard(invoice.id)
+        self._records[invoice.id] = record
+        self._puts[invoice.id] = record
+
+    def update_invoice(self, invoice_id: str, updates: dict) -> Optional[InvoiceData]:
+        current = self._get_record(invoice_id)
+        if current is None:
+            return None
+        current = {**current, **updates}
+        self._records[invoice_id] = current
+        self._puts[invoice_id] = current
+        return InvoiceData(**current)
+
+    def delete_invoice(self, invoice_id: str) -> bool:
+        if self._get_record(invoice_id) is None:
+            return False
+        self._records.pop(invoice_id, None)
+        self._puts.pop(invoice_id, None)
+        self._deletes.add(invoice_id)
+        return True
+
+    def commit(self):
+        if not self._puts and not self._deletes:
+            return
+        if self._on_commit:
+            self._on_commit(self._puts, self._deletes, lambda: self.backend.apply(self._puts, self._deletes))
+        else:
+            self.backend.apply(self._puts, self._deletes)
+        self._puts = {}
+        self._deletes = set()
+
+class StorageService:
+    """
+    Invoice history facade.
+    Keeps a write-through cache of the validated invoices; it is rebuilt from the
+    backend whenever the backend's version token moves (e.g. invoices.json edited by hand).
+    Models returned by get_all are shared with the cache - treat them as read-only.
+    """
+    def __init__(self, backend: Optional[StorageBackend] = None):
+        self.backend = backend or _create_backend()
+        # Moves on every write made through this service and on outside edits
+        self.revision = RevisionTracker(lambda: self.backend.version_token())
+        self._cache_lock = threading.RLock()
+        self._cache: Optional[Dict[str, InvoiceData]] = None
+        self._cache_token = None
+        # Sort name -> (the (key, id) pairs, the invoices), both ascending; kept up to date on write
+        self._sorted_cache: Dict[str, Tuple[List[tuple], List[InvoiceData]]] = {}
+        # Full-text index over the cached invoices; built on first search, then maintained with the cache
+        self._search_index: Optional[SearchIndex] = None
 
     def _load(self) -> Dict[str, dict]:
-        with open(DB_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-
-    def _save(self, data: Dict[str, dict]):
-        # Atomic-ish write: Serialize first to ensure valid JSON, then write
-        # default=str handles date objects automatically if we missed manual conversion
-        try:
-            # Atomic-ish write: Serialize first to ensure valid JSON, then write
-            json_str = json.dumps(data, indent=2, ensure_ascii=False, default=str)
-            print(f"--- SAFE SAVE EXECUTED with {len(data)} items ---")
-            with open(DB_FILE, 'w', encoding='utf-8') as f:
-                f.write(json_str)
-        except Exception as e:
-            print(f"CRITICAL: Failed to save database: {e}")
-            # Do not touch the file if serialization fails
+        return self.backend.load_all()
+
+    def _cache_is_current(self) -> bool:
+        return self._cache is not None and self.backend.version_token() == self._cache_token
+
+    def _get_cache(self) -> Dict[str, InvoiceData]:
+        with self._cache_lock:
+            token = self.backend.version_token()
+            if self._cache is None or token != self._cache_token:
+                cache = {}
+                for invoice_id, record in self._load().items():
+                    model = _to_model(record)
+                    if model is not None:
+                        cache[invoice_id] = model
+                self._cache = cache
+                self._search_index = None
+                self._cache_token = token
+                self._sorted_cache = {}
+            return self._cache
+
+    def _write(self, puts: Dict[str, dict], deletes: Iterable[str], write):
+        """Runs a backend write and applies the same change to the cache."""
+        with self._cache_lock:
+            was_current = self._cache_is_current()
+            result = write()
+            self._after_write(was_current, puts, deletes)
+            return result
+
+    def _after_write(self, was_current: bool, puts: Dict[str, dict], deletes: Iterable[str]):
+        self.revision.bump()
+        if not was_current:
+            # Someone else changed the data since we cached it: reload lazily
+            self._cache = None
+            return
+        deletes = list(deletes)
+        changed = {i: self._cache.get(i) for i in list(puts) + deletes}
+        for invoice_id, record in puts.items():
+            model = _to_model(record)
+            if model is not None:
+                self._cache[invoice_id] = model
+            else:
+                self._cache.pop(invoice_id, None)
+        for invoice_id in deletes:
+            self._cache.pop(invoice_id, None)
+        if self._search_index is not None:
+            for invoice_id in puts:
+                if invoice_id in self._cache:
+                    self._search_index.add(self._cache[invoice_id])
+                else:
+                    self._search_index.remove(invoice_id)
+            for invoice_id in deletes:
+                self._search_index.remove(invoice_id)
+        for sort, (keys, models) in self._sorted_cache.items():
+            key = SORT_KEYS[sort]
+            for invoice_id, old in changed.items():
+                if old is not None:
+                    pos = bisect.bisect_left(keys, (key(old), old.id))
+                    del keys[pos], models[pos]
+                new = self._cache.get(invoice_id)
+                if new is not None:
+                    pos = bisect.bisect_left(keys, (key(new), new.id))
+                    keys.insert(pos, (key(new), new.id))
+                    models.insert(pos, new)
+        self._cache_token = self.backend.version_token()
+
+    def _sorted_by(self, sort: str) -> Tuple[List[tuple], List[InvoiceData]]:
+        """The cached invoices ascending by (sort key, id), with those pairs. Call with _cache_lock held."""
+        cache = self._get_cache()
+        if sort not in self._sorted_cache:
+            key = SORT_KEYS[sort]
+            pairs = sorted(((key(x), x.id), x) for x in cache.values())
+            self._sorted_cache[sort] = ([k for k, _ in pairs], [x for _, x in pairs])
+        return self._sorted_cache[sort]
 
     def get_all(self) -> List[InvoiceData]:
-        data = self._load()
-        # Convert dicts back to Pydantic models
-        invoices = []
-        for v in data.values():
-             # Migration: is_processed -> status
-             if "status" not in v:
-                 if v.get("is_processed") is True:
-                     v["status"] = "Processed"
-                 else:
-                     v["status"] = "Pending"
-             
-             # Handle date conversion if saved as string
-             try:
-                 invoices.append(InvoiceData(**v))
-             except Exception as e:
-                 print(f"Skipping invalid invoice {v.get('id')}: {e}")
-                 
-        return sorted(invoices, key=lambda x: x.id, reverse=True) # Sort mostly by ID (roughly time)
+        # Sort mostly by ID (roughly time)
+        with self._cache_lock:
+            return self._sorted_by("id")[1][::-1]
+
+    def search(self, text: str, limit: int = 50) -> List[InvoiceData]:
+        """
+        Full-text search over subject, vendor, sender and comments.
+        Every word must match (as a whole word or a prefix); newest first.
+        """
+        with self._cache_lock:
+            cache = self._get_cache()
+            if self._search_index is None:
+                self._search_index = SearchIndex()
+                for model in cache.values():
+                    self._search_index.add(model)
+            ids = self._search_index.search(text)
+            return [cache[i] for i in heapq.nlargest(limit, ids) if i in cache]
+
+    def query(self, query: InvoiceQuery) -> InvoicePage:
+        """
+        Filtered, sorted, cursor-paginated listing.
+        Backends that can evaluate the query themselves (SQLite) do so against
+        their indexes; otherwise it runs over the in-memory cache.
+        Raises ValueError for an invalid cursor.
+        """
+        if query.sort not in SORT_KEYS:
+            raise ValueError(f"Unsupported sort: {query.sort}")
+        after = _decode_cursor(query)
+        descending = query.order == "desc"
+        # Fetch one extra row to know whether there is a next page
+        fetch = query.limit + 1 if query.limit else None
+
+        if hasattr(self.backend, "query"):
+            records, total = self.backend.query(query, after, fetch)
+            items = [m for m in (_to_model(r) for r in records) if m is not None]
+        else:
+            with self._cache_lock:
+                total, items = self._query_cache(query, after, descending, fetch)
+
+        next_cursor = None
+        if query.limit and len(items) > query.limit:
+            items = items[:query.limit]
+            next_cursor = _encode_cursor(query, items[-1])
+        return InvoicePage(items=items, total=total, next_cursor=next_cursor)
+
+    def _query_cache(self, query: InvoiceQuery, after: Optional[tuple], descending: bool,
+                     fetch: Optional[int]) -> Tuple[int, List[InvoiceData]]:
+        """
+        query() over the in-memory cache. The page starts at the cursor's place in the
+        kept-sorted order (a bisect), so an unfiltered page costs O(page size). With
+        filters the total still needs one _matches pass over every invoice - no sort.
+        """
+        keys, models = self._sorted_by(query.sort)
+        if after is None:
+            start = len(models) - 1 if descending else 0
+        elif descending:
+            start = bisect.bisect_left(keys, tuple(after)) - 1
+        else:
+            start = bisect.bisect_right(keys, tuple(after))
+        step = -1 if descending else 1
+        stop = -1 if descending else len(models)
+        filtered = any(getattr(query, f) not in (None, "") for f in FILTER_FIELDS)
+
+        if not filtered:
+            end = stop if not fetch else (max(start - fetch, -1) if descending else min(start + fetch, stop))
+            return len(models), [models[i] for i in range(start, end, step)]
+        # One pass counts the matches and collects the page (those at or past the cursor)
+        total, items = 0, []
+        for i, inv in enumerate(models):
+            if _matches(inv, query):
+                total += 1
+                if (i <= start if descending else i >= start):
+                    items.append(inv)
+        if descending:
+            items.reverse()
+        return total, items[:fetch] if fetch else items
+
+    def stream(self, query: InvoiceQuery) -> Tuple[int, Optional[str], ClosingIterator]:
+        """
+        Same listing as query(), as (total, next cursor, iterator of invoices).
+        Unpaged listings on backends that support it are read lazily, so the
+        full result never has to be held in memory. close() the iterator when
+        done with it, read or not: it may hold a database connection.
+        """
+        if query.limit or not hasattr(self.backend, "iter_query"):
+            # Paged, or served from the cache: the items are already in memory
+            page = self.query(query)
+            return page.total, page.next_cursor, ClosingIterator(page.items)
+        if query.sort not in SORT_KEYS:
+            raise ValueError(f"Unsupported sort: {query.sort}")
+        total, records = self.backend.iter_query(query, _decode_cursor(query))
+        models = (_to_model(r) for r in records)
+        return total, None, ClosingIterator((m for m in models if m is not None), records.close)
 
     def get_by_id(self, invoice_id: str) -> Optional[InvoiceData]:
-        data = self._load()
-        if invoice_id in data:
-            return InvoiceData(**data[invoice_id])
+        with self._cache_lock:
+            if self._cache_is_current():
+                cached = self._cache.get(invoice_id)
+                return cached.model_copy(deep=True) if cached else None
+        # Cold cache: a point lookup is cheaper than warming the whole cache
+        record = self.backend.get(invoice_id)
+        if record is not None:
+            return _to_model(record)
         return None
 
+    def existing_ids(self, invoice_ids: Iterable[str]) -> Set[str]:
+        """Which of the given ids are already stored (no records are loaded or validated)."""
+        with self._cache_lock:
+            if self._cache_is_current():
+                return {i for i in invoice_ids if i in self._cache}
+        return self.backend.existing_ids(invoice_ids)
+
     def save_invoice(self, invoice: InvoiceData):
-        data = self._load()
-        # Ensure dates are serialized
-        model_data = invoice.model_dump()
-        
-        # Serialize dates to string for JSON
-        if model_data.get('invoice_date'):
-            model_data['invoice_date'] = str(model_data['invoice_date'])
-            
-        data[invoice.id] = model_data
-        self._save(data)
-    
+        record = _to_record(invoice)
+        self._write({invoice.id: record}, (), lambda: self.backend.put(invoice.id, record))
+
     def bulk_save_or_update(self, invoices: List[InvoiceData], merge=True):
         """
-        Saves new invoices. 
-        If merge=True, it will NOT overwrite existing invoice STATUS or user-edited fields, 
-        unless the new scan provides better data? 
-        Actually, for 'History' logic: 
+        Saves new invoices.
+        If merge=True, it will NOT overwrite existing invoice STATUS or user-edited fields,
+        unless the new scan provides better data?
+        Actually, for 'History' logic:
         - If ID exists, we probably want to KEEP the user's manual edits and status.
         - So we probably only want to insert if ID does NOT exist.
         - OR if explicitly requested to update.
         """
-        data = self._load()
+        existing_ids = set(self._get_cache().keys()) if merge else set()
+        to_save = []
         for inv in invoices:
-            if inv.id in data and merge:
+            if inv.id in existing_ids:
                 # Exists. Keep existing status?
                 # Maybe keep everything unless we want to "Refresh" data?
                 # For now, let's assume Scan should ONLY add new items
                 continue
-            
+
             # Save new
-            model_data = inv.model_dump()
-            if model_data.get('invoice_date'):
-                model_data['invoice_date'] = str(model_data['invoice_date'])
-            data[inv.id] = model_data
-            
-        self._save(data)
+            to_save.append((inv.id, _to_record(inv)))
+
+        self._write(dict(to_save), (), lambda: self.backend.put_many(to_save))
 
     def update_invoice(self, invoice_id: str, updates: dict):
-        data = self._load()
-        if invoice_id in data:
-            # Merge updates
-            current = data[invoice_id]
-            current.update(updates)
-            data[invoice_id] = current
-            self._save(data)
+        # Merge updates
+        with self._cache_lock:
+            was_current = self._cache_is_current()
+            current = self.backend.patch(invoice_id, updates)
+            if current is not None:
+                self._after_write(was_current, {invoice_id: current}, ())
+        if current is not None:
             return InvoiceData(**current)
         return None
 
     def delete_invoice(self, invoice_id: str) -> bool:
-        data = self._load()
-        if invoice_id in data:
-            del data[invoice_id]
-            self._save(data)
-            return True
-        return False
+        return self._write({}, (invoice_id,), lambda: self.backend.delete(invoice_id))
+
+    def batch(self, invoice_ids: Optional[Iterable[str]] = None) -> StorageBatch:
+        """
+        Starts a unit of work. Pass the ids you are about to touch to preload
+        only those; otherwise the whole store is loaded once.
+        Use as a context manager to commit on success.
+        """
+        return StorageBatch(self.backend, invoice_ids, on_commit=self._write)
 
 storage_service = StorageService()
@@ -0,0 +1,53 @@
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+SYNC_STATE_FILE = "backend/data/sync_state.json"
+
+class SyncStateService:
+    """
+    Per-account Gmail sync position: the mailbox historyId as of the last completed scan
+    that reached the present, and when that scan started.
+    """
+
+    def __init__(self, state_file: str = SYNC_STATE_FILE):
+        self.state_file = state_file
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict:
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            print(f"Error reading sync state, starting over: {e}")
+            return {}
+
+    def _save(self, data: Dict):
+        os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+        tmp_file = self.state_file + ".tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_file, self.state_file)
+
+    def get(self, account: str) -> Optional[Dict]:
+        """{"history_id": ..., "synced_at": epoch seconds} for the account, or None if never synced."""
+        with self._lock:
+            return self._load().get(account)
+
+    def set_history_id(self, account: str, history_id: str, synced_at: Optional[float] = None):
+        with self._lock:
+            data = self._load()
+            data[account] = {"history_id": str(history_id), "synced_at": synced_at or time.time()}
+            self._save(data)
+
+    def clear(self, account: str):
+        with self._lock:
+            data = self._load()
+            if data.pop(account, None) is not None:
+                self._save(data)
+
+sync_state_service = SyncStateService()
@@ -0,0 +1,67 @@
+
+import os
+import sys
+import time
+import shutil
+import contextlib
+from datetime import date
+
+# Add project root
+sys.path.append(os.getcwd())
+
+from fake_gmail_server import FakeGmailServer, FakeMailbox
+from backend.services import gmail_service as gmail_module
+from backend.services.gmail_service import GmailService
+from backend.services.attachment_store import AttachmentStore
+
+MESSAGE_COUNT = 100
+STORE_DIR = "backend/static/bench_attachments"
+
+
+def quiet(fn):
+    # The scan prints a line per generated PDF; keep the benchmark output readable
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        return fn()
+
+
+def store_size(store):
+    return sum(os.path.getsize(path) for _, path in store.blobs())
+
+
+def scan(scanner, label, store):
+    before = dict(store.stats)
+    start = time.perf_counter()
+    result = quiet(lambda: scanner.scan_invoices(date(2020, 1, 1), date(2030, 1, 1)))
+    elapsed = time.perf_counter() - start
+    writes = store.stats["writes"] - before["writes"]
+    deduplicated = store.stats["deduplicated"] - before["deduplicated"]
+    print(f"{label:<10} {elapsed:6.2f}s  {result.invoices_found} invoices  {writes:4} blobs written  "
+          f"{deduplicated:4} already stored  store {store_size(store) / 1024:.0f} KB")
+    return result
+
+
+if __name__ == "__main__":
+    server = FakeGmailServer(FakeMailbox(MESSAGE_COUNT), latency=0.005).start()
+    gmail_module.GMAIL_API_ROOT_URL = server.url
+    store = AttachmentStore(root=os.path.join(STORE_DIR, "blobs"), files_dir=STORE_DIR)
+    gmail_module.attachment_store = store
+    gmail_module.scan_checkpoint_service.checkpoints_file = os.path.join(STORE_DIR, "checkpoints.json")
+    try:
+        scanner = GmailService()
+        first = scan(scanner, "scan", store)
+        # No known-id filter: every attachment is downloaded again, as on a refresh
+        scan(scanner, "rescan", store)
+
+        # Each blob is named by its content
+        for sha256, path in store.blobs():
+            with open(path, "rb") as f:
+                assert store.put(f.read()) == sha256
+
+        # Drop half the invoices: their blobs lose their only reference
+        kept = [inv for n, inv in enumerate(first.invoices) if n % 2 == 0]
+        result = store.collect_garbage(kept, grace_seconds=0)
+        print(f"gc after deleting half the invoices: {result}")
+        assert result["kept"] == len({inv.attachment_sha256 for inv in kept if inv.attachment_sha256})
+    finally:
+        server.stop()
+        shutil.rmtree(STORE_DIR, ignore_errors=True)
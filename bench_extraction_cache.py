@@ -0,0 +1,75 @@
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+# Add project root
+sys.path.append(os.getcwd())
+
+from backend.services.extraction_cache import ExtractionCache
+from backend.services.extraction_executor import ExtractionExecutor
+from bench_extraction_pool import make_invoice_pdf, quiet, DOCUMENTS, MAX_PAGES
+
+
+def scan(cache, pdfs, workers=1):
+    executor = ExtractionExecutor(workers=workers, cache=cache)
+    executor.warm_up()
+    start = time.perf_counter()
+    results = quiet(lambda: executor.extract_many(pdfs))
+    elapsed = time.perf_counter() - start
+    executor.shutdown()
+    return results, elapsed, executor.stats["tasks"]
+
+
+def report(label, elapsed, tasks, cache):
+    print(f"{label:<34} {elapsed:6.2f}s  {tasks:3d} PDFs parsed  cache {cache.stats}")
+
+
+if __name__ == "__main__":
+    tmp_dir = tempfile.mkdtemp()
+    db_file = os.path.join(tmp_dir, "extraction_cache.db")
+    pdfs = [make_invoice_pdf(n) for n in range(DOCUMENTS)]
+    pages = sum(1 + n % MAX_PAGES + 1 for n in range(DOCUMENTS))
+    print(f"{DOCUMENTS} PDFs, {pages} pages")
+    try:
+        baseline, elapsed, tasks = scan(None, pdfs)
+        print(f"{'no cache':<34} {elapsed:6.2f}s  {tasks:3d} PDFs parsed")
+
+        cache = ExtractionCache(db_file)
+        results, elapsed, tasks = scan(cache, pdfs)
+        report("first scan (cache empty)", elapsed, tasks, cache)
+        assert results == baseline and tasks == DOCUMENTS
+
+        # A new process (a restart of the server) opens the same file
+        cache = ExtractionCache(db_file)
+        results, rescan_s, tasks = scan(cache, pdfs)
+        report("rescan", rescan_s, tasks, cache)
+        assert results == baseline and tasks == 0
+
+        # _extract_from_text changed: the fields are found again in the cached text. Only PDFs whose
+        # reading stopped once the old fields were found (their text is missing pages) are parsed again.
+        truncated = cache._connection().execute("SELECT COUNT(*) FROM extractions WHERE NOT complete").fetchone()[0]
+        cache = ExtractionCache(db_file, fields_version="bench-next")
+        results, elapsed, tasks = scan(cache, pdfs)
+        report("rescan, new FIELDS_VERSION", elapsed, tasks, cache)
+        print(f"{'':<34} {truncated} of {DOCUMENTS} cached texts were missing pages")
+        assert results == baseline and 0 < tasks == truncated and cache.stats["stale_fields"] == DOCUMENTS
+
+        # The text extractor changed: every entry is dropped and every PDF parsed again
+        cache = ExtractionCache(db_file, extractor_version="bench-next")
+        results, elapsed, tasks = quiet(lambda: scan(cache, pdfs))
+        report("rescan, new EXTRACTOR_VERSION", elapsed, tasks, cache)
+        assert results == baseline and tasks == DOCUMENTS
+
+        # Room for about a third of the documents: the least recently used ones go
+        full_size = cache.size()
+        small = ExtractionCache(os.path.join(tmp_dir, "small.db"), max_bytes=full_size // 3)
+        scan(small, pdfs)
+        results, elapsed, tasks = scan(small, pdfs[-5:])
+        print(f"bounded to {small.max_bytes} of {full_size} bytes: holds {small.size()}, "
+              f"{small.stats['evictions']} evicted, last 5 PDFs parsed {tasks} times")
+        assert small.size() <= small.max_bytes and small.stats["evictions"] > 0 and tasks == 0
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
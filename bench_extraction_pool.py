@@ -0,0 +1,82 @@
+
+import io
+import os
+import sys
+import time
+import contextlib
+
+# Add project root
+sys.path.append(os.getcwd())
+
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+from backend.services.extraction_executor import ExtractionExecutor
+
+DOCUMENTS = 48
+# Invoices of 1 to 8 pages, like statements with long line-item tables
+MAX_PAGES = 8
+LINES_PER_PAGE = 45
+
+
+def make_invoice_pdf(n: int, pages: int = 0) -> bytes:
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    pages = pages or 1 + n % MAX_PAGES
+    total = 0.0
+    for page in range(pages):
+        y = 800
+        pdf.drawString(40, y, f"Vendor {n} Ltd.   Invoice No. {20000 + n}   Date: {1 + n % 28:02d}/{1 + n % 12:02d}/2025   Page {page + 1}/{pages}")
+        for line in range(LINES_PER_PAGE):
+            y -= 16
+            amount = round(5 + (n * 31 + page * 7 + line * 13) % 400 + 0.5, 2)
+            total += amount
+            pdf.drawString(40, y, f"{page * LINES_PER_PAGE + line + 1:4d}  Service item {line} for account {n}-{page}   qty 1   {amount:,.2f}")
+        pdf.showPage()
+    pdf.drawString(40, 800, f"VAT 18%: {total * 18 / 118:,.2f}    Total: {total:,.2f} ILS")
+    pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
+
+
+def quiet(fn):
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        return fn()
+
+
+def run(workers, pdfs, timeout=60):
+    executor = ExtractionExecutor(workers=workers, timeout=timeout)
+    # Worker start-up is paid once per server, not per scan
+    executor.warm_up()
+    start = time.perf_counter()
+    results = quiet(lambda: executor.extract_many(pdfs))
+    elapsed = time.perf_counter() - start
+    return executor, results, elapsed
+
+
+if __name__ == "__main__":
+    pdfs = [make_invoice_pdf(n) for n in range(DOCUMENTS)]
+    pages = sum(1 + n % MAX_PAGES + 1 for n in range(DOCUMENTS))
+    cores = os.cpu_count() or 1
+    print(f"{DOCUMENTS} PDFs, {pages} pages, {cores} cores")
+
+    _, baseline, inline_s = run(0, pdfs)
+    print(f"in-process     {inline_s:6.2f}s  {pages / inline_s:6.1f} pages/s")
+
+    counts = sorted({1, 2, 4, 8, cores} & set(range(1, cores + 1)))
+    for workers in counts:
+        executor, results, elapsed = run(workers, pdfs)
+        assert results == baseline, "worker processes changed the results"
+        print(f"{workers:2d} worker{'s' if workers > 1 else ' '}     {elapsed:6.2f}s  {pages / elapsed:6.1f} pages/s  {inline_s / elapsed:4.1f}x")
+        executor.shutdown()
+
+    # A document over its time budget is stopped; the ones around it are unaffected
+    runaway = make_invoice_pdf(0, pages=40)
+    executor = ExtractionExecutor(workers=1, timeout=1.0)
+    executor.warm_up()
+    start = time.perf_counter()
+    results = quiet(lambda: executor.extract_many([pdfs[0], runaway, pdfs[0]]))
+    print(f"1s timeout, 40-page PDF between two 1-page ones: {time.perf_counter() - start:.2f}s, "
+          f"found fields {[bool(r) for r in results]}, {executor.stats}")
+    assert results[0] and results[2] and results[1] == {}
+    executor.shutdown()
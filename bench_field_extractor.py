@@ -0,0 +1,166 @@
+
+import os
+import re
+import sys
+import time
+import random
+from datetime import datetime
+
+# Add project root
+sys.path.append(os.getcwd())
+
+from backend.services.extraction_service import extraction_service
+
+TEXTS = 10000
+SEED = 25
+
+# Texts that trip up date and amount parsing; they are part of the golden corpus as is
+EDGE_CASES = [
+    "",
+    "no numbers at all",
+    "Date: 26/10/2025 Total: 35.00 VAT: 5.34",
+    "תאריך: 26.10.2025 סה\"כ: 1,234.50 ₪ מע\"מ: 188.31",
+    "10023 רפסמ הלבק סמ תינובשח\n26/10/2025 :ךיראת\n₪ 1,234.50 :םולשתל כ\"הס\n188.31 :18% מ\"עמ",
+    "Issued 2025-02-29, due 2025-03-01. Amount 99.90",
+    "31/02/2025 then 30/02/2025 then 01/03/2025",
+    "00/10/2025 10/00/2025 1/1/2025",
+    "Expires 12/31/2025, issued 1/2/2024",
+    "26/10/25 and 26.10.2035 and 26/10/1999",
+    "1999-12-31 2035-01-01 2029-12-31",
+    "Period 01/01/69 - 31/12/68 and 15/06/29",
+    "Total 1234.56 (not 234.56?) and 12.345 and 1,2345.67",
+    "1,234,567.89 49,999.99 50,000.00 2,025.00 2025.00 2024.00 0.00",
+    "Dates as amounts: 26.10.2025 and 1.1.2025 and 12.12.12",
+    "Phone 03-1234567, ref 2025-10-26-001, invoice 123/45/6789",
+    "₪99.90₪ NIS100.00 ILS 35.00ILS",
+    "٢٦/١٠/٢٠٢٥ total ١٢٣.٤٥",
+    # strptime reads other scripts' digits in years and after a leading 1 or 2 of a day
+    "08.07.١6 total 35.00",
+    "1٥/10/2025 3١/10/2024 0٥/10/2023 15/1٠/2022",
+    "Issued 2025-1٠-26, due 2025-10-2٦",
+    "26/10/٢٠٢٥ and 07/07/۲۰۲۴",
+    "26/10/2025/10/2025 11/11/11/11/2025",
+    "Line 1: 10.00\nLine 2: 20.00\nVAT: 4.58\nTotal: 30.00",
+    "Totals: 100.00 17.00 15.25 14.00 -18.00 19.00",
+]
+
+VENDORS = ["Bezeq", "Partner", "Electric Co", "חברת חשמל", "Amazon", "סלקום", "Wolt"]
+HEBREW_WORDS = ["חשבונית", "מס", "קבלה", "תאריך", "סה\"כ", "לתשלום", "מע\"מ", "כולל", "שירות"]
+
+
+def random_date(rng: random.Random) -> str:
+    day, month, year = rng.randint(0, 32), rng.randint(0, 13), rng.choice([1998, 2019, 2024, 2025, 2026, 2031])
+    sep = rng.choice("/.")
+    return rng.choice([
+        f"{day:02d}{sep}{month:02d}{sep}{year}",
+        f"{day}{sep}{month}{sep}{year}",
+        f"{year}-{month:02d}-{day:02d}",
+        f"{day:02d}{sep}{month:02d}{sep}{year % 100:02d}",
+    ])
+
+
+def random_amount(rng: random.Random) -> str:
+    value = rng.choice([rng.uniform(0, 100), rng.uniform(100, 5000), rng.uniform(5000, 80000), 2025.0])
+    return rng.choice([f"{value:,.2f}", f"{value:.2f}", f"{value:.3f}", f"{value:,.0f}", f"₪{value:,.2f}"])
+
+
+def random_text(rng: random.Random) -> str:
+    """An invoice, receipt or email body as a PDF text extractor returns it, with the usual noise."""
+    hebrew = rng.random() < 0.4
+    lines = [f"{rng.choice(VENDORS)} Ltd. Invoice No. {rng.randint(1000, 99999)}"]
+    for _ in range(rng.randint(0, 40)):
+        kind = rng.random()
+        if kind < 0.45:
+            lines.append(f"{rng.randint(1, 99)} Item {rng.randint(1, 500)} qty {rng.randint(1, 9)} {random_amount(rng)}")
+        elif kind < 0.6:
+            lines.append(f"Date: {random_date(rng)}")
+        elif kind < 0.7:
+            lines.append(f"Phone 0{rng.randint(2, 9)}-{rng.randint(1000000, 9999999)} ref {rng.randint(10 ** 5, 10 ** 9)}")
+        elif kind < 0.8 and hebrew:
+            words = " ".join(rng.choice(HEBREW_WORDS) for _ in range(rng.randint(2, 6)))
+            line = f"{words} {random_amount(rng)}"
+            # pdfplumber returns Hebrew in visual order
+            lines.append(line[::-1] if rng.random() < 0.5 else line)
+        else:
+            lines.append(f"Period {random_date(rng)} - {random_date(rng)}, paid {random_amount(rng)}")
+    total = rng.uniform(10, 9000)
+    lines.append(f"VAT 18%: {total * 18 / 118:,.2f}  Total: {total:,.2f} ILS" if rng.random() < 0.7 else f"Total: {total:,.2f}")
+    return "\n".join(lines)
+
+
+def legacy_extract_fields(text):
+    """_extract_fields before the single-pass scanner: four date scans with strptime, then amounts."""
+    data = {"invoice_date": None, "total_amount": None, "vat_amount": None, "vendor_name": None}
+    date_patterns = [
+        r'(\d{2}[/.]\d{2}[/.]\d{4})',
+        r'(\d{1,2}[/.]\d{1,2}[/.]\d{4})',
+        r'(\d{4}-\d{2}-\d{2})',
+        r'(\d{2}[/.]\d{2}[/.]\d{2})'
+    ]
+    for pattern in date_patterns:
+        for match in re.finditer(pattern, text):
+            date_str = match.group(0).replace('.', '/')
+            for fmt in ["%d/%m/%Y", "%Y-%m-%d", "%d/%m/%y"]:
+                try:
+                    dt = datetime.strptime(date_str, fmt).date()
+                    if 2000 < dt.year < 2030:
+                        data["invoice_date"] = dt
+                        break
+                except ValueError:
+                    continue
+            if data["invoice_date"]: break
+        if data["invoice_date"]: break
+
+    clean_text = text.replace('₪', 'NIS ').replace('₪', 'NIS ')
+    all_numbers = []
+    for m in re.findall(r'(\d{1,3}(?:,\d{3})*(?:\.\d{2}))', clean_text):
+        try:
+            val = float(m.replace(',', ''))
+            if 0.0 < val < 50000 and val not in [2023, 2024, 2025, 2026]:
+                all_numbers.append(val)
+        except: pass
+    if all_numbers:
+        data["total_amount"] = max(all_numbers)
+
+    found_explicit_vat = False
+    if data["total_amount"] and all_numbers:
+        for num in all_numbers:
+            if num == data["total_amount"]: continue
+            ratio = num / data["total_amount"]
+            if 0.14 < ratio < 0.19:
+                data["vat_amount"] = num
+                found_explicit_vat = True
+                break
+    if not data["vat_amount"] and data["total_amount"]:
+        data["vat_amount"] = round(data["total_amount"] * (0.18 / 1.18), 2)
+    return data, found_explicit_vat
+
+
+def timed(fns, texts, repeat=5):
+    """Best time of each function over the texts; the runs alternate so both see the same machine load."""
+    best = [float("inf")] * len(fns)
+    for _ in range(repeat):
+        for n, fn in enumerate(fns):
+            start = time.perf_counter()
+            for text in texts:
+                fn(text)
+            best[n] = min(best[n], time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    rng = random.Random(SEED)
+    texts = EDGE_CASES + [random_text(rng) for _ in range(TEXTS)]
+    print(f"{len(texts)} texts, {sum(map(len, texts)) // len(texts)} characters on average")
+
+    scan = lambda text: extraction_service._extract_fields(text, "bench")
+    mismatches = [text for text in texts if scan(text) != legacy_extract_fields(text)]
+    for text in mismatches[:5]:
+        print(f"MISMATCH {text!r}\n  single pass {scan(text)}\n  legacy      {legacy_extract_fields(text)}")
+    assert not mismatches, f"{len(mismatches)} texts give other fields than before"
+    found = sum(1 for text in texts if scan(text)[0]["invoice_date"])
+    print(f"Same fields for all {len(texts)} texts ({found} with a date)")
+
+    legacy_s, single_s = timed([legacy_extract_fields, scan], texts)
+    print(f"  legacy       {legacy_s:6.3f}s  {legacy_s / len(texts) * 1e6:6.1f} us/text")
+    print(f"  single pass  {single_s:6.3f}s  {single_s / len(texts) * 1e6:6.1f} us/text  {legacy_s / single_s:.1f}x")
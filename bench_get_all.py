@@ -0,0 +1,96 @@
+
+import os
+import sys
+import time
+import json
+import shutil
+import tempfile
+from datetime import date
+
+# Add project root
+sys.path.append(os.getcwd())
+
+from backend.models import InvoiceData
+from backend.services.storage_backends import JsonStorageBackend, SCHEMA_VERSION
+from backend.services.storage_service import StorageService
+
+SIZES = [10000, 100000]
+
+
+def make_records(count):
+    records = {}
+    for i in range(count):
+        record = InvoiceData(
+            id=f"msg{i:08d}",
+            filename=f"invoice_{i}.pdf",
+            sender_email=f"billing@vendor{i % 300}.com",
+            subject=f"Invoice #{i}",
+            invoice_date=date(2025, 1 + i % 12, 1 + i % 28),
+            vendor_name=f"Vendor {i % 300}",
+            total_amount=round(10 + (i * 37) % 5000 + 0.5, 2),
+            labels=["Business"] if i % 3 else [],
+        ).model_dump()
+        record["invoice_date"] = str(record["invoice_date"])
+        records[record["id"]] = record
+    return records
+
+
+def legacy_get_all(data):
+    """The pre-cache get_all: migrate + fully validate every row on every call."""
+    invoices = []
+    for v in data.values():
+        if "status" not in v:
+            v["status"] = "Processed" if v.get("is_processed") is True else "Pending"
+        invoices.append(InvoiceData(**v))
+    return sorted(invoices, key=lambda x: x.id, reverse=True)
+
+
+def construct_all(data):
+    """Skipping validation with model_construct (dates still need parsing by hand)."""
+    invoices = []
+    for v in data.values():
+        values = dict(v)
+        if values.get("invoice_date"):
+            values["invoice_date"] = date.fromisoformat(values["invoice_date"])
+        invoices.append(InvoiceData.model_construct(**values))
+    return sorted(invoices, key=lambda x: x.id, reverse=True)
+
+
+def timed(fn, runs=3):
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+
+if __name__ == "__main__":
+    for size in SIZES:
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, "invoices.json")
+            records = make_records(size)
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({"schema_version": SCHEMA_VERSION, "invoices": records}, f)
+
+            service = StorageService(JsonStorageBackend(path))
+            data = service.backend.load_all()
+
+            def cold():
+                # Drop the cache so get_all has to materialize every record again
+                service._cache = None
+                service.get_all()
+
+            legacy_ms = timed(lambda: legacy_get_all(data))
+            construct_ms = timed(lambda: construct_all(data))
+            cold_ms = timed(cold)
+            warm_ms = timed(service.get_all)
+            assert [i.model_dump() for i in service.get_all()[:100]] == [i.model_dump() for i in legacy_get_all(data)[:100]]
+
+            print(f"{size:>7} records: migrate+validate (old) {legacy_ms:8.1f} ms | "
+                  f"model_construct {construct_ms:8.1f} ms | "
+                  f"cold cache build {cold_ms:8.1f} ms | cached {warm_ms:6.2f} ms")
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
@@ -0,0 +1,59 @@
+
+import os
+import sys
+import time
+
+# Add project root
+sys.path.append(os.getcwd())
+
+from fake_gmail_server import FakeGmailServer, FakeMailbox
+from backend.services.gmail_service import GmailService, build_gmail_service, GMAIL_BATCH_SIZE
+
+MESSAGE_COUNT = 500
+LATENCIES = [0.02, 0.05]
+
+
+def list_ids(service):
+    ids, page_token = [], None
+    while True:
+        results = service.users().messages().list(userId='me', maxResults=500, pageToken=page_token).execute()
+        ids.extend(m['id'] for m in results.get('messages', []))
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            return ids
+
+
+def sequential_fetch(service, ids):
+    """What scan_invoices used to do: one messages.get round trip per message."""
+    return {msg_id: service.users().messages().get(userId='me', id=msg_id).execute() for msg_id in ids}
+
+
+if __name__ == "__main__":
+    mailbox = FakeMailbox(MESSAGE_COUNT)
+    for latency in LATENCIES:
+        server = FakeGmailServer(mailbox, latency=latency).start()
+        try:
+            service = build_gmail_service(root_url=server.url)
+            ids = list_ids(service)
+            # Unknown ids come back as per-item 404s without failing the rest of the batch
+            ids_with_missing = ids + ["doesnotexist1", "doesnotexist2"]
+
+            server.reset_stats()
+            start = time.perf_counter()
+            sequential = sequential_fetch(service, ids)
+            sequential_s = time.perf_counter() - start
+            sequential_requests = server.http_requests
+
+            server.reset_stats()
+            start = time.perf_counter()
+            batched = GmailService().fetch_messages(service, ids_with_missing)
+            batched_s = time.perf_counter() - start
+            batched_requests = server.http_requests
+
+            assert batched == sequential, "batched fetch returned different messages"
+            print(f"latency {latency * 1000:.0f} ms, {len(ids)} messages: "
+                  f"sequential {sequential_s:6.2f}s ({sequential_requests} requests) | "
+                  f"batched x{GMAIL_BATCH_SIZE} {batched_s:6.2f}s ({batched_requests} requests) | "
+                  f"{sequential_s / batched_s:.1f}x faster")
+        finally:
+            server.stop()
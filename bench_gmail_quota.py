@@ -0,0 +1,56 @@
+
+import os
+import sys
+import time
+import shutil
+import contextlib
+from datetime import date
+
+# Add project root
+sys.path.append(os.getcwd())
+
+from fake_gmail_server import FakeGmailServer, FakeMailbox
+from backend.services import gmail_service as gmail_module
+from backend.services.gmail_service import GmailService, ScanContext
+from backend.services.gmail_rate_limiter import GmailRateLimiter
+
+MESSAGE_COUNT = 200
+LATENCY = 0.01
+# The fake server enforces a per-second quota like Gmail does, answering 429 past it
+SERVER_UNITS_PER_SECOND = 150
+LIMITERS = [
+    ("retries only (no limiter)", dict(units_per_second=1e9, max_concurrency=1000)),
+    ("limiter at Gmail's 250 units/s", dict(units_per_second=250, max_concurrency=8)),
+    (f"limiter at the server's {SERVER_UNITS_PER_SECOND} units/s", dict(units_per_second=SERVER_UNITS_PER_SECOND, max_concurrency=8)),
+]
+
+
+def quiet(fn):
+    # The scan prints a line per generated PDF; keep the benchmark output readable
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        return fn()
+
+
+if __name__ == "__main__":
+    server = FakeGmailServer(FakeMailbox(MESSAGE_COUNT), latency=LATENCY, quota=SERVER_UNITS_PER_SECOND).start()
+    gmail_module.GMAIL_API_ROOT_URL = server.url
+    gmail_module.attachment_store.root = "backend/static/bench_invoices"
+    gmail_module.scan_checkpoint_service.checkpoints_file = "backend/static/bench_invoices/checkpoints.json"
+    os.makedirs(gmail_module.attachment_store.root, exist_ok=True)
+    try:
+        print(f"{MESSAGE_COUNT} messages, server quota {SERVER_UNITS_PER_SECOND} units/s, {LATENCY * 1000:.0f} ms latency")
+        for label, settings in LIMITERS:
+            limiter = GmailRateLimiter(**settings)
+            gmail_module.gmail_rate_limiter = limiter
+            server.reset_stats()
+            scan = ScanContext()
+            start = time.perf_counter()
+            result = quiet(lambda: GmailService().scan_invoices(date(2020, 1, 1), date(2030, 1, 1), workers={"download": 8}, scan=scan))
+            elapsed = time.perf_counter() - start
+            stats = limiter.stats()
+            print(f"{label:<36} {elapsed:6.2f}s  invoices {result.invoices_found}/{MESSAGE_COUNT}  "
+                  f"429s {server.throttled:4}  retries {stats['retries']:4}  throttled {scan.progress()['timings']['throttled']:6.1f}s  "
+                  f"concurrency {stats['concurrency_limit']}")
+    finally:
+        server.stop()
+        shutil.rmtree("backend/static/bench_invoices", ignore_errors=True)
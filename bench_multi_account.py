@@ -0,0 +1,107 @@
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+import contextlib
+from collections import Counter
+from datetime import date
+
+# Add project root
+sys.path.append(os.getcwd())
+os.makedirs("backend/static/invoices", exist_ok=True)
+
+from backend.services import gmail_service as gmail_module
+from backend.services.attachment_store import AttachmentStore
+from backend.services.storage_backends import JsonStorageBackend
+from backend.services.storage_service import storage_service
+from backend.services.sync_state_service import sync_state_service
+from backend.services.scan_checkpoint_service import scan_checkpoint_service
+from backend.services.gmail_account_service import GmailAccountService
+from backend.services import scan_job_service as scan_job_module
+from backend.services.scan_job_service import run_scan
+
+ACCOUNTS = ["office@example.com", "billing@example.com", "owner@example.com"]
+MESSAGE_COUNT = 120
+# (corpus, latency): attachments only, over a local and a typical round trip to Google; then a
+# mix where one email in five has its body rendered to a PDF, which is CPU work under the GIL
+RUNS = [("attachments", 0.02), ("attachments", 0.15), ("invoices", 0.15)]
+# Gmail's per-user quota, enforced by each fake server for its own mailbox
+QUOTA = 250
+FIRST_PORT = 8790
+
+
+def start_server(email, port, corpus, latency):
+    # A process per mailbox: in-process servers would compete with the scan for the GIL
+    process = subprocess.Popen(
+        [sys.executable, "fake_gmail_server.py", "--email", email, "--port", str(port), "--messages", str(MESSAGE_COUNT),
+         "--corpus", corpus, "--latency", str(latency), "--quota", str(QUOTA)],
+        stdout=subprocess.PIPE, text=True,
+    )
+    process.stdout.readline() # Listening
+    return process, f"http://127.0.0.1:{port}/"
+
+
+def quiet(fn):
+    # The scan prints a line per generated PDF; keep the benchmark output readable
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        return fn()
+
+
+def fresh_storage(tmp_dir, label):
+    storage_service.backend = JsonStorageBackend(os.path.join(tmp_dir, f"{label}.json"))
+
+
+def timed(label, fn):
+    start, cpu_start = time.perf_counter(), time.process_time()
+    result = quiet(fn)
+    elapsed = time.perf_counter() - start
+    # PDF parsing holds the GIL: CPU seconds bound how far concurrent accounts can overlap
+    print(f"  {label:<28} {elapsed:6.2f}s  cpu {time.process_time() - cpu_start:5.2f}s  {result['invoices']} invoices")
+    return elapsed, result
+
+
+def compare(corpus, latency):
+    def one_by_one():
+        fresh_storage(tmp_dir, f"sequential-{corpus}-{latency}")
+        results = [run_scan(date(2020, 1, 1), date(2030, 1, 1), accounts=[email]) for email in ACCOUNTS]
+        return {"invoices": sum(result.invoices_found for result in results)}
+
+    def side_by_side():
+        fresh_storage(tmp_dir, f"concurrent-{corpus}-{latency}")
+        result = run_scan(date(2020, 1, 1), date(2030, 1, 1), accounts=ACCOUNTS)
+        return {"invoices": result.invoices_found, "result": result}
+
+    print(f"{len(ACCOUNTS)} accounts x {MESSAGE_COUNT} '{corpus}' messages, {latency * 1000:.0f} ms latency, {QUOTA} units/s each")
+    sequential_s, _ = timed("one account after another", one_by_one)
+    concurrent_s, concurrent = timed("all accounts concurrently", side_by_side)
+    print(f"  speedup {sequential_s / concurrent_s:.1f}x")
+
+    result = concurrent["result"]
+    assert result.accounts == ACCOUNTS and not result.failed_accounts
+    per_account = Counter(inv.account for inv in storage_service.get_all())
+    assert per_account == Counter({email: MESSAGE_COUNT for email in ACCOUNTS}), per_account
+
+
+if __name__ == "__main__":
+    tmp_dir = tempfile.mkdtemp()
+    gmail_module.attachment_store = AttachmentStore(root=os.path.join(tmp_dir, "blobs"), files_dir=tmp_dir)
+    scan_checkpoint_service.checkpoints_file = os.path.join(tmp_dir, "checkpoints.json")
+    sync_state_service.state_file = os.path.join(tmp_dir, "sync_state.json")
+    try:
+        for corpus, latency in RUNS:
+            servers = [start_server(email, FIRST_PORT + n, corpus, latency) for n, email in enumerate(ACCOUNTS)]
+            accounts = GmailAccountService(tokens_dir=os.path.join(tmp_dir, "tokens"))
+            scan_job_module.gmail_account_service = accounts
+            try:
+                for _, url in servers:
+                    quiet(lambda: accounts.add(root_url=url))
+                compare(corpus, latency)
+            finally:
+                for process, _ in servers:
+                    process.terminate()
+                    process.wait()
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
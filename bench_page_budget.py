@@ -0,0 +1,72 @@
+
+import io
+import os
+import sys
+import time
+
+# Add project root
+sys.path.append(os.getcwd())
+
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+from backend.services.extraction_service import extraction_service, EXTRACTION_MAX_PAGES
+from backend.services.pdf_text_backends import pdf_text_extractor
+
+LINES_PER_PAGE = 45
+# (documents, pages, VAT line on the last page): one-page invoices, short ones, long statements,
+# and long statements whose VAT is not printed (read up to EXTRACTION_MAX_PAGES)
+CORPUS = [(12, 1, True), (8, 4, True), (4, 60, True), (2, 60, False)]
+
+
+def make_statement_pdf(n: int, pages: int, with_vat: bool) -> bytes:
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    total = 0.0
+    for page in range(pages):
+        y = 800
+        pdf.drawString(40, y, f"Vendor {n} Ltd.   Statement {40000 + n}   Date: {1 + n % 28:02d}/{1 + n % 12:02d}/2025   Page {page + 1}/{pages}")
+        for line in range(LINES_PER_PAGE if pages > 1 else 8):
+            y -= 16
+            amount = round(1 + (n * 29 + page * 7 + line * 13) % 15 + 0.5, 2)
+            total += amount
+            pdf.drawString(40, y, f"{line + 1:4d}  Usage charge {line} for line {n}-{page}   {amount:,.2f}")
+        if page == pages - 1:
+            y -= 24
+            if with_vat:
+                pdf.drawString(40, y, f"VAT 18%: {total * 18 / 118:,.2f}")
+            pdf.drawString(40, y - 16, f"Total: {total:,.2f} ILS")
+        pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
+
+
+def read(pdf, budgeted):
+    if budgeted:
+        text = extraction_service.extract_text(pdf, "bench.pdf")
+    else:
+        text = pdf_text_extractor.extract_text(pdf, "bench.pdf")
+    return extraction_service._extract_from_text(text, "bench.pdf"), text.count(" Page ")
+
+
+def run(label, documents, budgeted):
+    start = time.perf_counter()
+    results = [read(pdf, budgeted) for pdf in documents]
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<12} {elapsed:6.2f}s  {sum(pages for _, pages in results):4d} pages read")
+    return [fields for fields, _ in results], elapsed
+
+
+if __name__ == "__main__":
+    print(f"EXTRACTION_MAX_PAGES={EXTRACTION_MAX_PAGES}")
+    n = 0
+    for count, pages, with_vat in CORPUS:
+        documents = [make_statement_pdf(n + i, pages, with_vat) for i in range(count)]
+        n += count
+        print(f"{count} PDFs of {pages} page{'s' if pages > 1 else ''}{'' if with_vat else ', no VAT line'}")
+        full, full_s = run("every page", documents, budgeted=False)
+        budgeted, budgeted_s = run("page budget", documents, budgeted=True)
+        same = sum(a == b for a, b in zip(full, budgeted))
+        print(f"  {full_s / budgeted_s:.1f}x, same fields for {same}/{count}")
+        if with_vat:
+            assert same == count, "stopping early changed the fields found"
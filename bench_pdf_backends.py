@@ -0,0 +1,114 @@
+
+import io
+import os
+import re
+import sys
+import time
+import contextlib
+
+# Add project root
+sys.path.append(os.getcwd())
+
+from bidi.algorithm import get_display
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+from backend.services.extraction_service import extraction_service
+from backend.services.pdf_text_backends import BACKENDS, PdfTextExtractor
+
+DOCUMENTS = 60
+MAX_PAGES = 4
+LINES_PER_PAGE = 30
+# The font the app renders Hebrew email bodies with
+FONT_FILE = "backend/static/fonts/arial.ttf"
+FONT_NAME = "BenchArial"
+NUMBER = re.compile(r"\d[\d,./:-]*\d|\d")
+
+
+def make_invoice_pdf(n: int) -> bytes:
+    """Invoice n: Hebrew (right-aligned, drawn in visual order like most generators do) when n is odd."""
+    hebrew = n % 2 == 1
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    pages = 1 + n % MAX_PAGES
+    total = 0.0
+
+    def line(y, text):
+        pdf.setFont(FONT_NAME, 10)
+        if hebrew:
+            pdf.drawRightString(555, y, get_display(text))
+        else:
+            pdf.drawString(40, y, text)
+
+    for page in range(pages):
+        y = 800
+        day, month = 1 + n % 28, 1 + n % 12
+        if hebrew:
+            line(y, f"חשבונית מס קבלה מספר {30000 + n}   תאריך: {day:02d}/{month:02d}/2025   עמוד {page + 1} מתוך {pages}")
+        else:
+            line(y, f"Tax invoice No. {30000 + n}   Date: {day:02d}/{month:02d}/2025   Page {page + 1} of {pages}")
+        for item in range(LINES_PER_PAGE):
+            y -= 18
+            amount = round(5 + (n * 17 + page * 11 + item * 7) % 300 + 0.25, 2)
+            total += amount
+            if hebrew:
+                line(y, f"{page * LINES_PER_PAGE + item + 1}. שירות חודשי {item} ללקוח {n}   כמות 1   {amount:,.2f} ₪")
+            else:
+                line(y, f"{page * LINES_PER_PAGE + item + 1}. Monthly service {item} for customer {n}   qty 1   {amount:,.2f} ILS")
+        pdf.showPage()
+    vat = total * 18 / 118
+    line(800, f'מע"מ 18%: {vat:,.2f}   סה"כ לתשלום: {total:,.2f} ₪' if hebrew else f"VAT 18%: {vat:,.2f}   Total: {total:,.2f} ILS")
+    pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
+
+
+def quiet(fn):
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        return fn()
+
+
+def numbers(text: str):
+    # Word order differs between backends (Hebrew lines are reversed by some); the numbers don't
+    return sorted(NUMBER.findall(text))
+
+
+def fields(text: str) -> dict:
+    return extraction_service._extract_from_text(text, "bench.pdf")
+
+
+if __name__ == "__main__":
+    pdfmetrics.registerFont(TTFont(FONT_NAME, FONT_FILE))
+    pdfs = [make_invoice_pdf(n) for n in range(DOCUMENTS)]
+    pages = sum(1 + n % MAX_PAGES + 1 for n in range(DOCUMENTS))
+    print(f"{DOCUMENTS} PDFs ({DOCUMENTS // 2} Hebrew), {pages} pages")
+
+    texts = {}
+    for name, backend in BACKENDS.items():
+        start = time.perf_counter()
+        texts[name] = [backend.extract_text(pdf) for pdf in pdfs]
+        elapsed = time.perf_counter() - start
+        print(f"  {name:<11} {elapsed:6.2f}s  {pages / elapsed:7.1f} pages/s")
+
+    # Agreement with pdfplumber, which invoices were always read with
+    reference = texts["pdfplumber"]
+    reference_fields = [fields(text) for text in reference]
+    print("Agreement with pdfplumber (English / Hebrew documents):")
+    for name in BACKENDS:
+        same_fields = [fields(text) == expected for text, expected in zip(texts[name], reference_fields)]
+        same_numbers = [numbers(text) == numbers(expected) for text, expected in zip(texts[name], reference)]
+        english, hebrew = slice(0, None, 2), slice(1, None, 2)
+        print(f"  {name:<11} fields {sum(same_fields[english])}/{DOCUMENTS // 2} / {sum(same_fields[hebrew])}/{DOCUMENTS // 2}"
+              f"   numbers {sum(same_numbers[english])}/{DOCUMENTS // 2} / {sum(same_numbers[hebrew])}/{DOCUMENTS // 2}")
+        assert all(same_fields), f"{name} finds other invoice fields than pdfplumber"
+
+    # Fallback: PDFium refuses a PDF whose %PDF header is cut off, the next backend reads it
+    headless = pdfs[0][len(b"%PDF-1.4\n"):]
+    chain = PdfTextExtractor("pdfium,pdfplumber")
+    text = quiet(lambda: chain.extract_text(headless, "headless.pdf"))
+    assert text is not None and fields(text) == reference_fields[0]
+    truncated = pdfs[0][:len(pdfs[0]) // 2]
+    assert quiet(lambda: chain.extract_text(truncated, "truncated.pdf")) is None
+    print("Fallback: a PDF PDFium can't open is read by the next backend; a truncated one by none")
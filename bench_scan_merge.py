@@ -0,0 +1,133 @@
+
+import os
+import sys
+import time
+import json
+import shutil
+import tempfile
+from datetime import date
+
+# Add project root
+sys.path.append(os.getcwd())
+os.makedirs("backend/static/invoices", exist_ok=True)
+
+from backend.models import InvoiceData, ScanResult
+from backend.services.storage_backends import JsonStorageBackend
+from backend.services.storage_service import storage_service
+from backend.services.rule_service import rule_service
+from backend import main
+
+HISTORY_SIZE = 20000
+SCAN_SIZE = 500
+
+
+class CountingJsonBackend(JsonStorageBackend):
+    """JSON backend that counts snapshot loads and journal appends."""
+    def __init__(self, db_file):
+        self.loads = 0
+        self.writes = 0
+        # Keep compaction out of the measurement
+        super().__init__(db_file, compact_bytes=sys.maxsize)
+
+    def _load(self):
+        self.loads += 1
+        return super()._load()
+
+    def _append(self, entries):
+        self.writes += 1
+        return super()._append(entries)
+
+
+def make_invoice(i: int) -> InvoiceData:
+    return InvoiceData(
+        id=f"msg{i:08d}",
+        filename=f"invoice_{i}.pdf",
+        sender_email=f"billing@vendor{i % 300}.com",
+        subject=f"Invoice #{i}",
+        invoice_date=date(2025, 1 + i % 12, 1 + i % 28),
+        vendor_name=f"Vendor {i % 300}",
+        total_amount=round(10 + (i * 37) % 5000 + 0.5, 2),
+        vat_amount=None,
+        download_url=None if i % 2 else f"http://127.0.0.1:8000/files/msg{i:08d}_invoice_{i}.pdf",
+    )
+
+
+def build_history(path: str):
+    data = {}
+    for i in range(HISTORY_SIZE):
+        record = make_invoice(i).model_dump()
+        record["invoice_date"] = str(record["invoice_date"])
+        data[record["id"]] = record
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+
+
+def build_scan() -> ScanResult:
+    # Half already in history (some get a download_url backfill), half new
+    invoices = [make_invoice(i) for i in range(HISTORY_SIZE - SCAN_SIZE // 2, HISTORY_SIZE + SCAN_SIZE // 2)]
+    for inv in invoices:
+        inv.download_url = f"http://127.0.0.1:8000/files/{inv.id}_{inv.filename}"
+    return ScanResult(total_emails_scanned=len(invoices), invoices_found=len(invoices), invoices=invoices)
+
+
+def legacy_merge(scan_result: ScanResult):
+    """The pre-batch /scan merge loop: one storage call (load + maybe save) per message."""
+    final_invoices = []
+    for fresh_inv in scan_result.invoices:
+        existing = storage_service.get_by_id(fresh_inv.id)
+        if existing:
+            if fresh_inv.download_url and not existing.download_url:
+                storage_service.update_invoice(existing.id, {"download_url": fresh_inv.download_url})
+                existing.download_url = fresh_inv.download_url
+            if rule_service.should_delete(existing):
+                storage_service.delete_invoice(existing.id)
+            else:
+                final_invoices.append(existing)
+        else:
+            processed_inv = rule_service.apply_rules(fresh_inv)
+            if processed_inv:
+                storage_service.save_invoice(processed_inv)
+                final_invoices.append(processed_inv)
+    return final_invoices
+
+
+def run(label, fn, scan_result):
+    tmp_dir = tempfile.mkdtemp()
+    path = os.path.join(tmp_dir, "invoices.json")
+    build_history(path)
+    backend = CountingJsonBackend(path)
+    storage_service.backend = backend
+
+    # Silence the per-save log line so it doesn't dominate the timing
+    real_stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        start = time.perf_counter()
+        fn(scan_result)
+        elapsed = time.perf_counter() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = real_stdout
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    print(f"{label:<10} loads={backend.loads:<5} writes={backend.writes:<5} time={elapsed:.2f}s")
+    return elapsed
+
+
+if __name__ == "__main__":
+    print(f"Merging {SCAN_SIZE} scanned messages into a {HISTORY_SIZE}-invoice history (JSON backend)")
+
+    legacy_time = run("legacy", legacy_merge, build_scan())
+
+    # Drive the real /scan handler with a canned Gmail result
+    scan_result = build_scan()
+    def canned_scan(start_date, end_date, scan=None, **options):
+        # Like the real scan, hand each invoice over as it is built (they are saved in batches)
+        for invoice in scan_result.invoices:
+            scan.on_invoice(invoice)
+        return scan_result
+
+    main.gmail_service.scan_invoices = canned_scan
+    batch_time = run("batch", lambda _: main.scan_emails(date(2025, 1, 1), date(2025, 12, 31), accounts=None), scan_result)
+
+    print(f"Speedup: {legacy_time / batch_time:.1f}x")
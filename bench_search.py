@@ -0,0 +1,57 @@
+
+import os
+import sys
+import time
+import random
+from datetime import date
+
+# Add project root
+sys.path.append(os.getcwd())
+
+from backend.models import InvoiceData
+from backend.services.search_index import SearchIndex
+
+INVOICE_COUNT = 100000
+QUERIES = ["חשבונית", "קבלה חשמל", "amazon", "inv", "billing@vendor12", "בעמ", "לחשבונית", "google cloud receipt", "nomatchatall"]
+
+VENDORS = ["Amazon", "Google Cloud", "DigitalOcean", "Upwork", "Fiverr", "פרטנר תקשורת", "חברת החשמל", "בזק", "קבענו בע\"מ", "סלקום"]
+SUBJECTS = ["Invoice #{n}", "Receipt for order {n}", "חשבונית מס קבלה מספר {n}", "קבלה על תשלום {n}", "Your bill {n}", "לחשבונית מס' {n}"]
+
+
+def make_invoices():
+    rng = random.Random(7)
+    for i in range(INVOICE_COUNT):
+        vendor = rng.choice(VENDORS)
+        yield InvoiceData(
+            id=f"msg{i:08d}",
+            filename=f"invoice_{i}.pdf",
+            sender_email=f"billing@vendor{i % 500}.com",
+            subject=rng.choice(SUBJECTS).format(n=rng.randint(1000, 99999)),
+            invoice_date=date(2025, 1 + i % 12, 1 + i % 28),
+            vendor_name=vendor,
+            total_amount=round(rng.uniform(10, 5000), 2),
+            comments="" if i % 5 else "paid by credit card / שולם באשראי",
+        )
+
+
+if __name__ == "__main__":
+    index = SearchIndex()
+    start = time.perf_counter()
+    for invoice in make_invoices():
+        index.add(invoice)
+    print(f"Indexed {INVOICE_COUNT} invoices in {time.perf_counter() - start:.2f}s")
+
+    for query in QUERIES:
+        runs = 20
+        start = time.perf_counter()
+        for _ in range(runs):
+            hits = index.search(query)
+        elapsed_ms = (time.perf_counter() - start) / runs * 1000
+        print(f"{query!r:<28} hits={len(hits):<7} {elapsed_ms:7.2f} ms")
+
+    # Incremental maintenance cost
+    sample = InvoiceData(id="msg00000001", filename="x.pdf", sender_email="a@b.com", subject="חשבונית חדשה", vendor_name="Updated")
+    start = time.perf_counter()
+    for _ in range(1000):
+        index.add(sample)
+    print(f"Re-index single invoice: {(time.perf_counter() - start):.3f} ms avg")
@@ -0,0 +1,84 @@
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+
+# Add project root
+sys.path.append(os.getcwd())
+
+from fake_gmail_server import FakeGmailServer, FakeMailbox
+from backend.services import rule_service as rule_module
+from backend.services.gmail_service import GmailService, ScanContext, build_gmail_service, find_pdf_part, GMAIL_BATCH_SIZE
+from backend.models import Rule
+
+MESSAGE_COUNT = 300
+LATENCY = 0.02
+# One of the five fake vendors is dropped by a rule on its sender
+DENY_RULE = Rule(
+    name="No DigitalOcean", conditions=[{"field": "sender_email", "operator": "contains", "value": "digitalocean"}],
+    actions=[{"action_type": "delete_invoice", "value": ""}],
+)
+
+
+def download_pdfs(service, messages):
+    for msg in messages:
+        pdf_part = find_pdf_part(msg.get('payload', {}))
+        if pdf_part and 'attachmentId' in pdf_part.get('body', {}):
+            service.users().messages().attachments().get(userId='me', messageId=msg['id'], id=pdf_part['body']['attachmentId']).execute()
+
+
+def one_phase(scanner, service, ids):
+    """Full payload of every message, and every PDF, as before."""
+    details = scanner.fetch_messages(service, ids)
+    download_pdfs(service, details.values())
+    return details
+
+
+def two_phase(scanner, ids, scan):
+    results = []
+    for start in range(0, len(ids), GMAIL_BATCH_SIZE):
+        results.extend(scanner._fetch_stage(scan, list(enumerate(ids[start:start + GMAIL_BATCH_SIZE], start))))
+    messages = [message for _, message in results]
+    download_pdfs(scanner._thread_service(), messages)
+    return messages
+
+
+if __name__ == "__main__":
+    tmp_dir = tempfile.mkdtemp()
+    rule_module.RULES_FILE = os.path.join(tmp_dir, "rules.json")
+    rule_module.REJECTED_IDS_FILE = os.path.join(tmp_dir, "rejected_ids.json")
+    with open(rule_module.RULES_FILE, "w") as f:
+        json.dump([DENY_RULE.model_dump()], f)
+
+    server = FakeGmailServer(FakeMailbox(MESSAGE_COUNT), latency=LATENCY).start()
+    from backend.services import gmail_service as gmail_module
+    gmail_module.GMAIL_API_ROOT_URL = server.url
+    try:
+        scanner = GmailService()
+        service = build_gmail_service(root_url=server.url)
+        ids = list(server.httpd.api.mailbox.order)
+
+        server.reset_stats()
+        start = time.perf_counter()
+        old = one_phase(scanner, service, ids)
+        old_s, old_bytes, old_calls = time.perf_counter() - start, server.bytes_sent, server.api_calls
+
+        server.reset_stats()
+        scan = ScanContext(rule_module.rule_service.rejects_headers)
+        start = time.perf_counter()
+        new = two_phase(scanner, ids, scan)
+        new_s, new_bytes, new_calls = time.perf_counter() - start, server.bytes_sent, server.api_calls
+
+        kept = {m['id'] for m in new}
+        assert kept == set(old) - set(scan.rejected_ids), "two-phase fetch lost messages"
+        print(f"{MESSAGE_COUNT} messages, {len(scan.rejected_ids)} dropped by a sender rule, {LATENCY * 1000:.0f} ms latency")
+        print(f"full payloads       {old_s:6.2f}s  {old_bytes / 1024:8.0f} KB  {old_calls} API calls")
+        print(f"outline, then full  {new_s:6.2f}s  {new_bytes / 1024:8.0f} KB  {new_calls} API calls")
+        print(f"measured saving {(old_bytes - new_bytes) / 1024:.0f} KB, reported estimate {scan.bytes_saved / 1024:.0f} KB "
+              f"({scan.full_fetches_skipped} full payloads skipped)")
+    finally:
+        server.stop()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
@@ -0,0 +1,738 @@
+
+"""
+Local stand-in for the Gmail REST API, for benchmarks and offline runs.
+
+Serves users.getProfile, messages.list (with search queries), messages.get, attachments.get,
+history.list and the batch endpoint from an in-memory mailbox, and sleeps `latency` seconds per HTTP
+request to imitate a round trip to Google. Mailboxes are built from corpora of realistic message
+shapes (see CORPORA), and rate limiting / server errors can be injected.
+
+    python fake_gmail_server.py --messages 500 --latency 0.05 --corpus realistic --quota 250
+    GMAIL_API_ROOT_URL=http://127.0.0.1:8765/ uvicorn backend.main:app
+"""
+import re
+import json
+import random
+import hashlib
+import time
+import base64
+import argparse
+import threading
+from email.parser import BytesParser
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+VENDORS = [
+    ("Amazon", "billing@amazon.com"),
+    ("Google Cloud", "payments-noreply@google.com"),
+    ("DigitalOcean", "support@digitalocean.com"),
+    ("Partner Communications", "invoice@partner.co.il"),
+    ("Electric Company", "noreply@iec.co.il"),
+]
+
+
+def make_pdf(lines) -> bytes:
+    """A small but valid one-page PDF (Helvetica text), readable by pdfplumber."""
+    text_ops = ["BT", "/F1 12 Tf", "72 770 Td", "16 TL"]
+    for line in lines:
+        escaped = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+        text_ops.append(f"({escaped}) Tj T*")
+    text_ops.append("ET")
+    stream = "\n".join(text_ops).encode("latin-1")
+
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R /Resources << /Font << /F1 5 0 R >> >> >>",
+        b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref_at = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_at)
+    return bytes(out)
+
+
+_EMAIL_STYLE = "".join(
+    f".c{n} {{font-family: Arial, Helvetica, sans-serif; font-size: {12 + n % 4}px; color: #33{n:02d}44; padding: 4px 8px; border-bottom: 1px solid #eeeeee;}}\n"
+    for n in range(40)
+)
+
+
+def _invoice_html(vendor, number, total, line_items):
+    """Marketing-style HTML invoice email: inline CSS and a table of line items (tens of KB, like the real ones)."""
+    rows = "".join(
+        f'<tr><td class="c{n % 40}" style="text-align:left;width:60%">Service item {n + 1} - monthly subscription</td>'
+        f'<td class="c{(n + 7) % 40}" style="text-align:right">{(total / line_items):,.2f} ILS</td></tr>\n'
+        for n in range(line_items)
+    )
+    return (
+        f"<html><head><style>{_EMAIL_STYLE}</style></head><body>"
+        f'<table width="100%" cellpadding="0" cellspacing="0" style="max-width:640px;margin:0 auto">'
+        f'<tr><td><h1 class="c1">{vendor}</h1><p class="c2">Thanks for your business. Invoice {number}.</p></td></tr>'
+        f"<tr><td><table width=\"100%\">{rows}</table></td></tr>"
+        f'<tr><td class="c3"><p>Total: {total:,.2f} ILS</p></td></tr>'
+        f"</table></body></html>"
+    )
+
+
+def _hebrew_html(vendor, number, total):
+    return (
+        f'<html dir="rtl"><body><h2>{vendor}</h2>'
+        f"<p>שלום, מצורפת חשבונית מס קבלה מספר {number}.</p>"
+        f"<p>סה\"כ לתשלום: {total:,.2f} ₪ (כולל מע\"מ)</p>"
+        f"<p>תודה שבחרת ב-{vendor}</p></body></html>"
+    )
+
+
+def _newsletter_html(vendor):
+    items = "".join(f'<li class="c{n}">Product update {n + 1}: new features are rolling out this month.</li>' for n in range(12))
+    return f"<html><head><style>{_EMAIL_STYLE}</style></head><body><h1>{vendor} weekly</h1><ul>{items}</ul></body></html>"
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode("ascii")
+
+
+def _padding(size, seed) -> bytes:
+    """`size` bytes that do not compress (attachments are mostly compressed streams and images)."""
+    out = bytearray()
+    counter = 0
+    while len(out) < size:
+        out += hashlib.sha256(f"{seed}:{counter}".encode()).digest()
+        counter += 1
+    return bytes(out[:size])
+
+
+# MIME tree nodes, turned into Gmail's message format by FakeMailbox
+def leaf(mime_type, data: bytes, filename="", inline=False, headers=()):
+    return {"mimeType": mime_type, "data": data, "filename": filename, "inline": inline, "headers": list(headers)}
+
+
+def multipart(mime_type, *children, headers=()):
+    return {"mimeType": mime_type, "children": list(children), "headers": list(headers)}
+
+
+# Message kinds a corpus is made of, cycled by message number
+KINDS = ("pdf", "html", "forward", "octet_pdf", "pdf_only", "inline_image", "hebrew", "resend", "newsletter")
+CORPORA = {
+    # One in five without an attachment; what the benchmarks have always used
+    "invoices": ["html", "pdf", "pdf", "pdf", "pdf"],
+    # A mix of the shapes real invoice mail comes in, plus mail the scan query must leave out
+    "realistic": ["pdf", "html", "forward", "pdf", "octet_pdf", "newsletter", "pdf_only", "inline_image",
+                  "hebrew", "pdf", "resend", "newsletter"],
+    "hebrew": ["hebrew", "hebrew", "html", "hebrew", "pdf"],
+    # Every invoice attached as a PDF: no email body is rendered
+    "attachments": ["pdf"],
+}
+# Attachment size per corpus (real invoice PDFs carry fonts and logos); None keeps the bare PDF
+CORPUS_ATTACHMENT_KB = {"invoices": None, "realistic": 60, "hebrew": 40, "attachments": None}
+
+
+class FakeMailbox:
+    """
+    Deterministic mailbox of invoice emails, newest first like Gmail lists them.
+    `corpus` names the mix of message shapes (CORPORA), or is a list of KINDS to cycle through.
+    """
+
+    def __init__(self, count=500, email_address="me@example.com", corpus="invoices", attachment_kb=None,
+                 start=datetime(2025, 1, 1, 9, 0, tzinfo=timezone.utc), interval=timedelta(hours=6)):
+        self.email_address = email_address
+        self.kinds = CORPORA[corpus] if isinstance(corpus, str) else list(corpus)
+        if attachment_kb is None and isinstance(corpus, str):
+            attachment_kb = CORPUS_ATTACHMENT_KB.get(corpus)
+        self.attachment_kb = attachment_kb
+        self.messages = {}
+        self.attachments = {}
+        self.order = []
+        # Per message, for search queries: lowercased text, its words, send time, kind
+        self.search_text = {}
+        self.search_words = {}
+        self.sent_at = {}
+        self.kind = {}
+        self.with_attachment = set()
+        # (historyId, message id) per delivered message, oldest first
+        self.history = []
+        self.history_id = 1000
+        # history.list answers 404 for start ids below this, like Gmail does for expired history
+        self.history_floor = 0
+        self._lock = threading.Lock()
+        self._start = start
+        self._interval = interval
+        self._last_pdf = None
+        # Ids differ between mailboxes, as they do between Gmail accounts
+        self._id_base = 0x18d0000000000000 + (int(hashlib.sha256(email_address.encode()).hexdigest()[:4], 16) << 36)
+        for i in range(count):
+            self._add(i, self._start + self._interval * i)
+
+    def deliver(self, count=1):
+        """New mail arrives: adds `count` messages and returns their ids."""
+        with self._lock:
+            first = len(self.messages)
+            return [self._add(i, self._start + self._interval * i) for i in range(first, first + count)]
+
+    def expire_history(self):
+        """Forgets all history so far, so older sync points are rejected."""
+        self.history_floor = self.history_id
+
+    def _invoice_pdf(self, i, vendor, sent_at, total, vat):
+        pdf = make_pdf([
+            f"{vendor} Ltd.",
+            f"Invoice No. {10000 + i}",
+            f"Date: {sent_at.strftime('%d/%m/%Y')}",
+            f"VAT 18%: {vat:,.2f}",
+            f"Total: {total:,.2f} ILS",
+        ])
+        if self.attachment_kb:
+            # Trailing bytes after %%EOF are ignored by PDF readers
+            pdf += b"%" + _padding(self.attachment_kb * 1024, i)
+        return pdf
+
+    def _add(self, i, sent_at):
+        msg_id = f"{self._id_base + i * 7919:x}"
+        kind = self.kinds[i % len(self.kinds)]
+        vendor, sender = VENDORS[i % len(VENDORS)]
+        total = round(50 + (i * 37) % 4000 + 0.9, 2)
+        vat = round(total * 18 / 118, 2)
+        subject = f"Invoice {10000 + i} from {vendor}"
+        from_header = f'"{vendor}" <{sender}>'
+        html = _invoice_html(vendor, 10000 + i, total, line_items=8 + i % 25)
+        text = f"Thanks for your business.\nTotal: {total:,.2f} ILS\n"
+        snippet = f"Thanks for your business. Total: {total:,.2f} ILS"
+        filename = f"invoice_{10000 + i}.pdf"
+        body = multipart("multipart/alternative", leaf("text/plain", text.encode()), leaf("text/html", html.encode()))
+
+        if kind in ("pdf", "resend", "forward", "octet_pdf", "pdf_only", "hebrew"):
+            pdf = self._invoice_pdf(i, vendor, sent_at, total, vat)
+            if kind == "resend" and self._last_pdf:
+                # The vendor sent the same PDF again ("reminder"): identical bytes, new message
+                pdf, filename = self._last_pdf
+                subject = f"Reminder: {subject}"
+            self._last_pdf = (pdf, filename)
+
+        if kind == "html":
+            tree = multipart("multipart/mixed", body)
+        elif kind == "forward":
+            # Forwarded by a colleague: the original email is a message/rfc822 part with its own headers
+            original = multipart("multipart/mixed", body, leaf("application/pdf", pdf, filename), headers=[
+                ("From", from_header), ("Subject", subject), ("Date", format_datetime(sent_at - timedelta(days=2))),
+            ])
+            note = "Forwarding this for the books.\n\n---------- Forwarded message ---------\n"
+            tree = multipart("multipart/mixed", leaf("text/plain", note.encode()), {"mimeType": "message/rfc822", "children": [original], "headers": []})
+            subject, from_header = f"Fwd: {subject}", '"Dana (Accounting)" <dana@example.com>'
+        elif kind == "octet_pdf":
+            # Some mailers label every attachment application/octet-stream; only the name says PDF
+            tree = multipart("multipart/mixed", leaf("text/html", html.encode()), leaf("application/octet-stream", pdf, filename.upper()))
+        elif kind == "pdf_only":
+            # No body at all: the message itself is the PDF
+            tree = leaf("application/pdf", pdf, filename)
+            snippet = ""
+        elif kind == "inline_image":
+            # Receipt in the body with an embedded logo, no attachment
+            logo = leaf("image/png", b"\x89PNG\r\n\x1a\n" + _padding(8 * 1024, i), "logo.png", inline=True)
+            tree = multipart("multipart/mixed", multipart("multipart/related", body, logo))
+            subject = f"Your receipt from {vendor} #{10000 + i}"
+        elif kind == "hebrew":
+            he_html = _hebrew_html(vendor, 10000 + i, total)
+            he_text = f"מצורפת חשבונית מס קבלה מספר {10000 + i}. סה\"כ לתשלום: {total:,.2f} ₪\n"
+            he_body = multipart("multipart/alternative", leaf("text/plain", he_text.encode()), leaf("text/html", he_html.encode()))
+            tree = multipart("multipart/mixed", he_body, leaf("application/pdf", pdf, f"heshbonit_{10000 + i}.pdf"))
+            subject = f"חשבונית מס קבלה {10000 + i} - {vendor}"
+            snippet = he_text.strip()
+        elif kind == "newsletter":
+            news = _newsletter_html(vendor)
+            tree = multipart("multipart/mixed", multipart("multipart/alternative", leaf("text/plain", b"Product updates this week."), leaf("text/html", news.encode())))
+            subject, snippet = f"What's new at {vendor} this week", "Product updates this week."
+        else: # pdf, resend
+            tree = multipart("multipart/mixed", body, leaf("application/pdf", pdf, filename))
+
+        headers = [
+            ("From", from_header),
+            ("To", self.email_address),
+            ("Subject", subject),
+            ("Date", format_datetime(sent_at)),
+            ("Message-ID", f"<{msg_id}@mail.example.com>"),
+            ("MIME-Version", "1.0"),
+        ]
+        payload = self._part(msg_id, tree, "")
+        payload["headers"] = [{"name": name, "value": value} for name, value in headers] + payload["headers"]
+
+        text_parts = [subject, from_header, snippet]
+        self._collect_text(tree, text_parts)
+        self.search_text[msg_id] = "\n".join(text_parts).lower()
+        self.search_words[msg_id] = set(re.findall(r"\w+", self.search_text[msg_id]))
+        self.sent_at[msg_id] = sent_at
+        self.kind[msg_id] = kind
+
+        self.messages[msg_id] = {
+            "id": msg_id,
+            "threadId": msg_id,
+            "labelIds": ["INBOX", "CATEGORY_UPDATES"],
+            "snippet": snippet,
+            "historyId": str(self.history_id + 1),
+            "internalDate": str(int(sent_at.timestamp() * 1000)),
+            "sizeEstimate": self._size(payload),
+            "payload": payload,
+        }
+        self.history_id += 1
+        self.history.append((self.history_id, msg_id))
+        # Newest first, like Gmail lists them
+        self.order.insert(0, msg_id)
+        return msg_id
+
+    def _part(self, msg_id, node, part_id):
+        """A MIME node in Gmail's format: small bodies inline as data, named files as attachments."""
+        headers = [{"name": name, "value": value} for name, value in node["headers"]]
+        part = {"partId": part_id, "mimeType": node["mimeType"], "filename": node.get("filename", ""), "headers": headers}
+        if "children" in node:
+            boundary = f"{node['mimeType'].split('/')[1]}_{msg_id}_{part_id or 'root'}"
+            if node["mimeType"].startswith("multipart/"):
+                headers.append({"name": "Content-Type", "value": f'{node["mimeType"]}; boundary="{boundary}"'})
+            else:
+                headers.append({"name": "Content-Type", "value": node["mimeType"]})
+            part["body"] = {"size": 0}
+            prefix = f"{part_id}." if part_id else ""
+            part["parts"] = [self._part(msg_id, child, f"{prefix}{n}") for n, child in enumerate(node["children"])]
+            return part
+
+        data = node["data"]
+        filename = node["filename"]
+        if filename:
+            disposition = "inline" if node["inline"] else "attachment"
+            headers.append({"name": "Content-Type", "value": f'{node["mimeType"]}; name="{filename}"'})
+            headers.append({"name": "Content-Disposition", "value": f'{disposition}; filename="{filename}"'})
+            headers.append({"name": "Content-Transfer-Encoding", "value": "base64"})
+            att_id = f"ANGjdJ{msg_id}_{part_id.replace('.', '_') or 'root'}"
+            self.attachments[(msg_id, att_id)] = data
+            self.with_attachment.add(msg_id)
+            part["body"] = {"attachmentId": att_id, "size": len(data)}
+        else:
+            headers.append({"name": "Content-Type", "value": f"{node['mimeType']}; charset=\"UTF-8\""})
+            headers.append({"name": "Content-Transfer-Encoding", "value": "quoted-printable"})
+            part["body"] = {"size": len(data), "data": _b64(data)}
+        return part
+
+    def _collect_text(self, node, out):
+        if "children" in node:
+            for child in node["children"]:
+                out.extend(value for name, value in child["headers"] if name in ("From", "Subject"))
+                self._collect_text(child, out)
+        elif node["filename"]:
+            out.append(node["filename"])
+        elif node["mimeType"].startswith("text/"):
+            out.append(node["data"].decode("utf-8"))
+
+    def _size(self, part):
+        return part["body"].get("size", 0) + sum(self._size(child) for child in part.get("parts", []))
+
+    def search(self, q: str):
+        """Message ids matching a Gmail search query, newest first."""
+        if not q:
+            return list(self.order)
+        matches = compile_query(q)
+        return [msg_id for msg_id in self.order if matches(self, msg_id)]
+
+
+def _query_time(value: str) -> float:
+    # after:/before: take YYYY/MM/DD (midnight UTC here) or seconds since the epoch
+    if value.isdigit():
+        return float(value)
+    return datetime.strptime(value.replace("-", "/"), "%Y/%m/%d").replace(tzinfo=timezone.utc).timestamp()
+
+
+def compile_query(q: str):
+    """
+    Gmail search subset: words (AND), `OR` and parentheses, "quoted phrases", -negation,
+    after:/before:, from:, subject:, filename:, has:attachment. Returns matches(mailbox, msg_id).
+    """
+    tokens = re.findall(r'\(|\)|-?"[^"]*"|[^\s()]+', q)
+
+    def parse(pos):
+        alternatives = [[]]
+        while pos < len(tokens) and tokens[pos] != ")":
+            token = tokens[pos]
+            if token == "(":
+                node, pos = parse(pos + 1)
+                alternatives[-1].append(node)
+                pos += 1 # ")"
+            elif token == "OR":
+                alternatives.append([])
+                pos += 1
+            else:
+                alternatives[-1].append(term(token))
+                pos += 1
+        return (lambda mailbox, msg_id: any(all(t(mailbox, msg_id) for t in terms) for terms in alternatives)), pos
+
+    def term(token):
+        negate = token.startswith("-") and len(token) > 1
+        token = token[1:] if negate else token
+        key, _, value = token.partition(":")
+        value = value.strip('"').lower()
+        if key == "after" and value:
+            since = _query_time(value)
+            test = lambda mailbox, msg_id: mailbox.sent_at[msg_id].timestamp() >= since
+        elif key == "before" and value:
+            until = _query_time(value)
+            test = lambda mailbox, msg_id: mailbox.sent_at[msg_id].timestamp() < until
+        elif key == "has" and value == "attachment":
+            test = lambda mailbox, msg_id: msg_id in mailbox.with_attachment
+        elif key in ("from", "subject") and value:
+            header = key.capitalize()
+            test = lambda mailbox, msg_id: any(
+                h["name"] == header and value in h["value"].lower() for h in mailbox.messages[msg_id]["payload"]["headers"])
+        elif key == "filename" and value:
+            test = lambda mailbox, msg_id: value in mailbox.search_text[msg_id]
+        else:
+            # Whole words like Gmail ("bill" does not match "billing"); phrases and addresses as text
+            word = token.strip('"').lower()
+            if re.fullmatch(r"\w+", word):
+                test = lambda mailbox, msg_id: word in mailbox.search_words[msg_id]
+            else:
+                test = lambda mailbox, msg_id: word in mailbox.search_text[msg_id]
+        return (lambda mailbox, msg_id: not test(mailbox, msg_id)) if negate else test
+
+    return parse(0)[0]
+
+
+def parse_fields(spec: str) -> dict:
+    """Parses a partial-response mask ("id,payload(headers,parts(body/size))") into a tree."""
+    def parse_list(pos):
+        tree = {}
+        while pos < len(spec):
+            start = pos
+            while pos < len(spec) and spec[pos] not in ",()":
+                pos += 1
+            path = spec[start:pos].strip().split("/")
+            subtree = None
+            if pos < len(spec) and spec[pos] == "(":
+                subtree, pos = parse_list(pos + 1)
+            node = tree
+            for name in path[:-1]:
+                node = node.setdefault(name, {})
+            node[path[-1]] = subtree
+            if pos < len(spec) and spec[pos] == ")":
+                return tree, pos + 1
+            pos += 1 # ","
+        return tree, pos
+    return parse_list(0)[0]
+
+
+def select_fields(value, tree):
+    if tree is None:
+        return value
+    if isinstance(value, list):
+        return [select_fields(item, tree) for item in value]
+    if isinstance(value, dict):
+        return {key: select_fields(value[key], sub) for key, sub in tree.items() if key in value}
+    return value
+
+
+def _error(code, message, status):
+    return code, {"error": {"code": code, "message": message, "errors": [{"message": message, "domain": "global", "reason": status.lower()}], "status": status}}
+
+
+# Gmail quota units per call, for the simulated per-user quota
+QUOTA_UNITS = {"profile": 1, "history": 2, "messages": 5, "attachments": 5, "message": 5}
+
+
+class FakeGmailApi:
+    """
+    Routes Gmail REST calls to a FakeMailbox. Used for plain and batched requests alike.
+    Faults can be injected: `quota` enforces Gmail's per-user units per second (429 past it),
+    `error_rate` / `server_error_rate` fail that share of calls with 429 / 503 at random.
+    """
+
+    def __init__(self, mailbox: FakeMailbox, quota=None, error_rate=0.0, server_error_rate=0.0, seed=0):
+        self.mailbox = mailbox
+        self.calls = 0
+        self.throttled = 0
+        self.server_errors = 0
+        self.quota = quota
+        self.error_rate = error_rate
+        self.server_error_rate = server_error_rate
+        self._random = random.Random(seed)
+        self._tokens = float(quota or 0)
+        self._refilled = time.monotonic()
+        self._listings = {}
+        self._lock = threading.Lock()
+
+    def _fault(self, path):
+        """An injected error response for this call, or None."""
+        with self._lock:
+            if self.quota:
+                now = time.monotonic()
+                self._tokens = min(self.quota, self._tokens + (now - self._refilled) * self.quota)
+                self._refilled = now
+                if "/attachments/" in path:
+                    units = QUOTA_UNITS["attachments"]
+                else:
+                    units = QUOTA_UNITS.get(path.rstrip("/").rsplit("/", 1)[-1], QUOTA_UNITS["message"])
+                if self._tokens < units:
+                    self.throttled += 1
+                    return _error(429, "User-rate limit exceeded", "RESOURCE_EXHAUSTED")
+                self._tokens -= units
+            roll = self._random.random()
+            if roll < self.error_rate:
+                self.throttled += 1
+                return _error(429, "User-rate limit exceeded", "RESOURCE_EXHAUSTED")
+            if roll < self.error_rate + self.server_error_rate:
+                self.server_errors += 1
+                return _error(503, "The service is currently unavailable.", "UNAVAILABLE")
+        return None
+
+    def _search(self, q):
+        # Listing pages come one request at a time; search once per query and mailbox size
+        key = (q, len(self.mailbox.order))
+        with self._lock:
+            ids = self._listings.get(key)
+        if ids is None:
+            ids = self.mailbox.search(q)
+            with self._lock:
+                self._listings = {key: ids}
+        return ids
+
+    def handle(self, method, path, query):
+        with self._lock:
+            self.calls += 1
+        fault = self._fault(path)
+        if fault:
+            return fault
+        status, result = self._route(method, path.rstrip("/"), query)
+        if status == 200 and query.get("fields"):
+            result = select_fields(result, parse_fields(query["fields"]))
+        return status, result
+
+    def _route(self, method, path, query):
+        if method != "GET":
+            return _error(405, "Method not allowed", "METHOD_NOT_ALLOWED")
+
+        m = re.fullmatch(r"/gmail/v1/users/([^/]+)/profile", path)
+        if m:
+            return 200, {"emailAddress": self.mailbox.email_address, "messagesTotal": len(self.mailbox.order),
+                         "historyId": str(self.mailbox.history_id)}
+
+        m = re.fullmatch(r"/gmail/v1/users/([^/]+)/history", path)
+        if m:
+            start_id = int(query.get("startHistoryId") or 0)
+            if start_id < self.mailbox.history_floor:
+                return _error(404, "Requested entity was not found.", "NOT_FOUND")
+            max_results = min(int(query.get("maxResults", 100)), 500)
+            offset = int(query.get("pageToken") or 0)
+            records = [(hid, msg_id) for hid, msg_id in self.mailbox.history if hid > start_id]
+            page = records[offset:offset + max_results]
+            result = {"historyId": str(self.mailbox.history_id)}
+            if page:
+                result["history"] = [{
+                    "id": str(hid),
+                    "messages": [{"id": msg_id, "threadId": msg_id}],
+                    "messagesAdded": [{"message": {"id": msg_id, "threadId": msg_id, "labelIds": ["INBOX"]}}],
+                } for hid, msg_id in page]
+            if offset + max_results < len(records):
+                result["nextPageToken"] = str(offset + max_results)
+            return 200, result
+
+        m = re.fullmatch(r"/gmail/v1/users/([^/]+)/messages", path)
+        if m:
+            max_results = min(int(query.get("maxResults", 100)), 500)
+            offset = int(query.get("pageToken") or 0)
+            ids = self._search(query.get("q", ""))
+            page = ids[offset:offset + max_results]
+            result = {"resultSizeEstimate": len(ids)}
+            if page:
+                result["messages"] = [{"id": msg_id, "threadId": msg_id} for msg_id in page]
+            if offset + max_results < len(ids):
+                result["nextPageToken"] = str(offset + max_results)
+            return 200, result
+
+        m = re.fullmatch(r"/gmail/v1/users/([^/]+)/messages/([^/]+)/attachments/([^/]+)", path)
+        if m:
+            data = self.mailbox.attachments.get((m.group(2), m.group(3)))
+            if data is None:
+                return _error(404, "Requested entity was not found.", "NOT_FOUND")
+            return 200, {"size": len(data), "data": _b64(data)}
+
+        m = re.fullmatch(r"/gmail/v1/users/([^/]+)/messages/([^/]+)", path)
+        if m:
+            message = self.mailbox.messages.get(m.group(2))
+            if message is None:
+                return _error(404, "Requested entity was not found.", "NOT_FOUND")
+            fmt = query.get("format", "full")
+            if fmt == "minimal":
+                return 200, {k: v for k, v in message.items() if k != "payload"}
+            if fmt == "metadata":
+                wanted = query.get("metadataHeaders")
+                headers = [h for h in message["payload"]["headers"] if not wanted or h["name"] in wanted]
+                payload = {k: v for k, v in message["payload"].items() if k not in ("parts", "body")}
+                payload["headers"] = headers
+                return 200, dict(message, payload=payload)
+            if fmt != "full":
+                return _error(400, f"Unsupported format: {fmt}", "INVALID_ARGUMENT")
+            return 200, message
+
+        return _error(404, f"Unknown path {path}", "NOT_FOUND")
+
+
+def _parse_query(url_query):
+    query = {}
+    for key, values in parse_qs(url_query).items():
+        query[key] = values if key == "metadataHeaders" else values[-1]
+    return query
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without this, delayed ACKs add ~40 ms per request
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body: bytes, content_type="application/json; charset=UTF-8"):
+        with self.server.stats_lock:
+            self.server.bytes_sent += len(body)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _count_request(self):
+        server = self.server
+        with server.stats_lock:
+            server.http_requests += 1
+        time.sleep(server.latency)
+
+    def do_GET(self):
+        self._count_request()
+        url = urlsplit(self.path)
+        status, result = self.server.api.handle("GET", url.path, _parse_query(url.query))
+        self._send(status, json.dumps(result).encode("utf-8"))
+
+    def do_POST(self):
+        self._count_request()
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        if urlsplit(self.path).path.rstrip("/") not in ("/batch", "/batch/gmail/v1"):
+            status, result = _error(404, "Unknown path", "NOT_FOUND")
+            self._send(status, json.dumps(result).encode("utf-8"))
+            return
+        self._handle_batch(body)
+
+    def _handle_batch(self, body):
+        content_type = self.headers.get("Content-Type", "")
+        envelope = BytesParser().parsebytes(b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body)
+        parts = envelope.get_payload()
+        if len(parts) > 100:
+            status, result = _error(400, "Too many requests in batch, the limit is 100", "INVALID_ARGUMENT")
+            self._send(status, json.dumps(result).encode("utf-8"))
+            return
+
+        boundary = "batch_fake_gmail"
+        chunks = []
+        for part in parts:
+            request_line = part.get_payload().splitlines()[0]
+            method, target, _ = request_line.split(" ", 2)
+            url = urlsplit(target)
+            time.sleep(self.server.item_latency)
+            status, result = self.server.api.handle(method, url.path, _parse_query(url.query))
+            payload = json.dumps(result)
+            content_id = part["Content-ID"] or "<item>"
+            chunks.append(
+                f"--{boundary}\r\n"
+                "Content-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id.strip('<>')}>\r\n\r\n"
+                f"HTTP/1.1 {status} {self.responses.get(status, ('',))[0]}\r\n"
+                "Content-Type: application/json; charset=UTF-8\r\n"
+                f"Content-Length: {len(payload.encode('utf-8'))}\r\n\r\n"
+                f"{payload}\r\n"
+            )
+        chunks.append(f"--{boundary}--\r\n")
+        self._send(200, "".join(chunks).encode("utf-8"), content_type=f"multipart/mixed; boundary={boundary}")
+
+
+class FakeGmailServer:
+    """Runs the fake API on a background thread. `url` is the value for GMAIL_API_ROOT_URL."""
+
+    def __init__(self, mailbox: FakeMailbox = None, latency=0.05, item_latency=0.001, host="127.0.0.1", port=0,
+                 quota=None, error_rate=0.0, server_error_rate=0.0, seed=0):
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.api = FakeGmailApi(mailbox or FakeMailbox(), quota, error_rate, server_error_rate, seed)
+        self.httpd.latency = latency
+        self.httpd.item_latency = item_latency
+        self.httpd.http_requests = 0
+        self.httpd.bytes_sent = 0
+        self.httpd.stats_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    @property
+    def http_requests(self) -> int:
+        return self.httpd.http_requests
+
+    @property
+    def bytes_sent(self) -> int:
+        return self.httpd.bytes_sent
+
+    @property
+    def api_calls(self) -> int:
+        return self.httpd.api.calls
+
+    @property
+    def throttled(self) -> int:
+        """Calls answered with an injected 429."""
+        return self.httpd.api.throttled
+
+    def reset_stats(self):
+        with self.httpd.stats_lock:
+            self.httpd.http_requests = 0
+            self.httpd.bytes_sent = 0
+        self.httpd.api.calls = 0
+        self.httpd.api.throttled = 0
+        self.httpd.api.server_errors = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local fake Gmail API")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--email", default="me@example.com", help="address of the mailbox (one server per account)")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds slept per HTTP request")
+    parser.add_argument("--corpus", choices=sorted(CORPORA), default="invoices", help="mix of message shapes")
+    parser.add_argument("--attachment-kb", type=int, default=None, help="padding added to each PDF attachment")
+    parser.add_argument("--quota", type=float, default=None, help="quota units per second, 429 past it (Gmail: 250)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of calls answered 429 at random")
+    parser.add_argument("--server-error-rate", type=float, default=0.0, help="share of calls answered 503 at random")
+    args = parser.parse_args()
+
+    mailbox = FakeMailbox(args.messages, args.email, corpus=args.corpus, attachment_kb=args.attachment_kb)
+    server = FakeGmailServer(mailbox, latency=args.latency, port=args.port, quota=args.quota,
+                             error_rate=args.error_rate, server_error_rate=args.server_error_rate).start()
+    print(f"Fake Gmail API with {args.messages} '{args.corpus}' messages for {args.email} at {server.url} (GMAIL_API_ROOT_URL)", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
@@ -96,7 +96,13 @@ function AppContent() {
     setScanResults([])
 
     try {
-      const data = await api.scanInvoices(startDate, endDate)
+      // Runs as a background job; the counters update while emails are processed
+      const job = await api.startScanJob(startDate, endDate)
+      await api.watchScanJob(job.id, (info) => setStats({
+        totalScanned: info.counts.listed || 0,
+        found: info.counts.saved || 0
+      }))
+      const data = await api.getScanJobResult(job.id)
       if (data && data.invoices) {
         setStats({
           totalScanned: data.total_emails_scanned,
@@ -1,13 +1,67 @@
 const API_URL = 'http://127.0.0.1:8000';
 
-export const scanInvoices = async (startDate, endDate) => {
-    const response = await fetch(`${API_URL}/scan?start_date=${startDate}&end_date=${endDate}`);
+// incremental: only scan mail added since the last sync (falls back to the date range)
+// refresh: download emails again even if they are already in history
+export const scanInvoices = async (startDate, endDate, incremental = false, refresh = false) => {
+    const params = new URLSearchParams({ start_date: startDate, end_date: endDate });
+    if (incremental) params.set('incremental', 'true');
+    if (refresh) params.set('refresh', 'true');
+    const response = await fetch(`${API_URL}/scan?${params}`);
     if (!response.ok) {
         throw new Error('Scan failed');
     }
     return response.json();
 };
 
+// Background scan: starts a job and returns its info ({ id, status, counts, timings, ... })
+export const startScanJob = async (startDate, endDate, incremental = false, refresh = false) => {
+    const response = await fetch(`${API_URL}/scan/jobs`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ start_date: startDate, end_date: endDate, incremental, refresh }),
+    });
+    if (!response.ok) {
+        throw new Error('Scan failed');
+    }
+    return response.json();
+};
+
+export const getScanJobResult = async (jobId) => {
+    const response = await fetch(`${API_URL}/scan/jobs/${jobId}/result`);
+    if (!response.ok) {
+        throw new Error('Scan failed');
+    }
+    return response.json();
+};
+
+export const cancelScanJob = async (jobId) => {
+    const response = await fetch(`${API_URL}/scan/jobs/${jobId}/cancel`, { method: 'POST' });
+    if (!response.ok) {
+        throw new Error('Failed to cancel scan');
+    }
+    return response.json();
+};
+
+// Follows a job's progress events; onProgress(info) is called while it runs.
+// Resolves with the final info once the job is done or cancelled, rejects if it failed.
+export const watchScanJob = (jobId, onProgress) => new Promise((resolve, reject) => {
+    const source = new EventSource(`${API_URL}/scan/jobs/${jobId}/events`);
+    const finish = (settle) => (event) => {
+        source.close();
+        settle(event.data ? JSON.parse(event.data) : null);
+    };
+    source.addEventListener('progress', (event) => onProgress && onProgress(JSON.parse(event.data)));
+    source.addEventListener('done', finish(resolve));
+    source.addEventListener('cancelled', finish(resolve));
+    source.addEventListener('failed', finish((info) => reject(new Error(info.error || 'Scan failed'))));
+    source.onerror = () => {
+        // The server ends the stream after the final event; anything else is a lost connection
+        if (source.readyState === EventSource.CLOSED) return;
+        source.close();
+        reject(new Error('Lost connection to the scan'));
+    };
+});
+
 export const getInvoices = async () => {
     const response = await fetch(`${API_URL}/invoices`);
     if (!response.ok) {
@@ -16,6 +70,35 @@ export const getInvoices = async () => {
     return response.json();
 };
 
+// Server-side filtered page. params: { limit, cursor, sort, order, status, label,
+// start_date, end_date, min_amount, max_amount, q }
+export const getInvoicesPage = async (params = {}) => {
+    const query = new URLSearchParams();
+    Object.entries(params).forEach(([key, value]) => {
+        if (value !== undefined && value !== null && value !== '') {
+            query.append(key, value);
+        }
+    });
+    const response = await fetch(`${API_URL}/invoices?${query.toString()}`);
+    if (!response.ok) {
+        throw new Error('Failed to fetch history');
+    }
+    return {
+        items: await response.json(),
+        total: Number(response.headers.get('X-Total-Count') || 0),
+        nextCursor: response.headers.get('X-Next-Cursor'),
+    };
+};
+
+export const searchInvoices = async (q, limit = 50) => {
+    const params = new URLSearchParams({ q, limit });
+    const response = await fetch(`${API_URL}/invoices/search?${params.toString()}`);
+    if (!response.ok) {
+        throw new Error('Search failed');
+    }
+    return response.json();
+};
+
 export const updateInvoice = async (id, data) => {
     const response = await fetch(`${API_URL}/invoices/${id}`, {
         method: 'PUT',
@@ -0,0 +1,158 @@
+import os
+import sys
+import shutil
+import contextlib
+from collections import Counter
+from datetime import date
+
+# Add project root
+sys.path.append(os.getcwd())
+
+from fake_gmail_server import FakeGmailServer, FakeMailbox
+from backend.services import gmail_service as gmail_module
+from backend.services.gmail_service import GmailService, ScanContext
+from backend.services.gmail_account_service import GmailAccountService
+from backend.services.attachment_store import AttachmentStore
+from backend.services.gmail_rate_limiter import GmailRateLimiter
+
+MESSAGE_COUNT = 96
+STORE_DIR = "backend/static/verify_fake_gmail"
+# What GmailService.scan_invoices asks Gmail for
+SCAN_QUERY = "(invoice OR receipt OR bill OR חשבונית OR קבלה) after:2020/01/01 before:2030/01/01"
+
+
+def quiet(fn):
+    # The scan prints a line per generated PDF; keep the output readable
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        return fn()
+
+
+def scan(mailbox, start_date, end_date, **server_options):
+    server = FakeGmailServer(mailbox, latency=0.002, **server_options).start()
+    gmail_module.GMAIL_API_ROOT_URL = server.url
+    try:
+        result = quiet(lambda: GmailService().scan_invoices(start_date, end_date))
+    finally:
+        server.stop()
+    return result, server
+
+
+def verify_realistic_corpus(mailbox):
+    result, _ = scan(mailbox, date(2020, 1, 1), date(2030, 1, 1))
+    found = Counter(mailbox.kind[inv.id] for inv in result.invoices)
+    print(f"Found by kind: {dict(found)}")
+
+    for kind in ("pdf", "forward", "octet_pdf", "pdf_only", "hebrew", "html", "inline_image"):
+        expected = sum(1 for msg_id in mailbox.order if mailbox.kind[msg_id] == kind)
+        assert found[kind] == expected, f"{kind}: found {found[kind]} of {expected}"
+    stored = {inv.attachment_sha256 for inv in result.invoices if mailbox.kind[inv.id] == "resend"}
+    originals = {inv.attachment_sha256 for inv in result.invoices if mailbox.kind[inv.id] == "pdf"}
+    assert stored <= originals, "a resent PDF should reuse the blob of the original"
+    # Gmail matches words in addresses too: a newsletter from invoice@ gets through the query
+    let_through = sum(1 for msg_id in mailbox.search(SCAN_QUERY) if mailbox.kind[msg_id] == "newsletter")
+    assert found["newsletter"] == let_through, f"newsletters: found {found['newsletter']} of {let_through}"
+    print(f"OK: {result.invoices_found} invoices from {result.total_emails_scanned} matching emails")
+
+
+def verify_query_filters(mailbox):
+    hits = set(mailbox.search(SCAN_QUERY))
+    kinds = Counter(mailbox.kind[msg_id] for msg_id in mailbox.order if msg_id not in hits)
+    assert set(kinds) == {"newsletter"}, f"only newsletters should be left out, not {dict(kinds)}"
+    assert set(mailbox.search("has:attachment")) == mailbox.with_attachment
+    assert not set(mailbox.search("invoice -has:attachment")) & mailbox.with_attachment
+    assert all(mailbox.kind[msg_id] == "hebrew" for msg_id in mailbox.search("חשבונית"))
+    assert all(mailbox.kind[msg_id] == "resend" for msg_id in mailbox.search('subject:"reminder"'))
+    print(f"OK: query left out {sum(kinds.values())} newsletters, operators behave")
+
+
+def verify_date_range(mailbox):
+    # Six hours apart from 2025-01-01: two days hold eight messages, one a newsletter
+    result, _ = scan(mailbox, date(2025, 1, 3), date(2025, 1, 5))
+    sent = [mailbox.sent_at[inv.id] for inv in result.invoices]
+    assert sent and all(date(2025, 1, 3) <= s.date() < date(2025, 1, 5) for s in sent), sent
+    print(f"OK: {len(sent)} invoices between 2025-01-03 and 2025-01-05")
+
+
+def verify_injected_errors(mailbox):
+    result, server = scan(mailbox, date(2020, 1, 1), date(2030, 1, 1), error_rate=0.1, server_error_rate=0.05, seed=7)
+    expected = len(mailbox.search(SCAN_QUERY))
+    assert server.throttled > 0
+    assert not result.failed_emails, result.failed_emails
+    assert result.invoices_found == expected, f"found {result.invoices_found} of {expected}"
+    print(f"OK: {server.throttled} injected 429s and {server.httpd.api.server_errors} 503s retried, "
+          f"all {expected} invoices found")
+
+
+def verify_resumed_scan(mailbox):
+    # Cancelled after a few invoices; the next scan of the range does only what is left
+    whole = {inv.id for inv in scan(mailbox, date(2020, 1, 1), date(2030, 1, 1))[0].invoices}
+    server = FakeGmailServer(mailbox, latency=0.002).start()
+    gmail_module.GMAIL_API_ROOT_URL = server.url
+    checkpoints = gmail_module.scan_checkpoint_service
+    try:
+        first = ScanContext()
+
+        def on_invoice(invoice):
+            first.finished([invoice.id])
+            if first.counts["built"] >= 10:
+                first.cancel()
+        first.on_invoice = on_invoice
+        done = quiet(lambda: GmailService().scan_invoices(date(2020, 1, 1), date(2030, 1, 1), scan=first))
+        (state,) = checkpoints._load().values()
+        assert "processed_ids" not in state and len(state["pending_ids"]) < len(whole), state
+        second = quiet(lambda: GmailService().scan_invoices(date(2020, 1, 1), date(2030, 1, 1)))
+    finally:
+        server.stop()
+    first_ids = {inv.id for inv in done.invoices}
+    second_ids = {inv.id for inv in second.invoices}
+    assert not first_ids & second_ids, "the resumed scan did finished messages again"
+    assert first_ids | second_ids == whole, f"{len(whole - first_ids - second_ids)} invoices lost between the two scans"
+    assert not checkpoints._load(), "the checkpoint should be gone once the range is done"
+    print(f"OK: cancelled after {len(first_ids)} invoices, {len(state['pending_ids'])} pending in the checkpoint; "
+          f"the next scan found the other {len(second_ids)}")
+
+
+def verify_removed_primary():
+    # A signed-out primary account is left out of a default scan rather than signed in again from a job
+    accounts_dir = os.path.join(STORE_DIR, "accounts")
+    os.makedirs(accounts_dir, exist_ok=True)
+    server = FakeGmailServer(FakeMailbox(4, email_address="other@example.com"), latency=0).start()
+    gmail_module.GMAIL_API_ROOT_URL = None
+    try:
+        primary = GmailService(token_file=os.path.join(accounts_dir, "token.json"))
+        with open(primary.token_file, "w") as token:
+            token.write("{}")
+        primary.email = "me@example.com"
+        accounts = GmailAccountService(tokens_dir=os.path.join(accounts_dir, "tokens"), primary=primary)
+        other = quiet(lambda: accounts.add(root_url=server.url))
+        assert accounts.services()[0] is primary and len(accounts.services()) == 2
+
+        accounts.remove("me@example.com")
+        assert [service.email for service in accounts.services()] == [other], "a removed primary is still scanned"
+        accounts.remove(other)
+        try:
+            accounts.services()
+            raise AssertionError("a scan with no account signed in should be refused")
+        except ValueError:
+            pass
+    finally:
+        server.stop()
+    print("OK: a removed primary account is skipped; with no account signed in the scan is refused")
+
+
+if __name__ == "__main__":
+    gmail_module.attachment_store = AttachmentStore(root=os.path.join(STORE_DIR, "blobs"), files_dir=STORE_DIR)
+    gmail_module.scan_checkpoint_service.checkpoints_file = os.path.join(STORE_DIR, "checkpoints.json")
+    # Fast retries: the injected errors are not a real quota
+    gmail_module.gmail_rate_limiter = GmailRateLimiter(units_per_second=1e9)
+    mailbox = FakeMailbox(MESSAGE_COUNT, corpus="realistic")
+    try:
+        verify_query_filters(mailbox)
+        verify_realistic_corpus(mailbox)
+        verify_date_range(mailbox)
+        verify_injected_errors(mailbox)
+        verify_resumed_scan(mailbox)
+        verify_removed_primary()
+    finally:
+        shutil.rmtree(STORE_DIR, ignore_errors=True)
+    print("All fake Gmail checks passed.")
@@ -0,0 +1,136 @@
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import time
+
+# Add project root
+sys.path.append(os.getcwd())
+
+from backend.services.storage_backends import JsonStorageBackend, SqliteStorageBackend, import_json_file
+
+
+def record(invoice_id, status="Pending"):
+    return {
+        "id": invoice_id,
+        "filename": f"{invoice_id}.pdf",
+        "sender_email": "billing@example.com",
+        "subject": "Invoice",
+        "invoice_date": "2026-01-01",
+        "total_amount": 100.0,
+        "status": status,
+    }
+
+
+def verify_truncated_tail(tmp_dir):
+    db_file = os.path.join(tmp_dir, "invoices.json")
+    backend = JsonStorageBackend(db_file)
+    backend.put("a", record("a"))
+    backend.put("b", record("b"))
+    backend.patch("a", {"status": "Processed"})
+    backend.delete("b")
+    backend.put("c", record("c"))
+
+    # The snapshot is never rewritten for single edits
+    with open(db_file, encoding="utf-8") as f:
+        assert json.load(f)["invoices"] == {}, "snapshot should be untouched before compaction"
+
+    # Simulate a crash in the middle of appending the next record
+    good_size = os.path.getsize(backend.journal_file)
+    torn = json.dumps({"op": "put", "id": "d", "record": record("d")})
+    with open(backend.journal_file, "a", encoding="utf-8") as f:
+        f.write(torn[: len(torn) // 2])
+
+    recovered = JsonStorageBackend(db_file)
+    data = recovered.load_all()
+    assert sorted(data) == ["a", "c"], f"unexpected ids after replay: {sorted(data)}"
+    assert data["a"]["status"] == "Processed"
+    assert "d" not in data, "torn record must be dropped"
+    assert os.path.getsize(recovered.journal_file) == good_size, "torn tail should be truncated"
+
+    # Appending after recovery must produce a clean journal
+    recovered.put("e", record("e"))
+    assert sorted(JsonStorageBackend(db_file).load_all()) == ["a", "c", "e"]
+    print("OK: truncated trailing record dropped, earlier entries replayed")
+
+
+def verify_garbage_tail(tmp_dir):
+    db_file = os.path.join(tmp_dir, "invoices.json")
+    backend = JsonStorageBackend(db_file)
+    backend.put("a", record("a"))
+    with open(backend.journal_file, "ab") as f:
+        f.write(b"\x00\x00{not json}\n")
+
+    data = JsonStorageBackend(db_file).load_all()
+    assert sorted(data) == ["a"], f"unexpected ids after replay: {sorted(data)}"
+    print("OK: corrupt trailing line dropped")
+
+
+def verify_corrupt_middle(tmp_dir):
+    db_file = os.path.join(tmp_dir, "invoices.json")
+    backend = JsonStorageBackend(db_file)
+    backend.put("a", record("a"))
+    backend.put("b", record("b"))
+    backend.patch("a", {"status": "Processed"})
+
+    # Damage the first entry's line; the entries after it are intact
+    with open(backend.journal_file, "rb") as f:
+        lines = f.readlines()
+    with open(backend.journal_file, "wb") as f:
+        f.write(b"\x00\x00{not json}\n" + b"".join(lines[1:]))
+    size = os.path.getsize(backend.journal_file)
+
+    data = JsonStorageBackend(db_file).load_all()
+    assert sorted(data) == ["b"], f"writes after a corrupt line were lost: {sorted(data)}"
+    assert os.path.getsize(backend.journal_file) == size, "a corrupt line in the middle must not truncate the journal"
+    print("OK: corrupt line in the middle skipped, later entries replayed")
+
+
+def verify_import_read_only(tmp_dir):
+    # A legacy (v1) snapshot plus a journal, as an old install leaves them
+    db_file = os.path.join(tmp_dir, "invoices.json")
+    with open(db_file, "w", encoding="utf-8") as f:
+        json.dump({"a": record("a"), "b": record("b")}, f)
+    journal_file = os.path.join(tmp_dir, "invoices.journal")
+    with open(journal_file, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"op": "delete", "id": "b"}) + "\n")
+        f.write(json.dumps({"op": "put", "id": "c", "record": record("c")}) + "\n")
+        f.write('{"op": "put", "id": "d", "rec')
+    before = {path: open(path, "rb").read() for path in (db_file, journal_file)}
+
+    target = SqliteStorageBackend(os.path.join(tmp_dir, "invoices.db"))
+    assert import_json_file(target, db_file) == 2
+    assert sorted(target.load_all()) == ["a", "c"]
+    after = {path: open(path, "rb").read() for path in (db_file, journal_file)}
+    assert after == before, "the import must not upgrade, compact or truncate its source"
+    print("OK: v1 snapshot and journal imported without touching them")
+
+
+def verify_compaction(tmp_dir):
+    db_file = os.path.join(tmp_dir, "invoices.json")
+    backend = JsonStorageBackend(db_file, compact_bytes=2048)
+    for i in range(50):
+        backend.put(f"inv{i}", record(f"inv{i}"))
+
+    # Compaction runs in a background thread
+    deadline = time.time() + 10
+    while time.time() < deadline and (backend._compacting or backend._journal_size() >= 2048):
+        time.sleep(0.05)
+
+    with open(db_file, encoding="utf-8") as f:
+        snapshot = json.load(f)["invoices"]
+    assert len(snapshot) >= 40, f"snapshot should hold the compacted records, has {len(snapshot)}"
+    assert sorted(JsonStorageBackend(db_file).load_all()) == sorted(f"inv{i}" for i in range(50))
+    print(f"OK: journal compacted into snapshot ({len(snapshot)} items), nothing lost")
+
+
+if __name__ == "__main__":
+    for check in (verify_truncated_tail, verify_garbage_tail, verify_corrupt_middle, verify_import_read_only, verify_compaction):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            check(tmp_dir)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    print("All journal recovery checks passed.")